@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+"""
+This script runs the benchmarks of the MultiCellDB scripts on a corpus
+generated by corpus.py, against a local ermrest stub (ermrest_stub.py).
+
+Each script is run end to end in its own process. For every script the report
+records the wall time of each run, the median and the best time, the peak RSS
+of the script process, and the throughput (input MB/s and files/s).
+With the profile option, an additional run of each script under cProfile
+gives the time spent in the main phases of the script.
+
+Parameters:
+
+    - corpus: the corpus directory
+    - work: the directory where the outputs of the scripts are written
+    - scripts: the comma separated list of the scripts to run (default all)
+    - runs: the number of timed runs of each script
+    - profile: time the phases of the scripts with cProfile
+    - report: the JSON file where the report is written
+    - baseline: a previous report; a script slower than its baseline
+      by more than the threshold is reported as a regression
+    - threshold: the tolerated slowdown, in percents (default 10)
+    - xml2csv-args: additional arguments of xml2csv.py (e.g. "--single-pass --workers 4")
+
+Usage:
+    python bench.py -c <corpus_dir> -w <work_dir> [-s scripts] [-n runs] [--profile] [-r report.json] [-b baseline.json] [-t threshold]
+
+"""
+
+import sys
+import os
+import shutil
+import time
+import json
+import subprocess
+import pstats
+from optparse import OptionParser
+
+SCRIPTS = ['xml2csv', 'xml2sql', 'json2sql', 'json2csv', 'xsd2sql', 'xml2xml']
+
+"""
+The functions timing the phases of each script, when profiled.
+A function is one of the script, or is given with the end of the path of its module.
+"""
+PHASES = {
+    'xml2csv': [('ermrest', ['get_schema', 'load']), ('infer', ['process_input']), ('rows', ['engine.py:load', 'stream_input', 'parallel_input']), ('csv', ['insert_csv_data']), ('bag', ['makeBag', 'zipBag'])],
+    'xml2sql': [('parse', ['ElementTree.py:parse']), ('events', ['readers.py:events']), ('infer', ['engine.py:infer']), ('rows', ['engine.py:load']), ('sql', ['create_sql_table', 'insert_sql_data'])],
+    'json2sql': [('parse', ['json/__init__.py:load']), ('events', ['readers.py:events']), ('infer', ['engine.py:infer']), ('rows', ['engine.py:load']), ('sql', ['create_sql_table', 'insert_sql_data'])],
+    'json2csv': [('parse', ['json/__init__.py:load']), ('events', ['readers.py:events']), ('infer', ['engine.py:infer']), ('rows', ['engine.py:load']), ('csv', ['insert_csv_data'])],
+    'xsd2sql': [('parse', ['process_file']), ('tables', ['getTables', 'getFields']), ('sort', ['sortTablesDefinitions']), ('sql', ['create_sql_table'])],
+    'xml2xml': [('parse', ['ElementTree.py:parse']), ('thumbnails', ['process_element']), ('write', ['ElementTree.py:write'])],
+}
+
+"""
+The input directory of each script, in the corpus
+"""
+INPUTS = {'xml2csv': 'xml', 'xml2sql': 'xml', 'json2sql': 'json', 'json2csv': 'json', 'xsd2sql': 'xsd', 'xml2xml': 'xml'}
+
+parser = OptionParser()
+parser.header = {}
+parser.add_option('-c', '--corpus', action='store', dest='corpus', type='string', help='Corpus directory')
+parser.add_option('-w', '--work', action='store', dest='work', type='string', help='Work directory')
+parser.add_option('-s', '--scripts', action='store', dest='scripts', type='string', default=','.join(SCRIPTS), help='Comma separated scripts to run')
+parser.add_option('-n', '--runs', action='store', dest='runs', type='int', default=3, help='Number of timed runs')
+parser.add_option('--profile', action='store_true', dest='profile', default=False, help='Time the phases with cProfile')
+parser.add_option('-r', '--report', action='store', dest='report', type='string', help='Report file')
+parser.add_option('-b', '--baseline', action='store', dest='baseline', type='string', help='Baseline report file')
+parser.add_option('-t', '--threshold', action='store', dest='threshold', type='float', default=10.0, help='Tolerated slowdown in percents')
+parser.add_option('--xml2csv-args', action='store', dest='xml2csv_args', type='string', default='', help='Additional xml2csv.py arguments')
+
+(options, args) = parser.parse_args()
+
+if not options.corpus:
+    print 'ERROR: Missing corpus directory'
+    sys.exit(1)
+
+if not options.work:
+    print 'ERROR: Missing work directory'
+    sys.exit(1)
+
+scripts = options.scripts.split(',')
+for script in scripts:
+    if script not in SCRIPTS:
+        sys.stderr.write('Unknown script: %s.\n' % script)
+        sys.exit(1)
+
+corpus = os.path.abspath(options.corpus)
+work = os.path.abspath(options.work)
+sbin = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sbin')
+python = sys.executable
+
+"""
+Get the size of the files of a directory
+"""
+def get_input_size(path):
+    size = 0
+    files = 0
+    for f in os.listdir(path):
+        size += os.path.getsize(os.path.join(path, f))
+        files += 1
+    return size, files
+
+"""
+Write a JSON configuration file
+"""
+def write_config(path, cfg):
+    out = open(path, 'w')
+    out.write('%s\n' % json.dumps(cfg, indent=4))
+    out.close()
+
+"""
+Start the ermrest stub, returning its process and its port
+"""
+def start_stub():
+    proc = subprocess.Popen([python, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ermrest_stub.py'), '-s', os.path.join(corpus, 'schema.json')], stdout=subprocess.PIPE)
+    port = int(proc.stdout.readline())
+    return proc, port
+
+"""
+Prepare the output directory of a script, returning the arguments of the script
+"""
+def prepare(script, port):
+    out = os.path.join(work, script)
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    os.makedirs(out)
+    if script == 'xml2csv':
+        config = os.path.join(work, 'xml2csv.json')
+        write_config(config, {'host': '127.0.0.1:%d' % port, 'protocol': 'http', 'catalog': 1, 'schema': 'multicelldb', 'xml': os.path.join(corpus, 'xml'), 'thumbnail': os.path.join(corpus, 'thumbnails'), 'thumbnail_url': '/thumbnails', 'csv': out})
+        return ['-c', config] + options.xml2csv_args.split()
+    elif script == 'xml2sql':
+        return ['-i', os.path.join(corpus, 'xml'), '-o', 'out.sql', '-s', 'multicelldb', '-r', 'MultiCellDS', '-t', 'description', '-p', 'thumbnail']
+    elif script == 'json2sql':
+        return ['-i', os.path.join(corpus, 'json'), '-o', 'out.sql', '-s', 'multicelldb', '-r', 'MultiCellDS']
+    elif script == 'json2csv':
+        return ['-i', os.path.join(corpus, 'json'), '-o', out]
+    elif script == 'xsd2sql':
+        config = os.path.join(work, 'xsd2sql.json')
+        write_config(config, {'input': os.path.join(corpus, 'xsd'), 'json': 'xsd.json', 'schema': 'multicelldb', 'root': 'root.xsd', 'tablesDefinitions': 'tablesDefinitions.json', 'tables': 'tables.json', 'sql': 'out.sql', 'annotation': 'annotation.sql', 'topTable': 'MultiCellDS', 'thumbnail': 'MultiCellDS'})
+        return ['-c', config]
+    elif script == 'xml2xml':
+        return ['-i', os.path.join(corpus, 'xml'), '-o', out, '-u', '/thumbnails', '-p', os.path.join(corpus, 'thumbnails'), '-t', 'MultiCellDS', '-a', 'thumbnail']
+
+"""
+Run a command, returning its exit status, its wall time and its peak RSS in KB
+"""
+def run(command, cwd, log):
+    out = open(log, 'a')
+    start = time.time()
+    proc = subprocess.Popen(command, cwd=cwd, stdout=out, stderr=subprocess.STDOUT)
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    out.close()
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1, elapsed, rusage.ru_maxrss
+
+"""
+Get the time of the phases of a script from its profile.
+The functions with the same name nest (a method called by a function), so only
+the largest cumulative time of the functions matching a name is counted.
+"""
+def get_phases(script, path, profile):
+    stats = pstats.Stats(profile).stats
+    phases = {}
+    for phase,functions in PHASES[script]:
+        phases[phase] = 0.0
+        for function in functions:
+            module = path
+            if ':' in function:
+                module,function = function.split(':')
+            times = [ct for (filename, line, name),(cc, nc, tt, ct, callers) in stats.iteritems() if name == function and filename.endswith(module)]
+            if len(times) > 0:
+                phases[phase] += max(times)
+    return phases
+
+"""
+Benchmark a script
+"""
+def benchmark(script, port):
+    size, files = get_input_size(os.path.join(corpus, INPUTS[script]))
+    path = os.path.join(sbin, '%s.py' % script)
+    log = os.path.join(work, '%s.log' % script)
+    if os.path.exists(log):
+        os.remove(log)
+    result = {'input_bytes': size, 'input_files': files, 'runs': [], 'peak_rss_kb': 0, 'status': 0}
+    for i in range(options.runs):
+        arguments = prepare(script, port)
+        status, elapsed, rss = run([python, path] + arguments, os.path.join(work, script), log)
+        if status != 0:
+            result['status'] = status
+            return result
+        result['runs'].append(elapsed)
+        result['peak_rss_kb'] = max(result['peak_rss_kb'], rss)
+    runs = sorted(result['runs'])
+    result['wall'] = runs[len(runs) / 2]
+    result['best'] = runs[0]
+    result['mb_per_s'] = size / 1024.0 / 1024.0 / result['wall']
+    result['files_per_s'] = files / result['wall']
+    if options.profile:
+        arguments = prepare(script, port)
+        profile = os.path.join(work, '%s.prof' % script)
+        status, elapsed, rss = run([python, '-m', 'cProfile', '-o', profile, path] + arguments, os.path.join(work, script), log)
+        if status == 0:
+            result['phases'] = get_phases(script, path, profile)
+    return result
+
+"""
+Compare the results with a baseline report, returning the regressions
+"""
+def compare(report, baseline):
+    regressions = []
+    for script,result in report['scripts'].iteritems():
+        previous = baseline['scripts'].get(script)
+        if previous == None or 'wall' not in previous or 'wall' not in result:
+            continue
+        ratio = result['wall'] / previous['wall']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + options.threshold / 100.0:
+            regressions.append((script, ratio))
+    return regressions
+
+if not os.path.exists(work):
+    os.makedirs(work)
+stub, port = start_stub()
+report = {'corpus': corpus, 'python': python, 'xml2csv_args': options.xml2csv_args, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'scripts': {}}
+try:
+    for script in scripts:
+        report['scripts'][script] = benchmark(script, port)
+finally:
+    stub.terminate()
+    stub.wait()
+
+regressions = []
+if options.baseline:
+    f = open(options.baseline, 'r')
+    regressions = compare(report, json.load(f))
+    f.close()
+
+if options.report:
+    write_config(options.report, report)
+
+print '%-10s %10s %10s %12s %10s %10s' % ('script', 'wall (s)', 'best (s)', 'peak RSS MB', 'MB/s', 'files/s')
+failed = False
+for script in scripts:
+    result = report['scripts'][script]
+    if result['status'] != 0:
+        print '%-10s FAILED with status %d, see %s' % (script, result['status'], os.path.join(work, '%s.log' % script))
+        failed = True
+        continue
+    print '%-10s %10.3f %10.3f %12.1f %10.2f %10.1f' % (script, result['wall'], result['best'], result['peak_rss_kb'] / 1024.0, result['mb_per_s'], result['files_per_s'])
+    for phase,functions in PHASES[script]:
+        if 'phases' in result:
+            print '%-10s   %-20s %10.3f' % ('', phase, result['phases'][phase])
+for script,ratio in regressions:
+    print 'REGRESSION: %s is %.1f%% slower than the baseline' % (script, (ratio - 1) * 100)
+if failed or len(regressions) > 0:
+    sys.exit(1)
+sys.exit(0)
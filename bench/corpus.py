@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+"""
+This script generates a synthetic MultiCellDS-like corpus for the benchmarks.
+
+Parameters:
+
+    - output: the directory where the corpus will be generated
+    - files: the number of XML (and JSON) files
+    - width: the number of cells of a cell population
+    - depth: the number of nested phenotype levels of a cell
+    - repeat: the number of repeated sibling leaves (tags, keywords)
+    - types: the number of additional XSD complex types
+    - seed: the seed of the random values
+
+The output directory will contain:
+
+    - xml: the XML files
+    - json: the JSON files, with the same content as the XML files
+    - xsd: the XSD root file (root.xsd) describing the XML files
+    - thumbnails: a thumbnail for every other XML file
+    - schema.json: the ermrest schema introspection of the tables
+
+Usage:
+    python corpus.py -o <output_dir> [-f files] [-w width] [-d depth] [-r repeat] [-t types] [-s seed]
+
+"""
+
+import sys
+import os
+import shutil
+import random
+import json
+from optparse import OptionParser
+from xml.sax.saxutils import escape, quoteattr
+
+parser = OptionParser()
+parser.header = {}
+parser.add_option('-o', '--output', action='store', dest='output', type='string', help='Output directory')
+parser.add_option('-f', '--files', action='store', dest='files', type='int', default=10, help='Number of XML and JSON files')
+parser.add_option('-w', '--width', action='store', dest='width', type='int', default=100, help='Number of cells of a population')
+parser.add_option('-d', '--depth', action='store', dest='depth', type='int', default=2, help='Number of nested phenotype levels')
+parser.add_option('-r', '--repeat', action='store', dest='repeat', type='int', default=2, help='Number of repeated sibling leaves')
+parser.add_option('-t', '--types', action='store', dest='types', type='int', default=0, help='Number of additional XSD types')
+parser.add_option('-s', '--seed', action='store', dest='seed', type='int', default=1, help='Seed of the random values')
+
+(options, args) = parser.parse_args()
+
+if not options.output:
+    print 'ERROR: Missing output directory'
+    sys.exit(1)
+
+"""
+The tables of the corpus, with their columns and ermrest types
+"""
+def getTables(depth):
+    tables = [
+        ('MultiCellDS', [('thumbnail', 'text'), ('version', 'text'), ('type', 'text')]),
+        ('metadata', [('description', 'text'), ('keywords', 'text'), ('MultiCellDS_id', 'int4')]),
+        ('current_time', [('units', 'text'), ('current_time', 'float8'), ('metadata_id', 'int4')]),
+        ('cellular_information', [('MultiCellDS_id', 'int4')]),
+        ('cell_populations', [('cellular_information_id', 'int4')]),
+        ('cell_population', [('type', 'text'), ('count', 'int4'), ('cell_populations_id', 'int4')]),
+        ('cell', [('ID', 'int4'), ('volume', 'float8'), ('tag', 'text'), ('alive', 'boolean'), ('cell_population_id', 'int4')]),
+        ('position', [('units', 'text'), ('position', 'text'), ('cell_id', 'int4')]),
+    ]
+    parent = 'cell'
+    for level in range(1, depth + 1):
+        table = 'phenotype_%d' % level
+        tables.append((table, [('name', 'text'), ('value', 'float8'), ('updated', 'timestamptz'), ('%s_id' % parent, 'int4')]))
+        parent = table
+    tables.append(('variables', [('MultiCellDS_id', 'int4')]))
+    tables.append(('variable', [('name', 'text'), ('units', 'text'), ('value', 'text'), ('variables_id', 'int4')]))
+    return tables
+
+"""
+Get the nested phenotypes of a cell
+"""
+def getPhenotypes(level, depth):
+    if level > depth:
+        return None
+    phenotype = {
+        'name': 'p%d' % random.randint(0, 20),
+        'value': '%.4f' % random.random(),
+        'updated': '2016-%02d-%02dT%02d:%02d:00Z' % (random.randint(1, 12), random.randint(1, 28), random.randint(0, 23), random.randint(0, 59)),
+    }
+    child = getPhenotypes(level + 1, depth)
+    if child != None:
+        phenotype['phenotype_%d' % (level + 1)] = child
+    return phenotype
+
+"""
+Get the content of a file, as a JSON object
+"""
+def getDocument(index):
+    cells = []
+    for i in range(options.width):
+        cell = {
+            'ID': str(i),
+            'position': {'units': 'micron', 'position': '%.3f %.3f %.3f' % (random.random(), random.random(), random.random())},
+            'volume': '%.2f' % random.uniform(100, 5000),
+            'tag': ['t%d' % random.randint(0, 9) for j in range(options.repeat)],
+            'alive': random.choice(['true', 'false']),
+        }
+        phenotype = getPhenotypes(1, options.depth)
+        if phenotype != None:
+            cell['phenotype_1'] = phenotype
+        cells.append(cell)
+    return {'MultiCellDS': {
+        'version': '1.0',
+        'type': 'snapshot',
+        'metadata': {
+            'description': 'Synthetic snapshot %d with "quotes", commas, and accents \xc3\xa9' % index,
+            'keywords': ['k%d' % j for j in range(options.repeat)],
+            'current_time': {'units': 'min', 'current_time': str(index * 10)},
+        },
+        'cellular_information': {'cell_populations': {'cell_population': {'type': 'individual', 'count': str(options.width), 'cell': cells}}},
+        'variables': {'variable': [{'name': 'oxygen', 'units': 'mmHg'}, {'name': 'glucose', 'units': 'mM', 'value': '%.2f' % random.random()}]},
+    }}
+
+"""
+The XML attributes of the elements, the other keys are child elements
+"""
+ATTRIBUTES = {
+    'MultiCellDS': ['version', 'type'],
+    'current_time': ['units'],
+    'cell_population': ['type', 'count'],
+    'cell': ['ID'],
+    'position': ['units'],
+    'variable': ['name', 'units'],
+}
+
+"""
+Write an element as XML
+"""
+def writeElement(out, tag, value):
+    if isinstance(value, list):
+        for item in value:
+            writeElement(out, tag, item)
+        return
+    if not isinstance(value, dict):
+        out.write('<%s>%s</%s>' % (tag, escape(value), tag))
+        return
+    attributes = ATTRIBUTES.get(tag, [])
+    out.write('<%s' % tag)
+    for attr in attributes:
+        if attr in value:
+            out.write(' %s=%s' % (attr, quoteattr(value[attr])))
+    children = [key for key in sorted(value.keys()) if key not in attributes]
+    if tag in children:
+        # the text of an element with attributes
+        out.write('>%s</%s>' % (escape(value[tag]), tag))
+        return
+    if len(children) == 0:
+        out.write('/>')
+        return
+    out.write('>')
+    for key in children:
+        writeElement(out, key, value[key])
+    out.write('</%s>' % tag)
+
+"""
+Write the XSD describing the tables
+"""
+def writeXSD(path, tables):
+    out = open(path, 'w')
+    out.write('<?xml version="1.0"?>\n<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">\n')
+    baseTypes = {'text': 'xs:string', 'float8': 'xs:double', 'int4': 'xs:unsignedInt', 'boolean': 'xs:boolean', 'timestamptz': 'xs:dateTime'}
+    children = {}
+    for table,columns in tables:
+        for col,col_type in columns:
+            if col.endswith('_id'):
+                children.setdefault(col[:-3], []).append(table)
+    types = list(tables)
+    for i in range(options.types):
+        types.append(('extra_%d' % i, [('name', 'text'), ('value', 'float8'), ('count', 'int4')]))
+    for table,columns in types:
+        out.write('<xs:complexType name="%s">\n<xs:sequence>\n' % table)
+        for child in children.get(table, []):
+            out.write('<xs:element name="%s" type="%s"/>\n' % (child, child))
+        out.write('</xs:sequence>\n')
+        for col,col_type in columns:
+            if not col.endswith('_id'):
+                out.write('<xs:attribute name="%s" type="%s"/>\n' % (col, baseTypes[col_type]))
+        out.write('</xs:complexType>\n')
+    out.write('</xs:schema>\n')
+    out.close()
+
+"""
+Write the ermrest schema introspection of the tables
+"""
+def writeSchema(path, tables):
+    schema = {'tables': {}}
+    for table,columns in tables:
+        definitions = [{'name': 'id', 'type': {'typename': 'int4'}}]
+        for col,col_type in columns:
+            definitions.append({'name': col, 'type': {'typename': col_type}})
+        schema['tables'][table] = {'column_definitions': definitions}
+    out = open(path, 'w')
+    out.write('%s\n' % json.dumps(schema, indent=4))
+    out.close()
+
+random.seed(options.seed)
+if os.path.exists(options.output):
+    shutil.rmtree(options.output)
+for d in ['xml', 'json', 'xsd', 'thumbnails']:
+    os.makedirs('%s/%s' % (options.output, d))
+for i in range(options.files):
+    doc = getDocument(i)
+    out = open('%s/xml/snapshot%06d.xml' % (options.output, i), 'w')
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    writeElement(out, 'MultiCellDS', doc['MultiCellDS'])
+    out.write('\n')
+    out.close()
+    out = open('%s/json/snapshot%06d.json' % (options.output, i), 'w')
+    json.dump(doc, out)
+    out.close()
+    if i % 2 == 0:
+        out = open('%s/thumbnails/snapshot%06d.png' % (options.output, i), 'wb')
+        out.write('\x89PNG\r\n\x1a\n')
+        out.close()
+tables = getTables(options.depth)
+writeXSD('%s/xsd/root.xsd' % options.output, tables)
+writeSchema('%s/schema.json' % options.output, tables)
+sys.exit(0)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+"""
+This script runs a local stub of the ermrest service, for the benchmarks.
+
+It answers the requests made by xml2csv.py:
+
+    - the schema introspection, with an ETag revalidated by If-None-Match
+    - the max id of a table (null, as the tables are empty)
+
+Parameters:
+
+    - schema: the ermrest schema introspection file (schema.json of a corpus)
+    - port: the HTTP port; with 0 a free port is used
+    - catalog: the catalog number
+    - name: the schema name
+
+The port is printed on the standard output once the server listens.
+
+Usage:
+    python ermrest_stub.py -s <schema.json> [-p port] [-c catalog] [-n name]
+
+"""
+
+import sys
+import re
+import json
+import hashlib
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+parser = OptionParser()
+parser.header = {}
+parser.add_option('-s', '--schema', action='store', dest='schema', type='string', help='Schema introspection file')
+parser.add_option('-p', '--port', action='store', dest='port', type='int', default=0, help='HTTP port')
+parser.add_option('-c', '--catalog', action='store', dest='catalog', type='int', default=1, help='Catalog number')
+parser.add_option('-n', '--name', action='store', dest='name', type='string', default='multicelldb', help='Schema name')
+
+(options, args) = parser.parse_args()
+
+if not options.schema:
+    print 'ERROR: Missing schema file'
+    sys.exit(1)
+
+f = open(options.schema, 'r')
+schema = f.read()
+f.close()
+etag = '"%s"' % hashlib.md5(schema).hexdigest()
+schema_url = '/ermrest/catalog/%d/schema/%s' % (options.catalog, options.name)
+max_pattern = re.compile(r'/ermrest/catalog/%d/aggregate/%s:([^/]+)/max:=max\(id\)$' % (options.catalog, re.escape(options.name)))
+
+"""
+Handler of the ermrest requests, on keep-alive connections
+"""
+class ErmrestHandler (BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == schema_url:
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.reply(schema)
+        elif max_pattern.match(self.path):
+            self.reply(json.dumps([{'max': None}]))
+        else:
+            self.send_error(404)
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+"""
+HTTP server handling each connection in its own thread
+"""
+class ErmrestServer (ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+server = ErmrestServer(('127.0.0.1', options.port), ErmrestHandler)
+print server.server_address[1]
+sys.stdout.flush()
+server.serve_forever()
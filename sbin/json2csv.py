@@ -8,18 +8,45 @@ Parameters:
 
     - input: the directory with the JSON files
     - output: the directory with the CSV files
+    - single-pass: parse each JSON file once, incrementally, inferring the tables and
+      loading the data from the same events, with a memory bounded by the buffer of the
+      parser instead of the size of the files; the columns are in the order of the files,
+      and the CSV rows are written while parsing instead of being kept in memory
+    - workers: the number of processes parsing the JSON files in parallel, each file
+      being inferred and loaded at once; the output is identical to the one of a serial run
+    - inference-cache: a file caching the tables inferred from each JSON file with its
+      content hash; the inference pass only parses the new and the changed files
+      (not with the single-pass and the workers options)
+    - metrics: a JSON file where the metrics of the run (phases, counters, tables, peak RSS, slowest files) are written
     
 """
 
 import sys
 import os
+import time
+import shutil
+import atexit
+import tempfile
 from optparse import OptionParser
 import json
+from itertools import izip
+from multiprocessing import Pool
+from multicelldb.ordering import sortTables, CycleError
+from multicelldb.schema import OrderedSet, Schema
+from multicelldb.engine import Engine, InputError
+from multicelldb.readers import JSONReader
+from multicelldb.csvstream import CSVStream, csvValue, getCSVColumns, writeCSV, discardStreams
+from multicelldb.metrics import Metrics
+from multicelldb.inferencecache import InferenceCache, cacheKey
 
 parser = OptionParser()
 parser.header = {}
 parser.add_option('-i', '--input', action='store', dest='input', type='string', help='Input directory')
 parser.add_option('-o', '--output', action='store', dest='output', type='string', help='Output directory')
+parser.add_option('--single-pass', action='store_true', dest='single_pass', default=False, help='Infer the tables and load the data in one incremental parse')
+parser.add_option('-w', '--workers', action='store', dest='workers', type='int', default=1, help='Number of parallel JSON parsing processes')
+parser.add_option('--inference-cache', action='store', dest='inference_cache', type='string', help='File caching the inference of the JSON files')
+parser.add_option('--metrics', action='store', dest='metrics', type='string', help='JSON file for the metrics of the run')
 
 (options, args) = parser.parse_args()
 
@@ -31,198 +58,176 @@ if not options.output:
     print 'ERROR: Missing output directory'
     sys.exit(1)
 
-tablesList = []
-tablesDict = {}
+if options.workers < 1:
+    print 'ERROR: The number of workers must be a positive integer'
+    sys.exit(1)
+
+if options.inference_cache and (options.single_pass or options.workers > 1):
+    print 'ERROR: The inference cache can not be used with the single-pass or the workers options'
+    sys.exit(1)
 
-tablesNames = []
-tablesDefinitions = {}
-tablesReferences = {}
+tablesSchema = Schema()
+tablesNames = tablesSchema.names
+tablesDefinitions = tablesSchema.definitions
+tablesReferences = tablesSchema.references
 tablesSortedNames = []
 
 tablesData = {}
 columnTypes = {}
 
 """
-Guess the type of a value
+The directory of the spill files of the CSV streams, removed at exit
 """
-def getType(value):
-    try:
-        v = int(value)
-        return 'integer'
-    except:
-        try:
-            v = float(value)
-            return 'double precision'
-        except:
-            return 'text'
-        
+spillDir = None
+if options.single_pass:
+    spillDir = tempfile.mkdtemp(prefix='json2csv.')
+    atexit.register(shutil.rmtree, spillDir, True)
+
 """
-Set the SQL type of a value
-"""
-def setType(table, column, col_type):        
-    if col_type=='integer':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'integer'
-    elif col_type=='double precision':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys() or columnTypes[table][column]=='integer':
-            columnTypes[table][column] = 'double precision'
-    elif col_type=='text':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'text'
-            
+Create the CSV stream of a table, its rows being spilled until its columns are known
+"""
+def newStream(table):
+    return CSVStream('%s/%s.csv' % (options.output, table), csvValue, lambda: None, spillDir=spillDir)
+
+engine = Engine(tablesSchema, tablesData, columnTypes, newStream if options.single_pass else None)
+reader = JSONReader()
+metrics = Metrics(options.metrics)
+cache = None
+if options.inference_cache:
+    cache = InferenceCache(options.inference_cache, options.input, cacheKey('json'))
+    cache.load()
+
 """
 Sort the tables to be created based on the dependencies (references)
 """
 def sortTablesDefinitions():
-    sorted = False
-    while not sorted:
-        sorted = True
-        for t in tablesNames:
-            if t not in tablesSortedNames:
-                if t not in tablesReferences.keys():
-                    tablesSortedNames.append(t)
-                    sorted = False
-                else:
-                    resolved = True
-                    for refTable in tablesReferences[t]:
-                        if refTable not in tablesSortedNames:
-                            resolved = False
-                            break
-                    if resolved:
-                        tablesSortedNames.append(t)
-                        sorted = False
-                        
-"""
-Check if all the values of an array are strings
-"""
-def isStringArray(data):
-    if isinstance(data,list):
-        for value in data:
-            if not isinstance(value, basestring):
-                return False
-        return True
-    return False
-
-"""
-Populate the data structures for the SQL tables
-"""
-def process_file(f, data, table_name):
-    if isinstance(data,dict):
-        for key,value in data.items():
-            if value!=None:
-                if isinstance(value, basestring):
-                    setType(table_name, key, getType(value))
-                elif isStringArray(value):
-                    setType(table_name, key, 'text')
-            if value==None or isinstance(value, basestring) or isStringArray(value):
-                if table_name==None:
-                    print 'Unexpected table name: %s' % table_name
-                    sys.exit(1)
-                if key not in tablesDefinitions[table_name]:
-                    tablesDefinitions[table_name].append(key)
-            elif isinstance(value,dict) or isinstance(value,list):
-                if key not in tablesNames:
-                    tablesNames.append(key)
-                if key not in tablesDefinitions.keys():
-                    tablesDefinitions[key] = []
-                if table_name!=None and key not in tablesReferences.keys():
-                    tablesReferences[key] = []
-                if table_name!=None and table_name not in tablesReferences[key]:
-                     tablesReferences[key].append(table_name)
-                process_file(f, value, key)
-    elif isinstance(data,list):
-        for value in data:
-            process_file(f, value, table_name)
-    elif not isinstance(data, basestring):
-        print 'Unknown type: %s' % data
+    try:
+        tablesSortedNames.extend(sortTables(tablesNames, tablesReferences))
+    except CycleError as e:
+        sys.stderr.write('%s\n' % e)
+        discardStreams(tablesData)
         sys.exit(1)
-    
-def csvValue(value):
-    if isinstance(value,basestring):
-        value = value.replace('"','""')
-        value = '"%s"' % value.encode('utf8')
-    else:
-        value = str(value)
-    return value
         
 """
 Insert the data for a table
 """
 def insert_csv_data(table):
-    if table in tablesData.keys():
-        out = open('%s/%s.csv' % (options.output, table), 'w')
-        colsDefs = ['id']
-        colsDefs.extend(tablesDefinitions[table])
-        if table in tablesReferences.keys():
-            colsRef = []
-            for col in tablesReferences[table]:
-                colsRef.append('%s_id' % col)
-            colsDefs.extend(colsRef)
-        out.write('%s\n' % ','.join(colsDefs))
-        for data in tablesData[table]['data']:
-            row = []
-            for col in colsDefs:
-                if col in data.keys():
-                    row.append(csvValue(data[col]))
-                else:
-                    row.append('')
-            out.write('%s\n' % ','.join(row))
-        out.close()
-
-
-"""
-Populate the data structures for the SQL data
-"""
-def load_file_data(f, data, table_name, parent_table):
-    if table_name!=None and table_name not in tablesData.keys():
-        tablesData[table_name] = {}
-        tablesData[table_name]['id'] = 0
-        tablesData[table_name]['data'] = []
-    obj = {}
-    if table_name!=None:
-        tablesData[table_name]['id'] = tablesData[table_name]['id']+1
-        obj['id'] = tablesData[table_name]['id']
-    if isinstance(data,dict):
-        for key,value in data.items():
-            if value!=None:
-                if isinstance(value, basestring):
-                    obj[key] = value
-                elif isStringArray(value):
-                    obj[key] = ','.join(value)
-                elif isinstance(value, dict):
-                    load_file_data(f, value, key, table_name)
-                elif isinstance(value, list):
-                    for val in value:
-                        load_file_data(f, val, key, table_name)
-        if table_name!=None and parent_table!=None and table_name in tablesReferences.keys() and parent_table in tablesReferences[table_name]:
-            col = '%s_id' % parent_table
-            obj[col] = tablesData[parent_table]['id']
-        if table_name!=None:
-            tablesData[table_name]['data'].append(obj)
-    elif isinstance(data,list):
-        sys.stderr.write('array data\n')
-        for value in data:
-            load_file_data(f, value, table_name, parent_table)
-    
-files=os.listdir(options.input)     
+    if table in tablesData:
+        store = tablesData[table]['data']
+        if options.single_pass:
+            store.close(getCSVColumns(tablesSchema, table))
+        else:
+            out = open('%s/%s.csv' % (options.output, table), 'w')
+            writeCSV(out, getCSVColumns(tablesSchema, table), store)
+            out.close()
 
-for f in files:  
-    input = open('%s/%s' % (options.input, f))
-    json_data = json.load(input)
-    process_file(f, json_data, None) 
+"""
+Parse incrementally a JSON file, populating the tables definitions and the data
+from the same events
+"""
+def stream_JSON_file(f):
+    input = open('%s/%s' % (options.input, f), 'rb')
+    try:
+        engine.ingest(reader.stream(input))
+    except InputError as e:
+        print e
+        discardStreams(tablesData)
+        sys.exit(1)
     input.close()
-    
-for f in files:  
+
+"""
+Infer the tables from a JSON file, with the inference cache if any
+"""
+def infer_JSON_file(f):
+    if cache != None:
+        cache.infer(engine, f, lambda: read_JSON_file(f))
+    else:
+        engine.infer(read_JSON_file(f))
+
+"""
+Parse the JSON files with a pool of worker processes.
+The partial results are merged in the order of the files,
+such that the output is the same as the one of a serial run.
+"""
+def parallel_input(files):
+    pool = Pool(options.workers)
+    chunksize = max(1, len(files) / (options.workers * 4))
+    try:
+        for f,partial in izip(files, pool.imap(parse_JSON_file, files, chunksize)):
+            engine.merge(partial)
+            metrics.fileParsed(f, partial['elapsed'])
+    except InputError as e:
+        pool.terminate()
+        print e
+        discardStreams(tablesData)
+        sys.exit(1)
+    pool.close()
+    pool.join()
+
+"""
+Parse a JSON file in a worker process into partial tables definitions and data.
+The tables are inferred and loaded from the same events, as the data of a file
+does not depend on the tables of the other files.
+"""
+def parse_JSON_file(f):
+    start = time.time()
+    partial = {'tablesNames': OrderedSet(), 'tablesDefinitions': {}, 'tablesReferences': {}, 'columnTypes': {}, 'tablesData': {}}
+    fileEngine = Engine(Schema(partial['tablesNames'], partial['tablesDefinitions'], partial['tablesReferences']), partial['tablesData'], partial['columnTypes'])
+    input = open('%s/%s' % (options.input, f), 'rb')
+    if options.single_pass:
+        fileEngine.ingest(reader.stream(input))
+    else:
+        fileEngine.ingest(reader.events(json.load(input)))
+    input.close()
+    fileEngine.flush()
+    partial['elapsed'] = time.time() - start
+    return partial
+
+"""
+Get the events of a JSON file
+"""
+def read_JSON_file(f):
     input = open('%s/%s' % (options.input, f))
     json_data = json.load(input)
-    load_file_data(f, json_data, None, None) 
     input.close()
+    try:
+        return reader.events(json_data)
+    except InputError as e:
+        print e
+        sys.exit(1)
+    
+files=os.listdir(options.input)     
+
+if options.workers > 1:
+    metrics.start('parse')
+    parallel_input(files)
+    metrics.stop('parse')
+elif options.single_pass:
+    metrics.start('parse')
+    for f in files:  
+        start = time.time()
+        stream_JSON_file(f)
+        metrics.fileParsed(f, time.time() - start)
+    engine.flush()
+    metrics.stop('parse')
+else:
+    metrics.start('inference')
+    for f in files:  
+        start = time.time()
+        infer_JSON_file(f)
+        metrics.fileParsed(f, time.time() - start)
+    engine.flush()
+    if cache != None:
+        cache.save()
+        metrics.count('cached_files', cache.hits)
+    metrics.stop('inference')
+    
+    metrics.start('data')
+    for f in files:  
+        start = time.time()
+        engine.load(read_JSON_file(f))
+        metrics.fileParsed(f, time.time() - start)
+    metrics.stop('data')
     
 sortTablesDefinitions()
 
@@ -243,8 +248,13 @@ print json.dumps(columnTypes, indent=4)
 
 """
 
+metrics.start('csv')
 for table in tablesSortedNames:
     insert_csv_data(table)
+    if table in tablesData:
+        metrics.table(table, len(tablesData[table]['data']), os.path.getsize('%s/%s.csv' % (options.output, table)))
+metrics.stop('csv')
+metrics.write()
     
 sys.exit(0)
 
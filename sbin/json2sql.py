@@ -11,16 +11,39 @@ Parameters:
     - title: the column name to set the title annotation
     - root: the top level table to be viewed 
     - output: the SQL file for creating and loading the tables
+      (the SQLite database file with the sqlite format)
+    - format: the statements loading the rows, "insert" (default) or "copy" for
+      COPY blocks in the PostgreSQL text format (loaded with psql), or "sqlite"
+      for creating and loading the tables directly in a SQLite database
+    - batch-size: the number of rows of an INSERT statement (default 1); the rows
+      with the same columns are grouped in multi-row INSERT statements
+    - single-pass: parse each JSON file once, incrementally, inferring the tables and
+      loading the data from the same events, with a memory bounded by the buffer of the
+      parser instead of the size of the files; the columns are in the order of the files
+    - inference-cache: a file caching the tables inferred from each JSON file with its
+      content hash; the inference pass only parses the new and the changed files
+      (not with the single-pass option)
+    - metrics: a JSON file where the metrics of the run (phases, counters, tables, peak RSS, slowest files) are written
     
 An SQL file with the schema name followed by the suffix _annotation will contain the statements 
-to be executed for the model_table_annotation and model_column_annotation tables.
+to be executed for the model_table_annotation and model_column_annotation tables
+(except with the sqlite format, as SQLite has no schema and no ermrest annotations).
     
 """
 
 import sys
 import os
+import time
 from optparse import OptionParser
 import json
+from multicelldb.ordering import sortTables, CycleError
+from multicelldb.schema import Schema
+from multicelldb.engine import Engine, InputError
+from multicelldb.readers import JSONReader
+from multicelldb.metrics import Metrics
+from multicelldb.inferencecache import InferenceCache, cacheKey
+from multicelldb.sql import getColumns, writeInserts, writeBatchedInserts, writeCopy
+from multicelldb.sqlitedb import SQLiteDatabase
 
 parser = OptionParser()
 parser.header = {}
@@ -30,6 +53,11 @@ parser.add_option('-s', '--schema', action='store', dest='schema', type='string'
 parser.add_option('-t', '--title', action='store', dest='title', type='string', help='The title column')
 parser.add_option('-p', '--thumbnail', action='store', dest='thumbnail', type='string', help='The thumbnail column')
 parser.add_option('-r', '--root', action='store', dest='root', type='string', help='The root table')
+parser.add_option('-f', '--format', action='store', dest='format', type='choice', choices=['insert', 'copy', 'sqlite'], default='insert', help='Output format of the rows: insert (default), copy or sqlite')
+parser.add_option('-b', '--batch-size', action='store', dest='batch_size', type='int', default=1, help='Number of rows of an INSERT statement')
+parser.add_option('--single-pass', action='store_true', dest='single_pass', default=False, help='Infer the tables and load the data in one incremental parse')
+parser.add_option('--inference-cache', action='store', dest='inference_cache', type='string', help='File caching the inference of the JSON files')
+parser.add_option('--metrics', action='store', dest='metrics', type='string', help='JSON file for the metrics of the run')
 
 (options, args) = parser.parse_args()
 
@@ -52,6 +80,14 @@ if not options.root:
     print 'ERROR: Missing root table'
     sys.exit(1)
 
+if options.batch_size < 1:
+    print 'ERROR: The batch size must be a positive integer'
+    sys.exit(1)
+
+if options.inference_cache and options.single_pass:
+    print 'ERROR: The inference cache can not be used with the single-pass option'
+    sys.exit(1)
+
 if not options.title:
     print 'WARNING: Missing title column'
 else:
@@ -64,122 +100,39 @@ else:
 
 schema='"%s"' % options.schema
 
-out_annotation = file('%s_annotation.sql' % options.schema, 'w')
-out = file(options.output, 'w')
-
+if options.format == 'sqlite':
+    database = SQLiteDatabase(options.output)
+else:
+    out_annotation = file('%s_annotation.sql' % options.schema, 'w')
+    out = file(options.output, 'w')
 
-tablesList = []
-tablesDict = {}
 
-tablesNames = []
-tablesDefinitions = {}
-tablesReferences = {}
+tablesSchema = Schema()
+tablesNames = tablesSchema.names
+tablesDefinitions = tablesSchema.definitions
+tablesReferences = tablesSchema.references
 tablesSortedNames = []
 
 tablesData = {}
 columnTypes = {}
+engine = Engine(tablesSchema, tablesData, columnTypes)
+reader = JSONReader()
+metrics = Metrics(options.metrics)
+cache = None
+if options.inference_cache:
+    cache = InferenceCache(options.inference_cache, options.input, cacheKey('json'))
+    cache.load()
 
-"""
-Guess the type of a value
-"""
-def getType(value):
-    try:
-        v = int(value)
-        return 'integer'
-    except:
-        try:
-            v = float(value)
-            return 'double precision'
-        except:
-            return 'text'
-        
-"""
-Set the SQL type of a value
-"""
-def setType(table, column, col_type):        
-    if col_type=='integer':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'integer'
-    elif col_type=='double precision':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys() or columnTypes[table][column]=='integer':
-            columnTypes[table][column] = 'double precision'
-    elif col_type=='text':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'text'
-            
 """
 Sort the tables to be created based on the dependencies (references)
 """
 def sortTablesDefinitions():
-    sorted = False
-    while not sorted:
-        sorted = True
-        for t in tablesNames:
-            if t not in tablesSortedNames:
-                if t not in tablesReferences.keys():
-                    tablesSortedNames.append(t)
-                    sorted = False
-                else:
-                    resolved = True
-                    for refTable in tablesReferences[t]:
-                        if refTable not in tablesSortedNames:
-                            resolved = False
-                            break
-                    if resolved:
-                        tablesSortedNames.append(t)
-                        sorted = False
-                        
-"""
-Check if all the values of an array are strings
-"""
-def isStringArray(data):
-    if isinstance(data,list):
-        for value in data:
-            if not isinstance(value, basestring):
-                return False
-        return True
-    return False
-
-"""
-Populate the data structures for the SQL tables
-"""
-def process_file(f, data, table_name):
-    if isinstance(data,dict):
-        for key,value in data.items():
-            if value!=None:
-                if isinstance(value, basestring):
-                    setType(table_name, key, getType(value))
-                elif isStringArray(value):
-                    setType(table_name, key, 'text')
-            if value==None or isinstance(value, basestring) or isStringArray(value):
-                if table_name==None:
-                    print 'Unexpected table name: %s' % table_name
-                    sys.exit(1)
-                if key not in tablesDefinitions[table_name]:
-                    tablesDefinitions[table_name].append(key)
-            elif isinstance(value,dict) or isinstance(value,list):
-                if key not in tablesNames:
-                    tablesNames.append(key)
-                if key not in tablesDefinitions.keys():
-                    tablesDefinitions[key] = []
-                if table_name!=None and key not in tablesReferences.keys():
-                    tablesReferences[key] = []
-                if table_name!=None and table_name not in tablesReferences[key]:
-                     tablesReferences[key].append(table_name)
-                process_file(f, value, key)
-    elif isinstance(data,list):
-        for value in data:
-            process_file(f, value, table_name)
-    elif not isinstance(data, basestring):
-        print 'Unknown type: %s' % data
+    try:
+        tablesSortedNames.extend(sortTables(tablesNames, tablesReferences))
+    except CycleError as e:
+        sys.stderr.write('%s\n' % e)
         sys.exit(1)
-    
+                        
 """
 Generate the SQL statements for a table as well as its annotations
 """
@@ -195,12 +148,12 @@ def create_sql_table(table):
             out_annotation.write('INSERT INTO _ermrest.model_column_annotation VALUES(\'%s\', \'%s\', \'%s\', \'comment\', \'["thumbnail"]\');\n' % (options.schema, table, col))
         if title!=None and col==title:
             out_annotation.write('INSERT INTO _ermrest.model_column_annotation VALUES(\'%s\', \'%s\', \'%s\', \'comment\', \'["title"]\');\n' % (options.schema, table, col))
-        if col not in tablesReferences.keys() or table not in tablesReferences[col]:
+        if not tablesSchema.isReference(col, table):
             col_type = 'text'
-            if table in columnTypes.keys() and col in columnTypes[table].keys():
+            if table in columnTypes and col in columnTypes[table]:
                 col_type = columnTypes[table][col]
             out.write(',\n\t"%s" %s' % (col, col_type))
-    if table in tablesReferences.keys():
+    if table in tablesReferences:
         for col in tablesReferences[table]:
             out.write(',\n\t"%s_id" integer' % col)
         for col in tablesReferences[table]:
@@ -209,81 +162,93 @@ def create_sql_table(table):
     out.write('\n);\n\n')
 
 
-"""
-Get the set of columns and values for a row to be inserted into the table
-"""
-def getRow(data):
-    ret={}
-    ret['columns']=[]
-    ret['values']=[]
-    for column,value in data.items():
-        ret['columns'].append('"%s"' % column)
-        if isinstance(value,basestring):
-            value = value.replace("'","''")
-        ret['values'].append("'%s'" % value)
-    ret['columns'] = ','.join(ret['columns'])
-    ret['values'] = ','.join(ret['values'])
-    return ret
-    
 """
 Insert the data for a table
 """
 def insert_sql_data(table):
-    if table in tablesData.keys():
-        for data in tablesData[table]['data']:
-            columns=getRow(data)['columns']
-            values=getRow(data)['values']
-            out.write(('INSERT INTO %s."%s" (%s) VALUES(%s);\n' % (schema,table,columns,values)).encode('utf8'))
+    if table in tablesData:
+        store = tablesData[table]['data']
+        if options.format == 'copy':
+            writeCopy(out, schema, table, getColumns(tablesSchema, table), store)
+        elif options.batch_size > 1:
+            writeBatchedInserts(out, schema, table, store, options.batch_size)
+        else:
+            writeInserts(out, schema, table, store)
     out.write('\n\n')
 
 
 """
-Populate the data structures for the SQL data
+Create a table in the SQLite database and load its data
 """
-def load_file_data(f, data, table_name, parent_table):
-    if table_name!=None and table_name not in tablesData.keys():
-        tablesData[table_name] = {}
-        tablesData[table_name]['id'] = 0
-        tablesData[table_name]['data'] = []
-    obj = {}
-    if table_name!=None:
-        tablesData[table_name]['id'] = tablesData[table_name]['id']+1
-        obj['id'] = tablesData[table_name]['id']
-    if isinstance(data,dict):
-        for key,value in data.items():
-            if value!=None:
-                if isinstance(value, basestring):
-                    obj[key] = value
-                elif isStringArray(value):
-                    obj[key] = ','.join(value)
-                elif isinstance(value, dict):
-                    load_file_data(f, value, key, table_name)
-                elif isinstance(value, list):
-                    for val in value:
-                        load_file_data(f, val, key, table_name)
-        if table_name!=None and parent_table!=None and table_name in tablesReferences.keys() and parent_table in tablesReferences[table_name]:
-            col = '%s_id' % parent_table
-            obj[col] = tablesData[parent_table]['id']
-        if table_name!=None:
-            tablesData[table_name]['data'].append(obj)
-    elif isinstance(data,list):
-        sys.stderr.write('array data\n')
-        for value in data:
-            load_file_data(f, value, table_name, parent_table)
-    
-files=os.listdir(options.input)     
+def create_sqlite_table(table):
+    columns = getColumns(tablesSchema, table)
+    database.createTable(table, columns, columnTypes.get(table, {}), tablesReferences.get(table, []))
+    if table in tablesData:
+        metrics.table(table, database.insertRows(table, columns, tablesData[table]['data']), 0)
 
-for f in files:  
-    input = open('%s/%s' % (options.input, f))
-    json_data = json.load(input)
-    process_file(f, json_data, None) 
+"""
+Parse incrementally a JSON file, populating the tables definitions and the data
+from the same events
+"""
+def stream_JSON_file(f):
+    input = open('%s/%s' % (options.input, f), 'rb')
+    try:
+        engine.ingest(reader.stream(input))
+    except InputError as e:
+        print e
+        sys.exit(1)
     input.close()
-    
-for f in files:  
+
+"""
+Infer the tables from a JSON file, with the inference cache if any
+"""
+def infer_JSON_file(f):
+    if cache != None:
+        cache.infer(engine, f, lambda: read_JSON_file(f))
+    else:
+        engine.infer(read_JSON_file(f))
+
+"""
+Get the events of a JSON file
+"""
+def read_JSON_file(f):
     input = open('%s/%s' % (options.input, f))
     json_data = json.load(input)
-    load_file_data(f, json_data, None, None) 
     input.close()
+    try:
+        return reader.events(json_data)
+    except InputError as e:
+        print e
+        sys.exit(1)
+    
+files=os.listdir(options.input)     
+
+if options.single_pass:
+    metrics.start('parse')
+    for f in files:  
+        start = time.time()
+        stream_JSON_file(f)
+        metrics.fileParsed(f, time.time() - start)
+    engine.flush()
+    metrics.stop('parse')
+else:
+    metrics.start('inference')
+    for f in files:  
+        start = time.time()
+        infer_JSON_file(f)
+        metrics.fileParsed(f, time.time() - start)
+    engine.flush()
+    if cache != None:
+        cache.save()
+        metrics.count('cached_files', cache.hits)
+    metrics.stop('inference')
+    
+    metrics.start('data')
+    for f in files:  
+        start = time.time()
+        engine.load(read_JSON_file(f))
+        metrics.fileParsed(f, time.time() - start)
+    metrics.stop('data')
     
 sortTablesDefinitions()
 
@@ -304,6 +269,16 @@ print json.dumps(columnTypes, indent=4)
 
 """
 
+if options.format == 'sqlite':
+    metrics.start('sql')
+    for table in tablesSortedNames:
+        create_sqlite_table(table)
+    database.close()
+    metrics.count('bytes', os.path.getsize(options.output))
+    metrics.stop('sql')
+    metrics.write()
+    sys.exit(0)
+
 out_annotation.write('BEGIN;\n\n')
 out_annotation.write('DELETE FROM _ermrest.model_table_annotation where schema_name=\'%s\';\n' % options.schema)
 out_annotation.write('DELETE FROM _ermrest.model_column_annotation where schema_name=\'%s\';\n\n' % options.schema)
@@ -312,15 +287,21 @@ out.write('BEGIN;\n\n')
 out.write('DROP SCHEMA %s CASCADE;\n\n' % schema)
 out.write('CREATE SCHEMA %s;\n\n' % schema)
 
+metrics.start('sql')
 for table in tablesSortedNames:
     create_sql_table(table)
     
 for table in tablesSortedNames:
+    position = out.tell()
     insert_sql_data(table)
+    if table in tablesData:
+        metrics.table(table, len(tablesData[table]['data']), out.tell() - position)
     
 out.write('COMMIT;\n\n')
 out.close()
 out_annotation.write('COMMIT;\n\n')
 out_annotation.close()
+metrics.stop('sql')
+metrics.write()
 sys.exit(0)
 
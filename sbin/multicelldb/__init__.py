@@ -0,0 +1,3 @@
+"""
+Shared modules for the MultiCellDB scripts.
+"""
@@ -0,0 +1,336 @@
+"""
+Streaming creation of a BagIt bag and of its zip archive.
+
+The payload files are checksummed while they are written, and, when possible,
+compressed into the zip archive from the same bytes, so the bag and the zip are
+made without reading the payload back. A payload file written while another one
+is still open (for example the CSV streams of a single-pass parse) is added to
+the zip archive from the disk when the bag is closed.
+
+The zip archive is written sequentially, with the struct and zlib modules only:
+each entry has a local header with the data descriptor flag, its data (stored,
+or deflated at the given level) and a data descriptor with its CRC and sizes.
+The central directory, and the ZIP64 records when they are needed, are written
+when the archive is closed.
+"""
+
+import os
+import time
+import struct
+import hashlib
+import zlib
+
+"""
+The BagIt declaration
+"""
+BAGIT_TXT = 'BagIt-Version: 0.97\nTag-File-Character-Encoding: UTF-8\n'
+
+"""
+Size of the chunks copied from the disk into the zip archive
+"""
+CHUNK_SIZE = 1024 * 1024
+
+"""
+The zip compression methods, flags and versions
+"""
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP64_VERSION = 45
+UNIX_SYSTEM = 3
+
+"""
+The largest sizes, offsets and number of entries of the zip records without ZIP64
+"""
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+"""
+The zip records: the signatures and the formats of their fixed fields
+"""
+LOCAL_HEADER = (0x04034b50, '<IHHHHHIIIHH')
+DATA_DESCRIPTOR = (0x08074b50, '<IIQQ')
+CENTRAL_HEADER = (0x02014b50, '<IBBHHHHHIIIHHHHHII')
+ZIP64_END = (0x06064b50, '<IQHHIIQQQQ')
+ZIP64_LOCATOR = (0x07064b50, '<IIQI')
+END = (0x06054b50, '<IHHHHIIH')
+
+"""
+The id of the ZIP64 extra field
+"""
+ZIP64_EXTRA = 1
+
+"""
+Get the MS-DOS time and date of a time tuple
+"""
+def dosDateTime(date_time):
+    year,month,day,hour,minute,second = date_time
+    return (hour << 11) | (minute << 5) | (second / 2), ((year - 1980) << 9) | (month << 5) | day
+
+"""
+Writer of a zip archive whose entries are written incrementally.
+The compression is None for stored entries, or the deflate level (0-9).
+"""
+class ZipStream (object):
+
+    def __init__(self, path, compression):
+        self.compression = compression
+        self.out = open(path, 'wb')
+        self.offset = 0
+        self.entries = []
+        self.entry = None
+
+    """
+    Write bytes to the archive
+    """
+    def write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    """
+    Start a new entry, returning it.
+    The sizes are not known yet, so the local header has a ZIP64 extra field
+    and the sizes are written in a ZIP64 data descriptor after the data.
+    """
+    def open(self, name):
+        if self.entry != None:
+            raise RuntimeError('The zip entry %s is still open' % self.entry.name)
+        self.entry = ZipEntry(self, name)
+        extra = struct.pack('<HHQQ', ZIP64_EXTRA, 16, 0, 0)
+        signature,fmt = LOCAL_HEADER
+        self.write(struct.pack(fmt, signature, ZIP64_VERSION, self.entry.flags, self.entry.method, self.entry.time, self.entry.date, 0, 0xffffffff, 0xffffffff, len(self.entry.filename), len(extra)))
+        self.write(self.entry.filename)
+        self.write(extra)
+        return self.entry
+
+    """
+    Complete the current entry with its data descriptor
+    """
+    def closed(self, entry):
+        signature,fmt = DATA_DESCRIPTOR
+        self.write(struct.pack(fmt, signature, entry.crc, entry.compressSize, entry.size))
+        self.entries.append(entry)
+        self.entry = None
+
+    """
+    Add an entry from a file on the disk
+    """
+    def writeFile(self, name, path):
+        entry = self.open(name)
+        f = open(path, 'rb')
+        while True:
+            buf = f.read(CHUNK_SIZE)
+            if not buf:
+                break
+            entry.write(buf)
+        f.close()
+        entry.close()
+
+    """
+    Add an entry from a string
+    """
+    def writestr(self, name, data):
+        entry = self.open(name)
+        entry.write(data)
+        entry.close()
+
+    """
+    Write the central directory, with the ZIP64 records if needed, and close the archive
+    """
+    def close(self):
+        if self.entry != None:
+            raise RuntimeError('The zip entry %s is still open' % self.entry.name)
+        start = self.offset
+        for entry in self.entries:
+            self.writeCentralHeader(entry)
+        end = self.offset
+        count = len(self.entries)
+        size = end - start
+        if count > ZIP_FILECOUNT_LIMIT or start > ZIP64_LIMIT or size > ZIP64_LIMIT:
+            signature,fmt = ZIP64_END
+            self.write(struct.pack(fmt, signature, struct.calcsize(fmt) - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0, count, count, size, start))
+            signature,fmt = ZIP64_LOCATOR
+            self.write(struct.pack(fmt, signature, 0, end, 1))
+            # The values beyond the limits are read from the ZIP64 end record
+            if count > ZIP_FILECOUNT_LIMIT:
+                count = 0xffff
+            if start > ZIP64_LIMIT:
+                start = 0xffffffff
+            if size > ZIP64_LIMIT:
+                size = 0xffffffff
+        signature,fmt = END
+        self.write(struct.pack(fmt, signature, 0, 0, count, count, size, start, 0))
+        self.out.close()
+
+    """
+    Write the central directory header of an entry; the sizes and the offset
+    beyond the limits of the header are in its ZIP64 extra field
+    """
+    def writeCentralHeader(self, entry):
+        fields = []
+        size = entry.size
+        if size > ZIP64_LIMIT:
+            fields.append(size)
+            size = 0xffffffff
+        compressSize = entry.compressSize
+        if compressSize > ZIP64_LIMIT:
+            fields.append(compressSize)
+            compressSize = 0xffffffff
+        offset = entry.offset
+        if offset > ZIP64_LIMIT:
+            fields.append(offset)
+            offset = 0xffffffff
+        extra = ''
+        if len(fields) > 0:
+            extra = struct.pack('<HH%dQ' % len(fields), ZIP64_EXTRA, 8 * len(fields), *fields)
+        signature,fmt = CENTRAL_HEADER
+        self.write(struct.pack(fmt, signature, ZIP64_VERSION, UNIX_SYSTEM, ZIP64_VERSION, entry.flags, entry.method, entry.time, entry.date, entry.crc, compressSize, size, len(entry.filename), len(extra), 0, 0, 0, 0644 << 16L, offset))
+        self.write(entry.filename)
+        self.write(extra)
+
+"""
+An entry of a ZipStream being written
+"""
+class ZipEntry (object):
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+        self.flags = FLAG_DATA_DESCRIPTOR
+        if isinstance(name, unicode):
+            try:
+                self.filename = name.encode('ascii')
+            except UnicodeEncodeError:
+                self.filename = name.encode('utf8')
+                self.flags |= FLAG_UTF8
+        else:
+            self.filename = name
+        self.time,self.date = dosDateTime(time.localtime(time.time())[:6])
+        self.offset = stream.offset
+        self.size = 0
+        self.compressSize = 0
+        self.crc = 0
+        self.cmpr = None
+        self.method = ZIP_STORED
+        if stream.compression != None:
+            self.method = ZIP_DEFLATED
+            self.cmpr = zlib.compressobj(stream.compression, zlib.DEFLATED, -15)
+
+    def write(self, data):
+        self.size += len(data)
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        if self.cmpr != None:
+            data = self.cmpr.compress(data)
+        self.compressSize += len(data)
+        self.stream.write(data)
+
+    """
+    Complete the entry with the end of the compressed data and the data descriptor
+    """
+    def close(self):
+        if self.cmpr != None:
+            data = self.cmpr.flush()
+            self.compressSize += len(data)
+            self.stream.write(data)
+        self.stream.closed(self)
+
+"""
+A file of the bag, checksummed (and zipped) while it is written
+"""
+class BagFile (object):
+
+    def __init__(self, bag, name):
+        self.bag = bag
+        self.name = name
+        self.out = open(os.path.join(bag.path, name), 'wb')
+        self.digests = [hashlib.new(algorithm) for algorithm in bag.algorithms]
+        self.size = 0
+        self.entry = None
+        if bag.zip != None and bag.zip.entry == None:
+            self.entry = bag.zip.open(name)
+
+    def write(self, data):
+        self.out.write(data)
+        for digest in self.digests:
+            digest.update(data)
+        self.size += len(data)
+        if self.entry != None:
+            self.entry.write(data)
+
+    def close(self):
+        self.out.close()
+        if self.entry != None:
+            self.entry.close()
+        self.bag.closed(self)
+
+"""
+Writer of a bag directory, and optionally of its zip archive
+"""
+class BagWriter (object):
+
+    def __init__(self, path, algorithms, zip=None, compression=None):
+        self.path = path
+        self.algorithms = algorithms
+        self.zip = None
+        if zip != None:
+            self.zip = ZipStream(zip, compression)
+        self.payload = []
+        self.tags = []
+        self.unzipped = []
+        if not os.path.exists(os.path.join(path, 'data')):
+            os.makedirs(os.path.join(path, 'data'))
+
+    """
+    Open a payload file
+    """
+    def open(self, name):
+        return BagFile(self, 'data/%s' % name)
+
+    """
+    Record the checksums of a closed file
+    """
+    def closed(self, f):
+        checksums = [digest.hexdigest() for digest in f.digests]
+        if f.name.startswith('data/'):
+            self.payload.append((f.name, f.size, checksums))
+        else:
+            self.tags.append((f.name, f.size, checksums))
+        if self.zip != None and f.entry == None:
+            self.unzipped.append(f.name)
+
+    """
+    Write a tag file
+    """
+    def writeTag(self, name, data):
+        f = BagFile(self, name)
+        f.write(data)
+        f.close()
+
+    """
+    Write the tag files: the declaration, the bag info and the manifests
+    """
+    def finish(self, info):
+        self.writeTag('bagit.txt', BAGIT_TXT)
+        info = dict(info)
+        info['Bagging-Date'] = time.strftime('%Y-%m-%d')
+        info['Payload-Oxum'] = '%d.%d' % (sum([size for name,size,checksums in self.payload]), len(self.payload))
+        lines = ['%s: %s\n' % (key, info[key]) for key in sorted(info.keys())]
+        self.writeTag('bag-info.txt', ''.join(lines))
+        for i in range(len(self.algorithms)):
+            lines = ['%s  %s\n' % (checksums[i], name) for name,size,checksums in sorted(self.payload)]
+            self.writeTag('manifest-%s.txt' % self.algorithms[i], ''.join(lines))
+        tags = sorted(self.tags)
+        for i in range(len(self.algorithms)):
+            lines = ['%s  %s\n' % (checksums[i], name) for name,size,checksums in tags]
+            self.writeTag('tagmanifest-%s.txt' % self.algorithms[i], ''.join(lines))
+
+    """
+    Complete the zip archive with the files not zipped while they were written
+    """
+    def close(self):
+        if self.zip != None:
+            for name in self.unzipped:
+                self.zip.writeFile(name, os.path.join(self.path, name))
+            self.zip.close()
+            self.zip = None
@@ -0,0 +1,166 @@
+"""
+Columnar binary output of the tables, as Parquet or Arrow IPC files.
+
+Each table is written to its own file, with the columns typed from their
+ermrest or inferred types, so that the tables can be scanned without parsing
+the CSV text again. The id and the references to the parent tables are
+64 bit integers. A column with a value which can not be converted to the
+type of the column, or which overflows it, is written as a string column.
+
+The writer requires the optional pyarrow package.
+"""
+
+import re
+import sys
+from datetime import datetime, timedelta
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""
+The file extension of each columnar format
+"""
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+"""
+The compressions of each columnar format, and the default one (None is no compression)
+"""
+COMPRESSIONS = {'parquet': [None, 'snappy', 'gzip', 'brotli', 'lz4', 'zstd'], 'arrow': [None, 'lz4', 'zstd']}
+DEFAULT_COMPRESSIONS = {'parquet': 'snappy', 'arrow': None}
+
+"""
+The Arrow type of each ermrest type, the other columns are strings
+"""
+ARROW_TYPES = {'int2': 'int16', 'int4': 'int32', 'int8': 'int64', 'serial2': 'int16', 'serial4': 'int32', 'serial8': 'int64', 'float4': 'float32', 'float8': 'float64', 'boolean': 'bool', 'timestamptz': 'timestamp'}
+
+"""
+The text values of the booleans, as accepted by PostgreSQL
+"""
+BOOLEAN_VALUES = {'true': True, 't': True, 'yes': True, 'y': True, 'on': True, '1': True, 'false': False, 'f': False, 'no': False, 'n': False, 'off': False, '0': False}
+
+"""
+The timestamps, with an optional time zone
+"""
+TIMESTAMP_PATTERN = re.compile(r'[ \t\r\n]*([0-9]{4})-([0-9]{2})-([0-9]{2})(?:[T ]([0-9]{2}):([0-9]{2})(?::([0-9]{2})(?:\.([0-9]+))?)?)?(?:Z|([-+])([0-9]{2}):?([0-9]{2})?)?[ \t\r\n]*\Z')
+
+"""
+Check if the pyarrow package is installed
+"""
+def available():
+    return pyarrow != None
+
+"""
+Check if the Arrow IPC files can be compressed (pyarrow 0.17 and later)
+"""
+def ipcCompression():
+    return hasattr(pyarrow, 'ipc') and hasattr(pyarrow.ipc, 'IpcWriteOptions')
+
+"""
+Convert a boolean value
+"""
+def booleanValue(value):
+    ret = BOOLEAN_VALUES.get(value.strip().lower())
+    if ret == None:
+        raise ValueError('Invalid boolean: %s' % value)
+    return ret
+
+"""
+Convert a timestamp value to UTC; a timestamp without a time zone is in UTC
+"""
+def timestampValue(value):
+    match = TIMESTAMP_PATTERN.match(value)
+    if match == None:
+        raise ValueError('Invalid timestamp: %s' % value)
+    year,month,day,hour,minute,second,fraction,sign,zoneHour,zoneMinute = match.groups()
+    micro = int((fraction or '0')[:6].ljust(6, '0'))
+    ret = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), micro)
+    if sign != None:
+        offset = timedelta(hours=int(zoneHour), minutes=int(zoneMinute or 0))
+        ret = ret - offset if sign == '+' else ret + offset
+    return ret
+
+"""
+The conversion of the text values of each Arrow type
+"""
+CONVERTERS = {'int16': int, 'int32': int, 'int64': int, 'float32': float, 'float64': float, 'bool': booleanValue, 'timestamp': timestampValue}
+
+"""
+Get the Arrow type of an Arrow type name
+"""
+def arrowType(name):
+    if name == 'timestamp':
+        return pyarrow.timestamp('us', tz='UTC')
+    if name == 'bool':
+        return pyarrow.bool_()
+    return getattr(pyarrow, name)()
+
+"""
+Convert the values of a column to an Arrow type, returning None if a value can not be converted
+"""
+def convertValues(values, name):
+    converter = CONVERTERS.get(name)
+    ret = []
+    for value in values:
+        if value != None and isinstance(value, basestring):
+            try:
+                value = converter(value)
+            except (ValueError, OverflowError):
+                return None
+        ret.append(value)
+    return ret
+
+"""
+Writer of the columnar files of the tables
+"""
+class ColumnarWriter (object):
+
+    def __init__(self, output, format='parquet', compression=None):
+        self.output = output
+        self.format = format
+        self.compression = compression
+
+    """
+    Get the Arrow array of a column; a column whose values can not be converted
+    to its Arrow type, or overflow it, is a string column
+    """
+    def getArray(self, table, column, col_type, values):
+        name = ARROW_TYPES.get(col_type)
+        if name != None:
+            converted = convertValues(values, name)
+            if converted != None:
+                try:
+                    return pyarrow.array(converted, type=arrowType(name))
+                except (pyarrow.ArrowInvalid, OverflowError, ValueError):
+                    pass
+            sys.stderr.write('WARNING: Column %s.%s is not %s, it is written as string\n' % (table, column, col_type))
+        return pyarrow.array([value if value == None or isinstance(value, basestring) else unicode(value) for value in values], type=pyarrow.string())
+
+    """
+    Write the columnar file of a table, returning its path
+    """
+    def write(self, table, columns, columnTypes, references, store):
+        keys = set(['%s_id' % ref for ref in references])
+        arrays = []
+        for column in columns:
+            if column == 'id' or column in keys:
+                col_type = 'int8'
+            else:
+                col_type = columnTypes.get(column, 'text')
+            arrays.append(self.getArray(table, column, col_type, store.column(column)))
+        data = pyarrow.Table.from_arrays(arrays, names=columns)
+        path = '%s/%s.%s' % (self.output, table, FORMATS[self.format])
+        if self.format == 'parquet':
+            pyarrow.parquet.write_table(data, path, compression=self.compression or 'none')
+        else:
+            sink = pyarrow.OSFile(path, 'wb')
+            if self.compression != None:
+                writer = pyarrow.ipc.new_file(sink, data.schema, options=pyarrow.ipc.IpcWriteOptions(compression=self.compression))
+            else:
+                writer = pyarrow.RecordBatchFileWriter(sink, data.schema)
+            writer.write_table(data)
+            writer.close()
+            sink.close()
+        return path
@@ -0,0 +1,227 @@
+"""
+CSV files of the tables, and streaming writer for the CSV file of a table.
+
+A CSVStream has the reserve/fill interface of the ColumnStore, but the rows are
+written to the file as soon as they are complete, so the memory does not grow
+with the size of the input. The rows are written in the order they were reserved:
+a row completed before an earlier reserved one waits in a small pending buffer.
+
+When the columns are known before the first row (the tables definitions were
+inferred in a previous pass), the header and the rows are written directly
+to the CSV file. Otherwise the rows are spilled in the order the columns were
+seen, and the CSV file is written from the spill file when the stream is closed.
+The spill file is a temporary file, in the temporary directory by default, so
+it is never left in the output directory. The scripts give a spill directory
+of their own, removed when they exit, and discard the streams before an error
+exit, so neither the spill files nor the partial CSV files are left behind.
+"""
+
+import os
+import marshal
+import tempfile
+
+"""
+Format a CSV value, the strings being quoted
+"""
+def csvValue(value):
+    if isinstance(value,basestring):
+        value = value.replace('"','""')
+        value = '"%s"' % value.encode('utf8')
+    else:
+        value = str(value)
+    return value
+
+"""
+Get the columns of the CSV file of a table: the id, the columns of the table
+and the references to the parent tables
+"""
+def getCSVColumns(schema, table):
+    columns = ['id']
+    columns.extend(schema.definitions[table])
+    for ref in schema.references.get(table, []):
+        columns.append('%s_id' % ref)
+    return columns
+
+"""
+Write the header and the rows of a table to a CSV file
+"""
+def writeCSV(out, columns, store):
+    out.write('%s\n' % ','.join(columns))
+    for data in store.rows(columns):
+        row = []
+        for value in data:
+            if value != None:
+                row.append(csvValue(value))
+            else:
+                row.append('')
+        out.write('%s\n' % ','.join(row))
+
+"""
+Open a CSV file for writing
+"""
+def openFile(path):
+    return open(path, 'w')
+
+"""
+Discard the CSV streams of the tables (an error exit): their spill files
+and their partial CSV files are removed
+"""
+def discardStreams(tablesData):
+    for data in tablesData.itervalues():
+        if isinstance(data['data'], CSVStream):
+            data['data'].close(None)
+
+"""
+Streaming writer for the CSV file of a table
+"""
+class CSVStream (object):
+
+    def __init__(self, path, csvValue, getColumns, openFile=openFile, spillDir=None):
+        self.path = path
+        self.spillDir = spillDir
+        self.openFile = openFile
+        self.csvValue = csvValue
+        self.getColumns = getColumns
+        self.size = 0
+        self.written = 0
+        self.pending = {}
+        self.out = None
+        self.columns = None
+        self.slots = {}
+        self.spill = None
+        self.spillPath = None
+
+    def __len__(self):
+        return self.size
+
+    """
+    Reserve a row, to be written when filled, returning its index
+    """
+    def reserve(self):
+        self.size += 1
+        return self.size - 1
+
+    """
+    Append a complete row given as a dictionary, returning its index
+    """
+    def append(self, obj):
+        index = self.reserve()
+        self.fill(index, obj)
+        return index
+
+    """
+    Append the rows of a ColumnStore, adding an offset to the values of the given columns
+    """
+    def extend(self, store, offsets):
+        for index in xrange(len(store)):
+            obj = store.row(index)
+            for column,offset in offsets.iteritems():
+                if column in obj:
+                    obj[column] = obj[column] + offset
+            self.append(obj)
+
+    """
+    Write a reserved row, together with the pending rows that follow it
+    """
+    def fill(self, index, obj):
+        if index != self.written:
+            self.pending[index] = obj
+            return
+        self.write(obj)
+        while self.written in self.pending:
+            self.write(self.pending.pop(self.written))
+
+    """
+    Open the CSV file or the spill file at the first row
+    """
+    def open(self):
+        self.columns = self.getColumns()
+        if self.columns != None:
+            self.out = self.openFile(self.path)
+            self.out.write('%s\n' % ','.join(self.columns))
+        else:
+            fd,self.spillPath = tempfile.mkstemp(prefix='%s.' % os.path.basename(self.path), suffix='.spill', dir=self.spillDir)
+            self.spill = os.fdopen(fd, 'wb')
+
+    """
+    Write a row to the CSV file or to the spill file
+    """
+    def write(self, obj):
+        if self.out == None and self.spill == None:
+            self.open()
+        self.written += 1
+        if self.out != None:
+            row = []
+            for col in self.columns:
+                value = obj.get(col)
+                if value != None:
+                    row.append(self.csvValue(value))
+                else:
+                    row.append('')
+            self.out.write('%s\n' % ','.join(row))
+        else:
+            row = [''] * len(self.slots)
+            for col,value in obj.iteritems():
+                if value == None:
+                    continue
+                slot = self.slots.get(col)
+                if slot == None:
+                    slot = len(self.slots)
+                    self.slots[col] = slot
+                    row.append('')
+                row[slot] = self.csvValue(value)
+            marshal.dump(row, self.spill)
+
+    """
+    Complete the CSV file with the final columns.
+    With columns None, the table is not written, and its spill file and its
+    partial CSV file are discarded, even if some rows were never filled.
+    """
+    def close(self, columns):
+        try:
+            self.complete(columns)
+        finally:
+            if self.spill != None:
+                self.spill.close()
+                self.spill = None
+            if self.spillPath != None:
+                os.remove(self.spillPath)
+                self.spillPath = None
+
+    """
+    Complete the CSV file with the final columns, from the spill file if any
+    """
+    def complete(self, columns):
+        if columns != None and len(self.pending) > 0:
+            raise RuntimeError('%s: %d rows were never filled' % (self.path, self.size - self.written))
+        if self.out != None:
+            self.out.close()
+            self.out = None
+            if columns == None:
+                os.remove(self.path)
+            elif columns != self.columns:
+                raise RuntimeError('%s: the columns changed after the header was written' % self.path)
+            return
+        if self.spill != None:
+            self.spill.close()
+            self.spill = None
+        if columns != None:
+            out = self.openFile(self.path)
+            out.write('%s\n' % ','.join(columns))
+            if self.spillPath != None:
+                slots = [self.slots.get(col) for col in columns]
+                f = open(self.spillPath, 'rb')
+                while True:
+                    try:
+                        row = marshal.load(f)
+                    except EOFError:
+                        break
+                    values = []
+                    for slot in slots:
+                        if slot != None and slot < len(row):
+                            values.append(row[slot])
+                        else:
+                            values.append('')
+                    out.write('%s\n' % ','.join(values))
+                f.close()
+            out.close()
@@ -0,0 +1,246 @@
+"""
+Ingest engine shared by the scripts loading the XML and the JSON files.
+
+A reader (see readers.py) turns an input file into a stream of node events,
+and the engine consumes the events to infer the tables (their columns,
+their references to the parent tables and the types of their columns)
+and to load their rows. The events are tuples whose first item is their kind:
+
+    - (TABLE, table, parent): a table referencing a parent table (None for
+      a top level table), without a row
+    - (START, node): the start of the row of a node, in the table node.table
+      and referencing the row of node.parent (None for a top level row)
+    - (COLUMN, node, column): a column of the table of a node, without a value
+    - (VALUE, node, column, value): a value of a column of a node, None for no value
+    - (TEXT, node, column, value): a value of a text column of a node,
+      such as the joined values of a multi valued column
+    - (END, node): the end of the row of a node
+
+The row of a node is reserved when it starts, so the ids follow the order
+of the nodes in the file, and it is stored when it ends. A node may get
+its values after the start of other nodes (the streaming readers).
+"""
+
+from multicelldb.store import ColumnStore
+from multicelldb.schema import Schema
+from multicelldb.inference import TypeInference
+
+TABLE = 0
+START = 1
+COLUMN = 2
+VALUE = 3
+TEXT = 4
+END = 5
+
+"""
+An input file which can not be ingested
+"""
+class InputError (Exception):
+    pass
+
+"""
+A node of an input file with a row in a table
+"""
+class Node (object):
+
+    __slots__ = ['table', 'parent', 'row', 'obj']
+
+    def __init__(self, table, parent=None):
+        self.table = table
+        self.parent = parent
+        self.row = None
+        self.obj = None
+
+"""
+Engine inferring and loading the tables from the events of the input files
+"""
+class Engine (object):
+
+    def __init__(self, schema=None, tablesData=None, columnTypes=None, newStore=None, columnType=None):
+        self.schema = schema
+        if self.schema == None:
+            self.schema = Schema()
+        self.tablesData = tablesData
+        if self.tablesData == None:
+            self.tablesData = {}
+        self.columnTypes = columnTypes
+        if self.columnTypes == None:
+            self.columnTypes = {}
+        self.inference = TypeInference(self.columnTypes)
+        self.newStore = newStore
+        if self.newStore == None:
+            self.newStore = lambda table: ColumnStore()
+        self.columnType = columnType
+
+    """
+    Infer the type of a column from a value, unless the column has a known type
+    """
+    def addValue(self, table, column, value):
+        if self.columnType != None:
+            col_type = self.columnType(table, column)
+            if col_type != None:
+                self.inference.setType(table, column, col_type)
+                return
+        self.inference.add(table, column, value)
+
+    """
+    Widen the type of a column
+    """
+    def setType(self, table, column, col_type):
+        self.inference.setType(table, column, col_type)
+
+    """
+    Classify the values still buffered by the type inference
+    """
+    def flush(self):
+        self.inference.flush()
+
+    """
+    Infer the tables definitions and the columns types from the events of a file
+    """
+    def infer(self, events):
+        schema = self.schema
+        definitions = schema.definitions
+        addValue = self.addValue if self.columnType != None else self.inference.add
+        setType = self.inference.setType
+        for event in events:
+            kind = event[0]
+            if kind == VALUE:
+                table = event[1].table
+                columns = definitions[table]
+                if event[2] not in columns.members:
+                    columns.add(event[2])
+                addValue(table, event[2], event[3])
+            elif kind == START:
+                self.addTable(event[1])
+            elif kind == TEXT:
+                table = event[1].table
+                definitions[table].add(event[2])
+                setType(table, event[2], 'text')
+            elif kind == COLUMN:
+                definitions[event[1].table].add(event[2])
+            elif kind == TABLE:
+                schema.addTable(event[1], event[2])
+
+    """
+    Load the rows from the events of a file, the tables being already inferred
+    """
+    def load(self, events):
+        tablesData = self.tablesData
+        for event in events:
+            kind = event[0]
+            if kind == VALUE or kind == TEXT:
+                if event[3] != None:
+                    event[1].obj[event[2]] = event[3]
+            elif kind == START:
+                self.startRow(event[1])
+            elif kind == END:
+                node = event[1]
+                tablesData[node.table]['data'].fill(node.row, node.obj)
+
+    """
+    Infer the tables and load the rows from the events of a file, in a single pass
+    """
+    def ingest(self, events):
+        schema = self.schema
+        definitions = schema.definitions
+        tablesData = self.tablesData
+        addValue = self.addValue if self.columnType != None else self.inference.add
+        for event in events:
+            kind = event[0]
+            if kind == VALUE:
+                node = event[1]
+                columns = definitions[node.table]
+                if event[2] not in columns.members:
+                    columns.add(event[2])
+                addValue(node.table, event[2], event[3])
+                if event[3] != None:
+                    node.obj[event[2]] = event[3]
+            elif kind == START:
+                self.addTable(event[1])
+                self.startRow(event[1])
+            elif kind == END:
+                node = event[1]
+                tablesData[node.table]['data'].fill(node.row, node.obj)
+            elif kind == TEXT:
+                node = event[1]
+                definitions[node.table].add(event[2])
+                self.inference.setType(node.table, event[2], 'text')
+                if event[3] != None:
+                    node.obj[event[2]] = event[3]
+            elif kind == COLUMN:
+                definitions[event[1].table].add(event[2])
+            elif kind == TABLE:
+                schema.addTable(event[1], event[2])
+
+    """
+    Register the table of a node and its reference to the parent table
+    """
+    def addTable(self, node):
+        if node.parent != None:
+            self.schema.addTable(node.table, node.parent.table)
+        else:
+            self.schema.addTable(node.table)
+
+    """
+    Reserve the row of a node, setting its id and the reference to the parent row
+    """
+    def startRow(self, node):
+        data = self.tablesData.get(node.table)
+        if data == None:
+            data = {'id': 0, 'data': self.newStore(node.table)}
+            self.tablesData[node.table] = data
+        data['id'] = data['id'] + 1
+        node.row = data['data'].reserve()
+        node.obj = {'id': data['id']}
+        parent = node.parent
+        if parent != None and self.schema.isReference(node.table, parent.table):
+            node.obj['%s_id' % parent.table] = parent.obj['id']
+
+    """
+    Merge the tables definitions, the columns types and the rows inferred and
+    loaded from a file by another engine (a worker process).
+    The ids of the rows are renumbered after the ones already loaded.
+    """
+    def merge(self, partial):
+        self.mergeInference(partial)
+        offsets = {}
+        for table in partial['tablesData']:
+            if table not in self.tablesData:
+                self.tablesData[table] = {'id': 0, 'data': self.newStore(table)}
+            offsets[table] = self.tablesData[table]['id']
+        for table,data in partial['tablesData'].items():
+            columnOffsets = {'id': offsets[table]}
+            for ref in partial['tablesReferences'].get(table, []):
+                if ref in offsets:
+                    columnOffsets['%s_id' % ref] = offsets[ref]
+            self.tablesData[table]['data'].extend(data['data'], columnOffsets)
+            self.tablesData[table]['id'] = self.tablesData[table]['id'] + data['id']
+
+    """
+    Merge the tables definitions and the columns types inferred by another engine
+    """
+    def mergeInference(self, partial):
+        self.schema.update(partial['tablesNames'], partial['tablesDefinitions'], partial['tablesReferences'])
+        for table,columns in partial['columnTypes'].items():
+            for col,col_type in columns.items():
+                self.setType(table, col, col_type)
+
+    """
+    Get the tables definitions and the columns types inferred by the engine,
+    as plain lists and dictionaries
+    """
+    def getInference(self):
+        schema = self.schema
+        inference = {}
+        inference['tablesNames'] = list(schema.names)
+        inference['tablesDefinitions'] = dict([(table, list(columns)) for table,columns in schema.definitions.iteritems()])
+        inference['tablesReferences'] = dict([(table, list(parents)) for table,parents in schema.references.iteritems()])
+        inference['columnTypes'] = self.columnTypes
+        return inference
+
+    """
+    Get the current ids of the tables
+    """
+    def getIds(self):
+        return dict([(table, data['id']) for table,data in self.tablesData.iteritems()])
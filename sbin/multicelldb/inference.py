@@ -0,0 +1,198 @@
+"""
+Inference of the SQL types of the columns from their values.
+
+The values of a column are buffered and classified in batches: the distinct
+values of a batch are matched at once against precompiled patterns, and only
+when the whole batch is not numeric the values are classified one by one.
+The type of a column only widens, along the lattice
+
+    int2 -> int4 -> int8 -> float8 -> text
+                     int8 -> numeric -> text
+    boolean -> text
+    timestamptz -> text
+
+where two types without an order between them widen to text. The integers
+beyond the range of int8 are numeric, so that they keep their precision,
+and the values looking like timestamps are timestamps only if they are
+valid dates and times.
+"""
+
+import re
+from datetime import datetime
+
+"""
+The number of values buffered for a column before they are classified
+"""
+BATCH_SIZE = 1024
+
+"""
+The numeric types, from the narrowest to the widest
+"""
+NUMERIC_TYPES = ['int2', 'int4', 'int8', 'float8']
+
+"""
+The type of the integers beyond the range of int8
+"""
+DECIMAL_TYPE = 'numeric'
+
+"""
+The integer types, with their ranges
+"""
+INTEGER_RANGES = [('int2', -2**15, 2**15 - 1), ('int4', -2**31, 2**31 - 1), ('int8', -2**63, 2**63 - 1)]
+INTEGER_TYPES = [col_type for col_type,minimum,maximum in INTEGER_RANGES]
+
+"""
+The integers longer than this length may be beyond the range of int8
+"""
+LONG_INTEGER_LENGTH = len(str(2**63)) - 1
+
+"""
+The separator of the values of a batch; it is not allowed in XML
+"""
+SEPARATOR = '\x00'
+
+INTEGER = r'[ \t\r\n]*[-+]?[0-9]+[ \t\r\n]*'
+FLOAT = r'[ \t\r\n]*(?:[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|[-+]?(?:inf|infinity)|nan)[ \t\r\n]*'
+
+INTEGER_PATTERN = re.compile(r'%s\Z' % INTEGER)
+FLOAT_PATTERN = re.compile(r'%s\Z' % FLOAT, re.IGNORECASE)
+INTEGERS_PATTERN = re.compile(r'(?:%s%s)*%s\Z' % (INTEGER, SEPARATOR, INTEGER))
+FLOATS_PATTERN = re.compile(r'(?:%s%s)*%s\Z' % (FLOAT, SEPARATOR, FLOAT), re.IGNORECASE)
+BOOLEAN_PATTERN = re.compile(r'[ \t\r\n]*(?:true|false)[ \t\r\n]*\Z', re.IGNORECASE)
+TIMESTAMP_PATTERN = re.compile(r'[ \t\r\n]*([0-9]{4})-([0-9]{2})-([0-9]{2})(?:[T ]([0-9]{2}):([0-9]{2})(?::([0-9]{2})(?:\.[0-9]+)?)?)?(?:Z|[-+]([0-9]{2})(?::?([0-9]{2}))?)?[ \t\r\n]*\Z')
+
+"""
+The largest hour of a time zone offset accepted by PostgreSQL
+"""
+MAX_ZONE_HOUR = 15
+
+"""
+Get the narrowest type including two types
+"""
+def widen(type1, type2):
+    if type1 == None or type1 == type2:
+        return type2
+    if type2 == None:
+        return type1
+    if type1 in NUMERIC_TYPES and type2 in NUMERIC_TYPES:
+        return NUMERIC_TYPES[max(NUMERIC_TYPES.index(type1), NUMERIC_TYPES.index(type2))]
+    if type1 == DECIMAL_TYPE and type2 in INTEGER_TYPES or type2 == DECIMAL_TYPE and type1 in INTEGER_TYPES:
+        return DECIMAL_TYPE
+    return 'text'
+
+"""
+Get the narrowest type of integers between two bounds
+"""
+def integerType(low, high):
+    for col_type,minimum,maximum in INTEGER_RANGES:
+        if low >= minimum and high <= maximum:
+            return col_type
+    return DECIMAL_TYPE
+
+"""
+Check if a value matching the timestamp pattern is a valid date and time
+"""
+def isTimestamp(match):
+    year,month,day,hour,minute,second,zoneHour,zoneMinute = match.groups()
+    try:
+        datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        return False
+    return int(zoneHour or 0) <= MAX_ZONE_HOUR and int(zoneMinute or 0) < 60
+
+"""
+Get the type of a single value
+"""
+def valueType(value):
+    if INTEGER_PATTERN.match(value):
+        number = int(value)
+        return integerType(number, number)
+    if FLOAT_PATTERN.match(value):
+        return 'float8'
+    if BOOLEAN_PATTERN.match(value):
+        return 'boolean'
+    match = TIMESTAMP_PATTERN.match(value)
+    if match != None and isTimestamp(match):
+        return 'timestamptz'
+    return 'text'
+
+"""
+Get the type of a batch of values
+"""
+def batchType(values):
+    joined = SEPARATOR.join(values)
+    if joined.count(SEPARATOR) == len(values) - 1:
+        if INTEGERS_PATTERN.match(joined):
+            numbers = [int(value) for value in values]
+            return integerType(min(numbers), max(numbers))
+        if FLOATS_PATTERN.match(joined):
+            col_type = 'float8'
+            for value in values:
+                if len(value) > LONG_INTEGER_LENGTH and INTEGER_PATTERN.match(value):
+                    col_type = widen(col_type, valueType(value))
+            return col_type
+    col_type = None
+    for value in values:
+        col_type = widen(col_type, valueType(value))
+        if col_type == 'text':
+            break
+    return col_type
+
+"""
+The types of the columns of the tables, inferred from their values
+"""
+class TypeInference (object):
+
+    def __init__(self, columnTypes, batchSize=BATCH_SIZE):
+        self.columnTypes = columnTypes
+        self.batchSize = batchSize
+        self.pending = {}
+
+    """
+    Add a value of a column; the values None do not change the type
+    """
+    def add(self, table, column, value):
+        if value == None:
+            return
+        types = self.columnTypes.get(table)
+        if types != None and types.get(column) == 'text':
+            return
+        columns = self.pending.get(table)
+        if columns == None:
+            columns = {}
+            self.pending[table] = columns
+        values = columns.get(column)
+        if values == None:
+            values = set()
+            columns[column] = values
+        values.add(value)
+        if len(values) >= self.batchSize:
+            self.classify(table, column, values)
+            del columns[column]
+
+    """
+    Widen the type of a column with a known type
+    """
+    def setType(self, table, column, col_type):
+        types = self.columnTypes.get(table)
+        if types == None:
+            types = {}
+            self.columnTypes[table] = types
+        types[column] = widen(types.get(column), col_type)
+
+    """
+    Widen the type of a column with the type of a batch of its values
+    """
+    def classify(self, table, column, values):
+        if self.columnTypes.get(table, {}).get(column) == 'text':
+            return
+        self.setType(table, column, batchType(list(values)))
+
+    """
+    Classify the values still buffered
+    """
+    def flush(self):
+        for table,columns in self.pending.iteritems():
+            for column,values in columns.iteritems():
+                self.classify(table, column, values)
+        self.pending = {}
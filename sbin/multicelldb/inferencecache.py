@@ -0,0 +1,104 @@
+"""
+Cache of the tables inferred from each input file, for the reruns on a corpus
+which did not change, or only partly.
+
+The cache records for each file the SHA-1 of its content and the tables
+definitions, the references and the columns types inferred from that file
+alone. The inference pass does not parse a file whose content did not change:
+its cached inference is merged instead, in the order of the files. As the
+tables, the columns and the references are merged in their order of appearance,
+and the columns types only widen, the result is the same as the inference
+of all the files.
+
+The cache is discarded as a whole when its key changes: the key identifies
+the reader and the settings which the inference depends on.
+"""
+
+import os
+import sys
+import json
+import hashlib
+from multicelldb.engine import Engine
+
+"""
+The version of the cache format and of the type inference, part of its key
+"""
+VERSION = 2
+
+"""
+Get the SHA-1 of a file content
+"""
+def fileHash(path):
+    digest = hashlib.sha1()
+    f = open(path, 'rb')
+    while True:
+        buf = f.read(1024 * 1024)
+        if not buf:
+            break
+        digest.update(buf)
+    f.close()
+    return digest.hexdigest()
+
+"""
+Get the key of a cache from the settings of the inference
+"""
+def cacheKey(*settings):
+    return hashlib.sha1(json.dumps([VERSION] + list(settings), sort_keys=True)).hexdigest()
+
+"""
+Cache of the inference of the files of an input directory
+"""
+class InferenceCache (object):
+
+    def __init__(self, path, input, key):
+        self.path = path
+        self.input = input
+        self.key = key
+        self.files = {}
+        self.current = {}
+        self.hits = 0
+
+    """
+    Read the cache of the previous runs, if any and if it has the same key
+    """
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path, 'r')
+        try:
+            cache = json.load(f)
+        except ValueError as e:
+            sys.stderr.write('WARNING: Malformed inference cache, it is ignored: %s\n' % e)
+            f.close()
+            return
+        else:
+            f.close()
+        if isinstance(cache, dict) and cache.get('key') == self.key:
+            self.files = cache.get('files', {})
+
+    """
+    Merge into an engine the inference of a file: the cached one if the file did
+    not change, otherwise the one of a new engine (given by newEngine) from the
+    events of the file (given by getEvents)
+    """
+    def infer(self, engine, f, getEvents, newEngine=Engine):
+        sha1 = fileHash('%s/%s' % (self.input, f))
+        entry = self.files.get(f)
+        if entry != None and entry['sha1'] == sha1:
+            self.hits += 1
+        else:
+            fileEngine = newEngine()
+            fileEngine.infer(getEvents())
+            fileEngine.flush()
+            entry = {'sha1': sha1, 'inference': fileEngine.getInference()}
+        self.current[f] = entry
+        engine.mergeInference(entry['inference'])
+
+    """
+    Save the cache of the current run; the files which were not inferred are dropped
+    """
+    def save(self):
+        out = open('%s.tmp' % self.path, 'w')
+        out.write('%s\n' % json.dumps({'key': self.key, 'files': self.current}, sort_keys=True))
+        out.close()
+        os.rename('%s.tmp' % self.path, self.path)
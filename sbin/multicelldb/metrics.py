@@ -0,0 +1,115 @@
+"""
+Metrics of a run of a script, written as a JSON file.
+
+The metrics are:
+
+    - the time of each phase (in the order the phases were started)
+    - the counters (files, cached files, elements, rows, bytes) and their rates over the run
+    - the rows and the bytes written for each table
+    - the peak RSS of the script process and of its worker processes
+    - the slowest input files
+
+Without a file name, the metrics are still collected but not written,
+and the costly ones (the number of elements of the input files) are skipped.
+"""
+
+import os
+import time
+import json
+import heapq
+import resource
+
+"""
+The number of slowest files reported
+"""
+SLOWEST_FILES = 10
+
+"""
+Metrics of a run
+"""
+class Metrics (object):
+
+    def __init__(self, path=None, enabled=None):
+        self.path = path
+        self.enabled = enabled
+        if self.enabled == None:
+            self.enabled = path != None
+        self.started = time.time()
+        self.phases = []
+        self.times = {}
+        self.running = {}
+        self.counters = {}
+        self.tables = {}
+        self.files = {}
+
+    """
+    Start timing a phase
+    """
+    def start(self, phase):
+        if phase not in self.times:
+            self.phases.append(phase)
+            self.times[phase] = 0.0
+        self.running[phase] = time.time()
+
+    """
+    Stop timing a phase; the time of a phase run several times is accumulated
+    """
+    def stop(self, phase):
+        self.times[phase] += time.time() - self.running.pop(phase)
+
+    """
+    Increment a counter
+    """
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    """
+    Record the time spent on an input file, and the number of its elements
+    """
+    def fileParsed(self, f, elapsed, elements=0):
+        self.files[f] = self.files.get(f, 0.0) + elapsed
+        self.count('elements', elements)
+
+    """
+    Record the rows and the bytes written for a table
+    """
+    def table(self, table, rows, size):
+        self.tables[table] = {'rows': rows, 'bytes': size}
+        self.count('rows', rows)
+        self.count('bytes', size)
+
+    """
+    Get the metrics as a JSON object
+    """
+    def report(self):
+        elapsed = time.time() - self.started
+        counters = dict(self.counters)
+        counters['files'] = len(self.files)
+        rates = {}
+        for name,value in counters.iteritems():
+            if elapsed > 0:
+                rates['%s_per_s' % name] = value / elapsed
+        slowest = heapq.nlargest(SLOWEST_FILES, self.files.iteritems(), key=lambda item: item[1])
+        return {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'pid': os.getpid(),
+            'elapsed': elapsed,
+            'phases': [{'name': phase, 'seconds': self.times[phase]} for phase in self.phases],
+            'counters': counters,
+            'rates': rates,
+            'tables': self.tables,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'workers_peak_rss_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            'slowest_files': [{'file': f, 'seconds': seconds} for f,seconds in slowest],
+        }
+
+    """
+    Write the metrics to the JSON file
+    """
+    def write(self):
+        if self.path == None:
+            return
+        out = open('%s.tmp' % self.path, 'w')
+        out.write('%s\n' % json.dumps(self.report(), indent=4, sort_keys=True))
+        out.close()
+        os.rename('%s.tmp' % self.path, self.path)
@@ -0,0 +1,73 @@
+"""
+Ordering of the tables such that a table comes after the tables it references.
+
+The order is the one of the repeated scans of the tables names done so far by the
+scripts: a scan appends, in the order of the names, every table whose references
+were already appended, and the scans are repeated until no table is left. Here
+the scan in which a table is appended is computed once, from the ones of the
+tables it references, in time linear in the number of tables and references.
+A table referencing itself does not wait for itself, and a reference to a
+table which is not in the names is ignored.
+"""
+
+"""
+Error raised when the references of the tables form a cycle
+"""
+class CycleError (Exception):
+
+    def __init__(self, tables):
+        Exception.__init__(self, 'The references of the tables form a cycle: %s' % ' -> '.join(tables))
+        self.tables = tables
+
+"""
+Sort the tables names, such that a table follows the tables it references.
+The references map a table name to the list of the tables it references.
+"""
+def sortTables(names, references):
+    index = dict([(table, i) for i,table in enumerate(names)])
+    waiting = {}
+    referencing = {}
+    for table in names:
+        refs = set([ref for ref in references.get(table, []) if ref != table and ref in index])
+        waiting[table] = len(refs)
+        for ref in refs:
+            referencing.setdefault(ref, []).append(table)
+    scans = {}
+    ready = []
+    for table in names:
+        if waiting[table] == 0:
+            scans[table] = 0
+            ready.append(table)
+    while len(ready) > 0:
+        ref = ready.pop()
+        for table in referencing.get(ref, []):
+            # the same scan as the reference when the table comes after it in the names, else the next one
+            scan = scans[ref]
+            if index[ref] > index[table]:
+                scan += 1
+            scans[table] = max(scans.get(table, 0), scan)
+            waiting[table] -= 1
+            if waiting[table] == 0:
+                ready.append(table)
+    if len([table for table in names if waiting[table] > 0]) > 0:
+        raise CycleError(findCycle(names, references, waiting))
+    passes = [[] for i in xrange(max([0] + scans.values()) + 1)]
+    for table in names:
+        passes[scans[table]].append(table)
+    result = []
+    for tables in passes:
+        result.extend(tables)
+    return result
+
+"""
+Find a cycle among the tables still waiting for their references
+"""
+def findCycle(names, references, waiting):
+    table = [table for table in names if waiting[table] > 0][0]
+    path = []
+    position = {}
+    while table not in position:
+        position[table] = len(path)
+        path.append(table)
+        table = [ref for ref in references[table] if ref != table and waiting.get(ref, 0) > 0][0]
+    return path[position[table]:] + [table]
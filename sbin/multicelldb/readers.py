@@ -0,0 +1,516 @@
+"""
+Readers turning the XML and the JSON files into the node events of the engine.
+
+An XML element with attributes or with child elements is a row of the table
+named by its tag, referencing the row of its parent element. Its attributes
+are columns of its table. A leaf element is a column of the table of its parent,
+or, if it has attributes, the text column of its own table. The leaves with
+the same tag under the same parent are a multi valued column: their texts
+are joined with commas.
+
+A JSON object value is a row of the table named by its key, and an array
+value has a row for each of its objects. The string, the null and the
+string array values are columns of the table of their object, the string
+arrays being joined with commas. The other values are ignored.
+
+The JSON documents mostly share one structure, so the reader learns the
+shape of the value of each key of each table (a scalar, a string array, an
+object or an array of objects), and checks first that a value has the shape
+of its key, with a cheap test of its type, before falling back to the full
+inspection of the value, which updates the shape of the key.
+
+A JSON file is either parsed at once, or streamed with a bounded buffer:
+the values smaller than the buffer are decoded at once by the json module,
+and only the larger objects and arrays are parsed incrementally, such that
+the bytes of the file are parsed about once. The keys of the streamed
+objects are in the order of the file, instead of the order of the parsed
+dictionaries.
+"""
+
+import re
+import json
+import xml.etree.ElementTree as ET
+from multicelldb.engine import Node, InputError, TABLE, START, COLUMN, VALUE, TEXT, END
+
+"""
+The size of the buffer of the streamed JSON files, and of the reads of the file
+"""
+BUFFER_SIZE = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+"""
+The JSON whitespace
+"""
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+"""
+The shapes of the values of the JSON keys: a string or null value, a string
+array, an object (a row of a child table), an array of objects (the rows
+of a child table) and a value which is ignored
+"""
+SCALAR = 0
+STRINGS = 1
+OBJECT = 2
+ARRAY = 3
+IGNORED = 4
+
+"""
+The types of the ignored JSON values
+"""
+IGNORED_TYPES = (int, long, float, bool)
+
+"""
+Group the texts of the children of an element by their tag
+"""
+def getSiblings(elem):
+    siblings = {'texts': {}, 'joined': {}}
+    for child in elem:
+        siblings['texts'].setdefault(child.tag, []).append(child.text)
+    return siblings
+
+"""
+Check if the tag is an array
+"""
+def isMultiValue(elem, siblings):
+    return len(siblings['texts'][elem.tag]) >= 2
+
+"""
+Get the multi value of a tag, joined once for all the siblings
+"""
+def getMultiValue(elem, siblings):
+    value = siblings['joined'].get(elem.tag)
+    if value == None:
+        value = ','.join(siblings['texts'][elem.tag])
+        siblings['joined'][elem.tag] = value
+    return value
+
+"""
+Check if all the values of an array are strings
+"""
+def isStringArray(data):
+    if isinstance(data,list):
+        for value in data:
+            if not isinstance(value, basestring):
+                return False
+        return True
+    return False
+
+"""
+Reader of the XML files.
+The attributes columns are named by the attribute prefix followed by the
+attribute name, and the text column of a leaf with attributes is named
+textColumn (the tag of the leaf by default).
+"""
+class XMLReader (object):
+
+    def __init__(self, attributePrefix='', textColumn=None):
+        self.attributePrefix = attributePrefix
+        self.textColumn = textColumn
+        self.elements = 0
+
+    """
+    Get the column of the text of a leaf
+    """
+    def getTextColumn(self, elem, hasAttributes):
+        if hasAttributes and self.textColumn != None:
+            return self.textColumn
+        return elem.tag
+
+    """
+    Get the events of a parsed XML file
+    """
+    def events(self, root):
+        events = []
+        self.addElement(events, root, None, None)
+        return events
+
+    """
+    Add the events of an element and of its children
+    """
+    def addElement(self, events, elem, parent, siblings):
+        append = events.append
+        attrib = elem.attrib
+        size = len(elem)
+        node = None
+        if attrib or size > 0:
+            node = Node(elem.tag, parent)
+            append((START, node))
+            prefix = self.attributePrefix
+            for attr,value in attrib.iteritems():
+                append((VALUE, node, prefix + attr, value))
+        if size == 0:
+            if parent == None:
+                raise InputError('Unexpected parent: None')
+            value = elem.text
+            multiValue = len(siblings['texts'][elem.tag]) >= 2
+            if value != None and multiValue:
+                value = getMultiValue(elem, siblings)
+            if attrib:
+                append((TEXT if multiValue else VALUE, node, self.textColumn or elem.tag, value))
+            else:
+                append((TEXT if multiValue else VALUE, parent, elem.tag, value))
+        else:
+            siblings = getSiblings(elem)
+            for child in elem:
+                self.addElement(events, child, node, siblings)
+        if node != None:
+            append((END, node))
+
+    """
+    Parse incrementally an XML file, generating its events.
+    A leaf is known to be multi valued only when its parent ends,
+    so the values of the leaves are generated at the end of their parent,
+    after which the parsed elements are dropped from the tree.
+    The number of the parsed elements is counted in self.elements.
+    """
+    def stream(self, path):
+        self.elements = 0
+        stack = []
+        for event, elem in ET.iterparse(path, events=('start', 'end')):
+            if event == 'start':
+                self.elements += 1
+                parent = None
+                if len(stack) > 0:
+                    parent = stack[-1]
+                    if parent['node'] == None:
+                        parent['node'] = Node(parent['elem'].tag, parent['parent']['node'] if parent['parent'] != None else None)
+                        yield (START, parent['node'])
+                    parent['children'] = parent['children'] + 1
+                frame = {'elem': elem, 'parent': parent, 'node': None, 'children': 0, 'siblings': {'texts': {}, 'joined': {}}, 'leaves': []}
+                frame['hasAttributes'] = len(elem.attrib) > 0
+                if frame['hasAttributes']:
+                    node = Node(elem.tag, parent['node'] if parent != None else None)
+                    frame['node'] = node
+                    yield (START, node)
+                    for attr,value in elem.attrib.iteritems():
+                        yield (VALUE, node, self.attributePrefix + attr, value)
+                stack.append(frame)
+            else:
+                frame = stack.pop()
+                parent = frame['parent']
+                if frame['children'] == 0:
+                    if parent == None:
+                        raise InputError('Unexpected parent: None')
+                    yield (COLUMN, frame['node'] if frame['hasAttributes'] else parent['node'], self.getTextColumn(elem, frame['hasAttributes']))
+                    frame['text'] = elem.text
+                    parent['leaves'].append(frame)
+                else:
+                    for leafEvent in self.leavesEvents(frame):
+                        yield leafEvent
+                    yield (END, frame['node'])
+                if parent != None:
+                    parent['siblings']['texts'].setdefault(elem.tag, []).append(elem.text)
+                    del parent['elem'][-1]
+                elem.clear()
+
+    """
+    Get the events of the values of the leaves of an element, at its end
+    """
+    def leavesEvents(self, frame):
+        events = []
+        for leaf in frame['leaves']:
+            elem = leaf['elem']
+            value = leaf['text']
+            multiValue = isMultiValue(elem, frame['siblings'])
+            if value != None and multiValue:
+                value = getMultiValue(elem, frame['siblings'])
+            node = leaf['node'] if leaf['hasAttributes'] else frame['node']
+            events.append((TEXT if multiValue else VALUE, node, self.getTextColumn(elem, leaf['hasAttributes']), value))
+            if leaf['hasAttributes']:
+                events.append((END, leaf['node']))
+        return events
+
+"""
+Reader of the JSON files
+"""
+class JSONReader (object):
+
+    def __init__(self):
+        self.shapes = {}
+
+    """
+    Get the events of a parsed JSON file
+    """
+    def events(self, data):
+        events = []
+        if isinstance(data, dict):
+            self.addObject(events, data, None)
+        elif isinstance(data, list):
+            self.addArray(events, data, None, None)
+        elif not isinstance(data, basestring):
+            raise InputError('Unknown type: %s' % data)
+        return events
+
+    """
+    Add the events of the values of an object.
+    A value with the shape of its key is added directly,
+    otherwise its shape is found by addValue.
+    """
+    def addObject(self, events, data, node):
+        append = events.append
+        table = node.table if node != None else None
+        shapes = self.shapes.get(table)
+        if shapes == None:
+            shapes = {}
+            self.shapes[table] = shapes
+        for key,value in data.iteritems():
+            shape = shapes.get(key)
+            if shape == SCALAR:
+                if value is None or type(value) is unicode:
+                    append((VALUE, node, key, value))
+                    continue
+            elif shape == OBJECT:
+                if type(value) is dict:
+                    self.addRow(events, value, key, node)
+                    continue
+            elif shape == STRINGS:
+                if type(value) is list:
+                    try:
+                        append((TEXT, node, key, ','.join(value)))
+                        continue
+                    except TypeError:
+                        pass
+            elif shape == ARRAY:
+                if type(value) is list and len(value) > 0 and type(value[0]) is dict:
+                    append((TABLE, key, table))
+                    self.addArray(events, value, key, node)
+                    continue
+            elif shape == IGNORED:
+                if type(value) in IGNORED_TYPES:
+                    continue
+            shapes[key] = self.addValue(events, key, value, node)
+
+    """
+    Add the events of the value of a key of an object, returning its shape
+    """
+    def addValue(self, events, key, value, node):
+        if value == None or isinstance(value, basestring):
+            if node == None:
+                raise InputError('Unexpected table name: None')
+            events.append((VALUE, node, key, value))
+            return SCALAR
+        elif isinstance(value, dict):
+            self.addRow(events, value, key, node)
+            return OBJECT
+        elif isStringArray(value):
+            if node == None:
+                raise InputError('Unexpected table name: None')
+            events.append((TEXT, node, key, ','.join(value)))
+            return STRINGS
+        elif isinstance(value, list):
+            events.append((TABLE, key, node.table if node != None else None))
+            self.addArray(events, value, key, node)
+            return ARRAY
+        return IGNORED
+
+    """
+    Add the events of the row of an object
+    """
+    def addRow(self, events, data, table, parent):
+        node = Node(table, parent)
+        events.append((START, node))
+        self.addObject(events, data, node)
+        events.append((END, node))
+
+    """
+    Add the events of the objects of an array, the nested arrays being flattened
+    """
+    def addArray(self, events, data, table, parent):
+        for value in data:
+            if isinstance(value, dict):
+                if table == None:
+                    self.addObject(events, value, None)
+                else:
+                    self.addRow(events, value, table, parent)
+            elif isinstance(value, list):
+                self.addArray(events, value, table, parent)
+            elif not isinstance(value, basestring):
+                raise InputError('Unknown type: %s' % value)
+
+    """
+    Parse incrementally a JSON file, generating its events
+    """
+    def stream(self, f, bufferSize=BUFFER_SIZE):
+        stream = JSONStream(f, bufferSize)
+        c = stream.peek()
+        if c == '{' or c == '[':
+            decoded, data = stream.decode()
+            if decoded:
+                for event in self.events(data):
+                    yield event
+            elif c == '{':
+                stream.next()
+                for event in self.streamObject(stream, None):
+                    yield event
+            else:
+                for event in self.streamArray(stream, None, None, False):
+                    yield event
+        else:
+            decoded, data = stream.decode()
+            self.events(data)
+        if stream.peek() != '':
+            raise InputError('Extra data at %d' % stream.offset())
+
+    """
+    Generate the events of the values of a streamed object, after its opening brace
+    """
+    def streamObject(self, stream, node):
+        if stream.peek() == '}':
+            stream.next()
+            return
+        while True:
+            decoded, key = stream.decode()
+            if not decoded or not isinstance(key, basestring):
+                raise InputError('Expecting a property name at %d' % stream.offset())
+            stream.expect(':')
+            decoded, value = stream.decode()
+            if decoded:
+                events = []
+                self.addObject(events, {key: value}, node)
+                for event in events:
+                    yield event
+            elif stream.peek() == '{':
+                stream.next()
+                child = Node(key, node)
+                yield (START, child)
+                for event in self.streamObject(stream, child):
+                    yield event
+                yield (END, child)
+            else:
+                for event in self.streamArray(stream, key, node, True):
+                    yield event
+            if stream.expect(',}') == '}':
+                return
+
+    """
+    Generate the events of a streamed array, the nested arrays being flattened.
+    The array of an object value is a string array column until a value which
+    is not a string, the table of the array being generated at that value.
+    """
+    def streamArray(self, stream, table, parent, isValue):
+        stream.expect('[')
+        strings = [] if isValue else None
+        if stream.peek() == ']':
+            stream.next()
+        else:
+            while True:
+                decoded, value = stream.decode()
+                if strings != None:
+                    if decoded and isinstance(value, basestring):
+                        strings.append(value)
+                    else:
+                        strings = None
+                        yield (TABLE, table, parent.table if parent != None else None)
+                if strings == None:
+                    if decoded:
+                        events = []
+                        self.addArray(events, [value], table, parent)
+                        for event in events:
+                            yield event
+                    elif stream.peek() == '{':
+                        stream.next()
+                        if table == None:
+                            for event in self.streamObject(stream, None):
+                                yield event
+                        else:
+                            node = Node(table, parent)
+                            yield (START, node)
+                            for event in self.streamObject(stream, node):
+                                yield event
+                            yield (END, node)
+                    else:
+                        for event in self.streamArray(stream, table, parent, False):
+                            yield event
+                if stream.expect(',]') == ']':
+                    break
+        if strings != None:
+            if parent == None:
+                raise InputError('Unexpected table name: None')
+            yield (TEXT, parent, table, ','.join(strings))
+
+"""
+Buffered reader of the values of a JSON file.
+The file is read by chunks into a buffer, from which the values are decoded
+with the json module. A value which is not complete in the buffer is decoded
+again once more of the file is read, unless it is an object or an array
+larger than the buffer size, which is then left to be parsed incrementally.
+"""
+class JSONStream (object):
+
+    def __init__(self, f, bufferSize=BUFFER_SIZE):
+        self.f = f
+        self.bufferSize = bufferSize
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    """
+    Get the offset of the current position in the file
+    """
+    def offset(self):
+        return self.consumed + self.pos
+
+    """
+    Read more of the file into the buffer, dropping its parsed part.
+    The read size grows with the pending part, such that a value is decoded
+    a bounded number of times. Returns False at the end of the file.
+    """
+    def fill(self):
+        if self.eof:
+            return False
+        data = self.f.read(max(CHUNK_SIZE, len(self.buffer) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    """
+    Skip the whitespace, returning the next character ('' at the end of the file)
+    """
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    """
+    Skip the next character
+    """
+    def next(self):
+        self.pos += 1
+
+    """
+    Skip the next character, which must be one of the given characters, and return it
+    """
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise InputError('Expecting %s at %d' % (' or '.join(["'%s'" % char for char in chars]), self.offset()))
+        self.pos += 1
+        return c
+
+    """
+    Decode the next value, returning (True, value), or (False, None) for
+    an object or an array larger than the buffer size, which is not consumed
+    """
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return True, value
+            except ValueError as e:
+                if self.eof:
+                    raise InputError('Invalid JSON at %d: %s' % (self.offset(), e))
+                if len(self.buffer) - self.pos >= self.bufferSize and self.buffer[self.pos] in '{[':
+                    return False, None
+            self.fill()
@@ -0,0 +1,97 @@
+"""
+Model of the tables inferred from the input files.
+
+The tables names, the columns of each table and the parent tables referenced
+by each table are kept in insertion order, as they are written in this order,
+but their membership is tested in constant time.
+"""
+
+"""
+A list without duplicates, with a constant time membership test.
+Appending an item already in the list does nothing.
+"""
+class OrderedSet (list):
+
+    def __init__(self, items=[]):
+        list.__init__(self)
+        self.members = set()
+        self.extend(items)
+
+    def __contains__(self, item):
+        return item in self.members
+
+    """
+    Append an item if it is not in the list yet, returning True if it was appended
+    """
+    def add(self, item):
+        if item in self.members:
+            return False
+        self.members.add(item)
+        list.append(self, item)
+        return True
+
+    def append(self, item):
+        self.add(item)
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def __reduce__(self):
+        return (OrderedSet, (list(self),))
+
+"""
+The tables names, their columns and their references to the parent tables
+"""
+class Schema (object):
+
+    def __init__(self, names=None, definitions=None, references=None):
+        self.names = names
+        if self.names == None:
+            self.names = OrderedSet()
+        self.definitions = definitions
+        if self.definitions == None:
+            self.definitions = {}
+        self.references = references
+        if self.references == None:
+            self.references = {}
+
+    """
+    Register a table and its reference to the parent table
+    """
+    def addTable(self, table, parent=None):
+        if table not in self.definitions:
+            self.names.add(table)
+            self.definitions[table] = OrderedSet()
+        if parent != None:
+            references = self.references.get(table)
+            if references == None:
+                references = OrderedSet()
+                self.references[table] = references
+            references.add(parent)
+
+    """
+    Register a column of a table
+    """
+    def addColumn(self, table, column):
+        self.definitions[table].add(column)
+
+    """
+    Check if a table references a parent table
+    """
+    def isReference(self, table, parent):
+        references = self.references.get(table)
+        return references != None and parent in references
+
+    """
+    Add the tables, columns and references of another schema, after the ones already known
+    """
+    def update(self, names, definitions, references):
+        for table in names:
+            self.addTable(table)
+        for table,columns in definitions.iteritems():
+            self.addTable(table)
+            self.definitions[table].extend(columns)
+        for table,parents in references.iteritems():
+            for parent in parents:
+                self.addTable(table, parent)
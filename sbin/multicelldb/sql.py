@@ -0,0 +1,98 @@
+"""
+SQL statements loading the rows of the tables.
+
+The rows are written either as INSERT statements, or as a COPY block per table
+in the PostgreSQL text format, which is much faster to load. The INSERT
+statements have one row, or a batch of consecutive rows with the same columns.
+"""
+
+"""
+The text format of a NULL value in a COPY block
+"""
+COPY_NULL = '\\N'
+
+"""
+Get the columns of a table, in the order of its CREATE TABLE statement:
+the id, the columns which are not a child table referencing the table,
+and the references to the parent tables.
+"""
+def getColumns(schema, table):
+    columns = ['id']
+    for col in schema.definitions[table]:
+        if not schema.isReference(col, table):
+            columns.append(col)
+    for ref in schema.references.get(table, []):
+        columns.append('%s_id' % ref)
+    return columns
+
+"""
+Get the set of columns and values for a row to be inserted into the table
+"""
+def getRow(columns, data):
+    ret={}
+    ret['columns']=[]
+    ret['values']=[]
+    for column,value in zip(columns, data):
+        if value==None:
+            continue
+        ret['columns'].append('"%s"' % column)
+        if isinstance(value,basestring):
+            value = value.replace("'","''")
+        ret['values'].append("'%s'" % value)
+    ret['columns'] = ','.join(ret['columns'])
+    ret['values'] = ','.join(ret['values'])
+    return ret
+
+"""
+Write the INSERT statements of the rows of a table
+"""
+def writeInserts(out, schema, table, store):
+    for data in store.rows(store.columns):
+        row = getRow(store.columns, data)
+        out.write(('INSERT INTO %s."%s" (%s) VALUES(%s);\n' % (schema,table,row['columns'],row['values'])).encode('utf8'))
+
+"""
+Write the multi-row INSERT statements of the rows of a table.
+The consecutive rows with the same columns are grouped in statements of up to
+batchSize rows, so the rows are inserted in the order of their ids: a row may
+reference a previous row of its own table.
+"""
+def writeBatchedInserts(out, schema, table, store, batchSize):
+    columns = None
+    batch = []
+    for data in store.rows(store.columns):
+        row = getRow(store.columns, data)
+        if row['columns'] != columns or len(batch) == batchSize:
+            if len(batch) > 0:
+                writeBatch(out, schema, table, columns, batch)
+            columns = row['columns']
+            batch = []
+        batch.append(row['values'])
+    if len(batch) > 0:
+        writeBatch(out, schema, table, columns, batch)
+
+"""
+Write a multi-row INSERT statement
+"""
+def writeBatch(out, schema, table, columns, batch):
+    values = ',\n'.join(['(%s)' % values for values in batch])
+    out.write(('INSERT INTO %s."%s" (%s) VALUES\n%s;\n' % (schema,table,columns,values)).encode('utf8'))
+
+"""
+Escape a value for the text format of COPY
+"""
+def copyValue(value):
+    if value == None:
+        return COPY_NULL
+    if not isinstance(value, basestring):
+        return str(value)
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+
+"""
+Write the COPY block of the rows of a table
+"""
+def writeCopy(out, schema, table, columns, store):
+    out.write('COPY %s."%s" (%s) FROM stdin;\n' % (schema, table, ','.join(['"%s"' % col for col in columns])))
+    for data in store.rows(columns):
+        out.write(('%s\n' % '\t'.join([copyValue(value) for value in data])).encode('utf8'))
+    out.write('\\.\n')
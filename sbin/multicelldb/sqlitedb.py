@@ -0,0 +1,122 @@
+"""
+SQLite database of the tables, for a local ingest and query of the files.
+
+The tables are created with the SQLite types of their inferred types, and the
+rows are loaded with prepared statements in a single transaction. The references
+to the parent tables are indexed once all the rows are loaded.
+
+The names of the SQLite tables, indexes and columns are case insensitive, so
+a table, an index or a column whose name differs from a previous one only by
+its case is renamed with a trailing underscore.
+"""
+
+import sys
+import os
+import sqlite3
+
+"""
+The SQLite type of each inferred type; the numeric integers do not fit
+the SQLite integers, they are stored as text to keep their precision
+"""
+SQLITE_TYPES = {'int2': 'integer', 'int4': 'integer', 'int8': 'integer', 'numeric': 'text', 'float8': 'real', 'boolean': 'boolean', 'timestamptz': 'text', 'text': 'text'}
+
+"""
+Convert a boolean value, as accepted by PostgreSQL, to an integer
+"""
+def booleanValue(value):
+    return 1 if value.strip().lower() == 'true' else 0
+
+"""
+The conversion of the values of each SQLite type, the other values are stored as text
+"""
+CONVERTERS = {'integer': int, 'real': float, 'boolean': booleanValue}
+
+"""
+Get a name which is not used yet, ignoring the case, by appending underscores,
+and mark it as used
+"""
+def uniqueName(name, used):
+    while name.lower() in used:
+        name = '%s_' % name
+    used.add(name.lower())
+    return name
+
+"""
+SQLite database loading the tables
+"""
+class SQLiteDatabase (object):
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=OFF')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        self.connection.execute('BEGIN')
+        self.types = {}
+        self.names = {}
+        self.tables = {}
+        self.used = set()
+        self.indexes = []
+
+    """
+    Create a table with the given columns; the id and the references are integers,
+    the other columns have the SQLite type of their inferred type (text by default)
+    """
+    def createTable(self, table, columns, columnTypes, references):
+        tableName = uniqueName(table, self.used)
+        if tableName != table:
+            sys.stderr.write('WARNING: Table %s renamed to %s\n' % (table, tableName))
+        self.tables[table] = tableName
+        keys = set(['%s_id' % ref for ref in references])
+        used = set()
+        types = []
+        names = []
+        definitions = []
+        for col in columns:
+            name = uniqueName(col, used)
+            if name != col:
+                sys.stderr.write('WARNING: Column %s.%s renamed to %s\n' % (table, col, name))
+            if col == 'id':
+                col_type = 'integer'
+                definitions.append('"id" integer PRIMARY KEY')
+            else:
+                col_type = 'integer' if col in keys else SQLITE_TYPES[columnTypes.get(col, 'text')]
+                definitions.append('"%s" %s' % (name, col_type))
+            types.append(col_type)
+            names.append(name)
+        for ref in references:
+            name = names[columns.index('%s_id' % ref)]
+            definitions.append('FOREIGN KEY ("%s") REFERENCES "%s" (id)' % (name, self.tables.get(ref, ref)))
+            self.indexes.append((table, name))
+        self.types[table] = types
+        self.names[table] = names
+        self.connection.execute('CREATE TABLE "%s" (%s)' % (tableName, ', '.join(definitions)))
+
+    """
+    Insert the rows of a table from its store, returning the number of rows
+    """
+    def insertRows(self, table, columns, store):
+        converters = [CONVERTERS.get(col_type) for col_type in self.types[table]]
+        statement = 'INSERT INTO "%s" (%s) VALUES (%s)' % (self.tables[table], ','.join(['"%s"' % name for name in self.names[table]]), ','.join(['?'] * len(columns)))
+        def rows():
+            for data in store.rows(columns):
+                for i,value in enumerate(data):
+                    if value != None and converters[i] != None and isinstance(value, basestring):
+                        data[i] = converters[i](value)
+                yield data
+        self.connection.executemany(statement, rows())
+        return len(store)
+
+    """
+    Index the references to the parent tables, and commit the database
+    """
+    def close(self):
+        for table,col in self.indexes:
+            index = '%s_%s_idx' % (self.tables[table], col)
+            name = uniqueName(index, self.used)
+            if name != index:
+                sys.stderr.write('WARNING: Index %s renamed to %s\n' % (index, name))
+            self.connection.execute('CREATE INDEX "%s" ON "%s" ("%s")' % (name, self.tables[table], col))
+        self.connection.execute('COMMIT')
+        self.connection.close()
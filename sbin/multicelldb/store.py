@@ -0,0 +1,188 @@
+"""
+Compact columnar storage for the rows of the tables.
+
+Instead of one dictionary per row, a table keeps one slot per column
+with a value for each row. The integer columns (the id and the references
+to the parent rows) are arrays of machine integers, the other columns are
+lists of values, where the short strings are interned per table.
+"""
+
+from array import array
+
+"""
+The integer stored in an array column for a missing value
+"""
+MISSING_INT = 0
+
+"""
+The strings up to this length are interned
+"""
+INTERN_LENGTH = 64
+
+"""
+Columnar store of the rows of a table
+"""
+class ColumnStore (object):
+
+    def __init__(self, columns=None):
+        self.size = 0
+        self.columns = []
+        self.slots = {}
+        self.values = []
+        self.strings = {}
+        if columns != None:
+            for column in columns:
+                self.addColumn(column)
+        
+    def __len__(self):
+        return self.size
+        
+    """
+    Add a column slot, returning its index
+    """
+    def addColumn(self, column):
+        slot = self.slots.get(column)
+        if slot == None:
+            slot = len(self.columns)
+            self.slots[column] = slot
+            self.columns.append(column)
+            self.values.append(None)
+        return slot
+        
+    """
+    Reserve a row, to be filled later, returning its index
+    """
+    def reserve(self):
+        self.size += 1
+        return self.size - 1
+        
+    """
+    Append a row given as a dictionary, returning its index
+    """
+    def append(self, obj):
+        index = self.reserve()
+        self.fill(index, obj)
+        return index
+        
+    """
+    Set the values of a reserved row from a dictionary
+    """
+    def fill(self, index, obj):
+        for column,value in obj.iteritems():
+            if value != None:
+                self.set(index, column, value)
+        
+    """
+    Set the value of a column in a row
+    """
+    def set(self, index, column, value):
+        slot = self.addColumn(column)
+        values = self.values[slot]
+        isInt = isinstance(value, (int, long)) and not isinstance(value, bool) and value > MISSING_INT
+        if values == None:
+            values = array('l') if isInt else []
+            self.values[slot] = values
+        elif isinstance(values, array) and not isInt:
+            values = [v if v != MISSING_INT else None for v in values]
+            self.values[slot] = values
+        if isinstance(values, array):
+            missing = MISSING_INT
+        else:
+            missing = None
+            if isinstance(value, basestring) and len(value) <= INTERN_LENGTH:
+                value = self.strings.setdefault(value, value)
+        if len(values) <= index:
+            values.extend([missing] * (index - len(values)))
+            values.append(value)
+        else:
+            values[index] = value
+        
+    """
+    Append the rows of another store, column by column, adding an offset to the
+    values of the given columns (the renumbered ids and references)
+    """
+    def extend(self, store, offsets):
+        base = self.size
+        strings = self.strings
+        for column in store.columns:
+            values = store.values[store.slots[column]]
+            if values == None:
+                continue
+            offset = offsets.get(column)
+            if isinstance(values, array):
+                if offset:
+                    values = array('l', [value + offset if value != MISSING_INT else MISSING_INT for value in values])
+            else:
+                values = [strings.setdefault(value, value) if isinstance(value, basestring) and len(value) <= INTERN_LENGTH else value for value in values]
+                if offset:
+                    values = [value + offset if value != None else None for value in values]
+            slot = self.addColumn(column)
+            current = self.values[slot]
+            if current == None:
+                current = array('l') if isinstance(values, array) else []
+                self.values[slot] = current
+            elif isinstance(current, array) and not isinstance(values, array):
+                current = [value if value != MISSING_INT else None for value in current]
+                self.values[slot] = current
+            elif isinstance(values, array) and not isinstance(current, array):
+                values = [value if value != MISSING_INT else None for value in values]
+            missing = MISSING_INT if isinstance(current, array) else None
+            if len(current) < base:
+                current.extend([missing] * (base - len(current)))
+            current.extend(values)
+        self.size = base + store.size
+        
+    """
+    Get the value of a column in a row, None if it is missing
+    """
+    def get(self, index, column):
+        slot = self.slots.get(column)
+        if slot == None:
+            return None
+        values = self.values[slot]
+        if values == None or index >= len(values):
+            return None
+        value = values[index]
+        if isinstance(values, array) and value == MISSING_INT:
+            return None
+        return value
+        
+    """
+    Get a row as a dictionary of its present values
+    """
+    def row(self, index):
+        obj = {}
+        for column in self.columns:
+            value = self.get(index, column)
+            if value != None:
+                obj[column] = value
+        return obj
+        
+    """
+    Get the values of a column for all the rows, a missing value is None
+    """
+    def column(self, column):
+        return [row[0] for row in self.rows([column])]
+        
+    """
+    Iterate over the rows, as lists of the values of the given columns.
+    A missing value is None.
+    """
+    def rows(self, columns):
+        slots = []
+        for column in columns:
+            slot = self.slots.get(column)
+            values = None
+            if slot != None:
+                values = self.values[slot]
+            slots.append((values, isinstance(values, array)))
+        for index in xrange(self.size):
+            row = []
+            for values,isArray in slots:
+                value = None
+                if values != None and index < len(values):
+                    value = values[index]
+                    if isArray and value == MISSING_INT:
+                        value = None
+                row.append(value)
+            yield row
@@ -18,25 +18,75 @@ The configuration file contains a JSON object with the following keys:
     - "thumbnail": the directory with the thumbnails files,
     - "thumbnail_url": the URL path for the thumbnails files,
     - "csv": the output directory where the CSV files and the beanbag will be generated
+    - "protocol": the ermrest protocol, "https" (default) or "http",
+    - "connections": the number of concurrent ermrest connections used to get the tables ids (default 8)
+    - "schema_cache": a file caching the ermrest schema introspection, revalidated with its ETag
+    - "checksums": the list of the bag checksum algorithms (default ["md5"])
+    - "zip_compression": "stored" (default) or the deflate level (0-9) of the bag zip archive
+    - "columnar": "parquet" or "arrow" for writing also the tables as typed columnar
+      files in the columnar directory of the output directory (requires pyarrow)
+    - "columnar_compression": the compression of the columnar files, "none" or
+      snappy (default for parquet), gzip, brotli, lz4, zstd (lz4 and zstd for arrow)
+    - "manifest": a file recording the XML files loaded by the previous runs;
+      when given, only the new and the changed XML files are loaded, their ids continue
+      after the recorded ones, and the ids ranges of the rows superseded by the changed
+      and the deleted files are written in the stale.json file of the output directory
+    - "inference_cache": a file caching the tables inferred from each XML file with its
+      content hash; the inference pass only parses the new and the changed files
+      (not with the single-pass and the workers options)
+
+Options:
+
+    - single-pass: infer the tables definitions and load the data in a single,
+      incremental parse of each XML file (lower memory, half the parsing time)
+    - workers: the number of processes parsing the XML files in parallel;
+      the output is identical to the one of a serial run
+    - stream: write the CSV rows while parsing, instead of keeping all of them in memory
+      (not with the columnar output)
+    - offline: use the cached schema introspection without revalidating it
+      (the tables max ids are still read from ermrest)
+    - metrics: a JSON file where the metrics of the run are written: the time of each
+      phase, the files, elements, rows and bytes counters and rates, the rows and
+      bytes of each table, the peak RSS and the slowest files
 
 Usage:
-    python xml2bag.py <config_file>
+    python xml2bag.py -c <config_file> [--single-pass] [--workers N] [--stream] [--offline] [--metrics <metrics_file>]
     
 """
 
 import sys
 import os
 import shutil
+import atexit
+import tempfile
+import hashlib
+import time
 from optparse import OptionParser
 import json
 import xml.etree.ElementTree as ET
-from httplib import HTTPSConnection, OK
-import bagit
-import zipfile
+from httplib import HTTPConnection, HTTPSConnection, OK, NOT_MODIFIED
+from threading import Thread
+from Queue import Queue, Empty
+from multiprocessing import Pool
+from multicelldb.store import ColumnStore
+from multicelldb.csvstream import CSVStream, csvValue, getCSVColumns, writeCSV, discardStreams
+from multicelldb.bag import BagWriter
+from multicelldb.ordering import sortTables, CycleError
+from multicelldb.schema import OrderedSet, Schema
+from multicelldb.engine import Engine, InputError, START, TEXT
+from multicelldb.readers import XMLReader
+from multicelldb.metrics import Metrics
+from multicelldb.inferencecache import InferenceCache, cacheKey, fileHash
+from multicelldb.columnar import ColumnarWriter, FORMATS, COMPRESSIONS, DEFAULT_COMPRESSIONS, available, ipcCompression
 
 parser = OptionParser()
 parser.header = {}
 parser.add_option('-c', '--config', action='store', dest='config', type='string', help='Configuration file')
+parser.add_option('--single-pass', action='store_true', dest='single_pass', default=False, help='Infer the tables and load the data in one incremental parse')
+parser.add_option('-w', '--workers', action='store', dest='workers', type='int', default=1, help='Number of parallel XML parsing processes')
+parser.add_option('--stream', action='store_true', dest='stream', default=False, help='Write the CSV rows while parsing the XML files')
+parser.add_option('--offline', action='store_true', dest='offline', default=False, help='Use the cached schema introspection without revalidating it')
+parser.add_option('--metrics', action='store', dest='metrics', type='string', help='JSON file for the metrics of the run')
 
 (options, args) = parser.parse_args()
 
@@ -44,7 +94,7 @@ if not options.config:
     print 'ERROR: Missing configuration file'
     sys.exit(1)
     
-tablesNames = []
+tablesNames = OrderedSet()
 tablesDefinitions = {}
 tablesReferences = {}
 tablesSortedNames = []
@@ -114,16 +164,77 @@ class ConfigClient (object):
             for f in os.listdir(self.thumbnail):
                 self.thumbnails[get_file_name(f)] = f
         self.thumbnail_url = self.cfg.get('thumbnail_url', None)
+        self.protocol = self.cfg.get('protocol', 'https')
+        if self.protocol not in ['http', 'https']:
+            sys.stderr.write('Ermrest protocol must be http or https.\n')
+            sys.exit(1)
+        self.schema_cache = self.cfg.get('schema_cache', None)
+        if self.options.offline and not (self.schema_cache and os.path.exists(self.schema_cache)):
+            sys.stderr.write('The offline mode requires an existing schema cache.\n')
+            sys.exit(1)
+        self.connections = self.cfg.get('connections', 8)
+        if not isinstance(self.connections, int) or self.connections < 1:
+            sys.stderr.write('The number of ermrest connections must be a positive integer.\n')
+            sys.exit(1)
         self.output = self.cfg.get('csv', None)
         if not self.output:
             sys.stderr.write('Output directory must be given.\n')
             sys.exit(1)
+        self.manifest = self.cfg.get('manifest', None)
+        if self.manifest and os.path.abspath(self.manifest).startswith('%s/' % os.path.abspath(self.output)):
+            sys.stderr.write('The manifest file must be outside the output directory.\n')
+            sys.exit(1)
+        self.inference_cache = self.cfg.get('inference_cache', None)
+        if self.inference_cache:
+            if os.path.abspath(self.inference_cache).startswith('%s/' % os.path.abspath(self.output)):
+                sys.stderr.write('The inference cache file must be outside the output directory.\n')
+                sys.exit(1)
+            if self.options.single_pass or self.options.workers > 1:
+                sys.stderr.write('The inference cache can not be used with the single-pass or the workers options.\n')
+                sys.exit(1)
+        self.columnar = self.cfg.get('columnar', None)
+        self.columnar_compression = None
+        self.columnar_output = None
+        if self.columnar:
+            if self.columnar not in FORMATS:
+                sys.stderr.write('The columnar format must be parquet or arrow.\n')
+                sys.exit(1)
+            if not available():
+                sys.stderr.write('The columnar output requires the pyarrow package.\n')
+                sys.exit(1)
+            if self.options.stream:
+                sys.stderr.write('The columnar output can not be used with the stream option.\n')
+                sys.exit(1)
+            self.columnar_compression = self.cfg.get('columnar_compression', DEFAULT_COMPRESSIONS[self.columnar])
+            if self.columnar_compression == 'none':
+                self.columnar_compression = None
+            if self.columnar_compression not in COMPRESSIONS[self.columnar]:
+                sys.stderr.write('Unknown %s compression: %s.\n' % (self.columnar, self.columnar_compression))
+                sys.exit(1)
+            if self.columnar == 'arrow' and self.columnar_compression != None and not ipcCompression():
+                sys.stderr.write('The compression of the arrow files requires pyarrow 0.17 or later.\n')
+                sys.exit(1)
         if os.path.exists(self.output):
             shutil.rmtree(self.output)
         os.makedirs('%s/bag' % self.output)
+        if self.columnar:
+            self.columnar_output = '%s/columnar' % self.output
+            os.makedirs(self.columnar_output)
+        self.checksums = self.cfg.get('checksums', ['md5'])
+        for algorithm in self.checksums:
+            if algorithm not in hashlib.algorithms:
+                sys.stderr.write('Unknown checksum algorithm: %s.\n' % algorithm)
+                sys.exit(1)
+        self.zip_compression = self.cfg.get('zip_compression', 'stored')
+        if self.zip_compression == 'stored':
+            self.zip_compression = None
+        elif not isinstance(self.zip_compression, int) or self.zip_compression < 0 or self.zip_compression > 9:
+            sys.stderr.write('The zip compression must be "stored" or a deflate level between 0 and 9.\n')
+            sys.exit(1)
         self.file = '%s/csv.txt' % self.output
         self.zip = '%s/bag.zip' % self.output
         self.dams = '%s/bag.conf' % self.output
+        self.stale = '%s/stale.json' % self.output
         self.output = '%s/bag' % self.output
         
             
@@ -151,6 +262,28 @@ class ConfigClient (object):
             return self.thumbnails
         elif field=='thumbnail_url':
             return self.thumbnail_url
+        elif field=='protocol':
+            return self.protocol
+        elif field=='connections':
+            return self.connections
+        elif field=='schema_cache':
+            return self.schema_cache
+        elif field=='checksums':
+            return self.checksums
+        elif field=='zip_compression':
+            return self.zip_compression
+        elif field=='manifest':
+            return self.manifest
+        elif field=='stale':
+            return self.stale
+        elif field=='inference_cache':
+            return self.inference_cache
+        elif field=='columnar':
+            return self.columnar
+        elif field=='columnar_compression':
+            return self.columnar_compression
+        elif field=='columnar_output':
+            return self.columnar_output
         else:
             return None
         
@@ -163,6 +296,10 @@ class ErmrestClient (object):
         self.host = kwargs.get("host")
         self.schema = kwargs.get("schema")
         self.catalog = kwargs.get("catalog")
+        self.protocol = kwargs.get("protocol")
+        self.connections = kwargs.get("connections")
+        self.schema_cache = kwargs.get("schema_cache")
+        self.offline = kwargs.get("offline")
         self.webconn = None
         self.headers = dict(Accept='application/json')
         
@@ -170,15 +307,27 @@ class ErmrestClient (object):
     Open an ermrest connection
     """
     def connect(self):
-        self.webconn = HTTPSConnection(self.host)
+        self.webconn = self.new_connection()
+        
+    """
+    Create a new (keep-alive) ermrest connection
+    """
+    def new_connection(self):
+        if self.protocol == 'http':
+            return HTTPConnection(self.host)
+        return HTTPSConnection(self.host)
             
     """
     Send an ermrest GET request
     """
-    def get_request(self, url):
-        self.webconn.request('GET', url, '', self.headers)
-        resp = self.webconn.getresponse()
-        if resp.status != OK:
+    def get_request(self, url, webconn=None, headers=None, statuses=[OK]):
+        if webconn == None:
+            webconn = self.webconn
+        if headers == None:
+            headers = self.headers
+        webconn.request('GET', url, '', headers)
+        resp = webconn.getresponse()
+        if resp.status not in statuses:
             sys.stderr.write('Unexpected HTTP status: %d' % resp.status)
             sys.exit(1)
         return resp
@@ -187,26 +336,103 @@ class ErmrestClient (object):
     GET the schema introspection
     """
     def get_schema(self):
-        resp = self.get_request('/ermrest/catalog/%d/schema/%s' % (self.catalog, self.schema))
+        cached = self.read_schema_cache()
+        if self.offline:
+            return cached['schema']
+        headers = dict(self.headers)
+        if cached != None and cached.get('etag') != None:
+            headers['If-None-Match'] = cached['etag']
+        resp = self.get_request('/ermrest/catalog/%d/schema/%s' % (self.catalog, self.schema), headers=headers, statuses=[OK, NOT_MODIFIED])
+        if resp.status == NOT_MODIFIED:
+            resp.read()
+            return cached['schema']
         res = json.loads(resp.read())
+        self.write_schema_cache(resp.getheader('etag'), res)
         return res
     
     """
-    Initialize the tables indexes
+    Read the cached schema introspection, if any
+    """
+    def read_schema_cache(self):
+        if not self.schema_cache or not os.path.exists(self.schema_cache):
+            return None
+        f = open(self.schema_cache, 'r')
+        try:
+            cached = json.load(f)
+        except ValueError as e:
+            sys.stderr.write('Ignoring the malformed schema cache: %s\n' % e)
+            cached = None
+        f.close()
+        if cached != None and (cached.get('host') != self.host or cached.get('catalog') != self.catalog or cached.get('schema_name') != self.schema):
+            cached = None
+        if cached == None and self.offline:
+            sys.stderr.write('The schema cache does not match the ermrest schema.\n')
+            sys.exit(1)
+        return cached
+    
+    """
+    Save the schema introspection and its ETag in the cache
+    """
+    def write_schema_cache(self, etag, res):
+        if not self.schema_cache:
+            return
+        cached = {'host': self.host, 'catalog': self.catalog, 'schema_name': self.schema, 'etag': etag, 'schema': res}
+        out = open('%s.tmp' % self.schema_cache, 'w')
+        out.write(json.dumps(cached))
+        out.close()
+        os.rename('%s.tmp' % self.schema_cache, self.schema_cache)
+    
+    """
+    Initialize the tables indexes.
+    The max ids are fetched concurrently, each thread reusing its own keep-alive connection.
     """
     def load(self, db_schema, tables):
         tables_names = []
         for key,value in db_schema['tables'].iteritems():
             tables_names.append(key)
+        queue = Queue()
+        for db_table in tables_names:
+            queue.put(db_table)
+        max_ids = {}
+        errors = []
+        threads = []
+        for i in range(min(self.connections, len(tables_names))):
+            thread = Thread(target=self.load_max_ids, args=(queue, max_ids, errors))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if len(errors) > 0:
+            sys.exit(1)
         for db_table in tables_names:
-            resp = self.get_request('/ermrest/catalog/%d/aggregate/%s:%s/max:=max(id)' % (self.catalog, self.schema, db_table))
-            res = json.loads(resp.read())
-            max_val = res[0]['max']
-            if max_val==None:
-                max_val = 0
             tables[db_table] = {}
-            tables[db_table]['id'] = max_val
-            tables[db_table]['data'] = []
+            tables[db_table]['id'] = max_ids[db_table]
+            tables[db_table]['data'] = ColumnStore()
+            
+    """
+    Get the max ids of the tables from the queue, on a new connection
+    """
+    def load_max_ids(self, queue, max_ids, errors):
+        webconn = self.new_connection()
+        try:
+            while len(errors) == 0:
+                try:
+                    db_table = queue.get_nowait()
+                except Empty:
+                    break
+                resp = self.get_request('/ermrest/catalog/%d/aggregate/%s:%s/max:=max(id)' % (self.catalog, self.schema, db_table), webconn)
+                res = json.loads(resp.read())
+                max_val = res[0]['max']
+                if max_val==None:
+                    max_val = 0
+                max_ids[db_table] = max_val
+        except SystemExit as e:
+            errors.append(e)
+        except Exception as e:
+            sys.stderr.write('Ermrest request failed: %s\n' % e)
+            errors.append(e)
+        finally:
+            webconn.close()
             
 """
 Class for XML parsing
@@ -218,12 +444,33 @@ class XMLClient (object):
         self.tablesNames = kwargs.get("tablesNames")
         self.tablesDefinitions = kwargs.get("tablesDefinitions")
         self.tablesReferences = kwargs.get("tablesReferences")
+        self.schema = Schema(self.tablesNames, self.tablesDefinitions, self.tablesReferences)
         self.tablesData = kwargs.get("tablesData")
         self.columnTypes = kwargs.get("columnTypes")
         self.schemaDefinition = kwargs.get("schemaDefinition")
-        self.files=[f for f in os.listdir(self.input) if f.endswith('.xml')]
+        self.files = kwargs.get("files")
+        if self.files == None:
+            self.files=[f for f in os.listdir(self.input) if f.endswith('.xml')]
         self.thumbnails = kwargs.get("thumbnails")
         self.thumbnail_url = kwargs.get("thumbnail_url")
+        self.newStore = kwargs.get("newStore")
+        if self.newStore != None:
+            for table,data in self.tablesData.iteritems():
+                data['data'] = self.newStore(table)
+        self.columnsIndex = kwargs.get("columnsIndex")
+        if self.columnsIndex == None:
+            self.indexSchema()
+        self.thumbnailTables = set([table for table,columns in self.columnsIndex.iteritems() if 'thumbnail' in columns])
+        self.engine = Engine(self.schema, self.tablesData, self.columnTypes, self.newStore, self.getColumnType)
+        self.reader = XMLReader()
+        self.fileLoaded = kwargs.get("fileLoaded")
+        self.metrics = kwargs.get("metrics")
+        if self.metrics == None:
+            self.metrics = Metrics()
+        self.cache = None
+        if kwargs.get("inference_cache"):
+            self.cache = InferenceCache(kwargs.get("inference_cache"), self.input, cacheKey('xml', '', None, self.columnsIndex))
+            self.cache.load()
 
         
     """
@@ -231,209 +478,187 @@ class XMLClient (object):
     """
     def process_input(self):
         for f in self.files:  
+            start = time.time()
             self.process_XML_file(f) 
+            self.metrics.fileParsed(f, time.time() - start)
+        self.engine.flush()
+        if self.cache != None:
+            self.cache.save()
+            self.metrics.count('cached_files', self.cache.hits)
         
     """
-    Parse an XML file
+    Infer the tables from an XML file, with the inference cache if any
     """
     def process_XML_file(self, f):
+        if self.cache != None:
+            self.cache.infer(self.engine, f, lambda: self.parseEvents(f), lambda: Engine(columnType=self.getColumnType))
+        else:
+            self.engine.infer(self.parseEvents(f))
+        
+    """
+    Parse an XML file, returning its events
+    """
+    def parseEvents(self, f):
         tree = ET.parse('%s/%s' % (self.input, f))
         root = tree.getroot()
-        self.process_file(f, root, None)
-        
-    """
-    Populate the data structures for the SQL tables
-    """
-    def process_file(self, f, elem, parent):
-        
-        """
-        Check for the thumbnail table
-        """
-        if self.hasThumbnailColumn(elem.tag):
-            if elem.tag not in self.tablesNames:
-                self.tablesNames.append(elem.tag)
-            if elem.tag not in self.tablesDefinitions.keys():
-                self.tablesDefinitions[elem.tag] = []
-            if 'thumbnail' not in self.tablesDefinitions[elem.tag]:
-                self.tablesDefinitions[elem.tag].append('thumbnail')
-                self.setType(elem.tag, 'thumbnail', 'text')
-        
-        hasAttributes = len(elem.attrib.keys()) > 0
-        
-        """
-        Process the XML attributes
-        """
-        if hasAttributes:
-            if elem.tag not in self.tablesNames:
-                self.tablesNames.append(elem.tag)
-            if elem.tag not in self.tablesDefinitions.keys():
-                self.tablesDefinitions[elem.tag] = []
-            if parent!=None and elem.tag not in self.tablesReferences.keys():
-                self.tablesReferences[elem.tag] = []
-            if parent!=None and parent.tag not in self.tablesReferences[elem.tag]:
-                self.tablesReferences[elem.tag].append(parent.tag)
-            for attr,value in elem.attrib.items():
-                attrib = attr
-                if attrib not in self.tablesDefinitions[elem.tag]:
-                    self.tablesDefinitions[elem.tag].append(attrib)
-                    self.setType(elem.tag, attrib, self.getType(elem.tag, attrib, value))
-    
-        """
-        Process the XML element
-        """
-        if len(elem)==0:
-            if parent==None:
-                sys.stderr.write('Unexpected parent: None')
-                sys.exit(1)
-            if not hasAttributes:
-                if elem.tag not in self.tablesDefinitions[parent.tag]:
-                    self.tablesDefinitions[parent.tag].append(elem.tag)
-            else:
-                if elem.tag not in self.tablesDefinitions[elem.tag]:
-                    self.tablesDefinitions[elem.tag].append(elem.tag)
-            if self.isMultiValue(elem, parent):
-                self.setType(parent.tag, elem.tag, 'text')
-            else:
-                self.setType(parent.tag, elem.tag, self.getType(parent.tag, elem.tag, elem.text))
-        else:
-            if not hasAttributes:
-                if elem.tag not in self.tablesNames:
-                    self.tablesNames.append(elem.tag)
-                if elem.tag not in self.tablesDefinitions.keys():
-                    self.tablesDefinitions[elem.tag] = []
-                if parent!=None and elem.tag not in self.tablesReferences.keys():
-                    self.tablesReferences[elem.tag] = []
-                if parent!=None and parent.tag not in self.tablesReferences[elem.tag]:
-                    self.tablesReferences[elem.tag].append(parent.tag)
-            for child in elem:
-                self.process_file(f, child, elem)
+        return self.getEvents(f, self.readEvents(root))
         
     """
-    Get the column type from the schema
+    Get the events of a parsed XML file
     """
-    def getColumnType(self, table, column):
-        if table in self.schemaDefinition['tables']:
-            column_definitions = self.schemaDefinition['tables'][table]['column_definitions']
-            for col_def in column_definitions:
-                if col_def['name'] == column:
-                    return col_def['type']['typename']
-        return None
+    def readEvents(self, root):
+        try:
+            return self.reader.events(root)
+        except InputError as e:
+            sys.stderr.write('%s\n' % e)
+            discardStreams(self.tablesData)
+            sys.exit(1)
         
     """
-    Check if a table has a thumbnail column
+    Add the thumbnail of the file to the rows of the thumbnail tables
     """
-    def hasThumbnailColumn(self, table):
-        if table in self.schemaDefinition['tables']:
-            column_definitions = self.schemaDefinition['tables'][table]['column_definitions']
-            for col_def in column_definitions:
-                if col_def['name'] == 'thumbnail':
-                    return True
-        return False
+    def getEvents(self, f, events):
+        if len(self.thumbnailTables) == 0:
+            return events
+        return self.thumbnailEvents(f, events)
         
     """
-    Guess the type of a value
+    Generate the events of a file, with the thumbnail column after the start of a thumbnail table row
     """
-    def getType(self, table, column, value):
-        ret = self.getColumnType(table, column)
-        if ret != None:
-            return ret
-        try:
-            v = int(value)
-            return 'int4'
-        except:
-            try:
-                v = float(value)
-                return 'float8'
-            except:
-                return 'text'
+    def thumbnailEvents(self, f, events):
+        thumbnail = None
+        if get_file_name(f) in self.thumbnails:
+            thumbnail = '%s/%s' % (self.thumbnail_url, self.thumbnails[get_file_name(f)])
+        for event in events:
+            yield event
+            if event[0] == START and self.hasThumbnailColumn(event[1].table):
+                yield (TEXT, event[1], 'thumbnail', thumbnail)
         
     """
-    Check if the tag is an array
+    Compile the schema introspection into a table -> column -> type index
     """
-    def isMultiValue(self, elem, parent):
-        count = 0
-        for child in parent:
-            if child.tag==elem.tag:
-                count += 1
-        return count >= 2
+    def indexSchema(self):
+        self.columnsIndex = {}
+        for table,table_def in self.schemaDefinition['tables'].iteritems():
+            columns = {}
+            for col_def in table_def['column_definitions']:
+                columns[col_def['name']] = col_def['type']['typename']
+            self.columnsIndex[table] = columns
+        
+    """
+    Get the column type from the schema
+    """
+    def getColumnType(self, table, column):
+        columns = self.columnsIndex.get(table)
+        if columns != None:
+            return columns.get(column)
+        return None
         
     """
-    Set the SQL type of a value
+    Check if a table has a thumbnail column
     """
-    def setType(self, table, column, col_type):
-        if table not in self.columnTypes.keys():
-            self.columnTypes[table] = {}
-        if column not in self.columnTypes[table].keys():
-            self.columnTypes[table][column] = col_type
+    def hasThumbnailColumn(self, table):
+        return table in self.thumbnailTables
         
     """
     Load the data from the XML files
     """
     def load_data(self):
         for f in self.files:  
+            start = time.time()
+            ids = self.engine.getIds()
             tree = ET.parse('%s/%s' % (self.input, f))
             root = tree.getroot()
-            self.load_file_data(f, root, None, None) 
+            self.engine.load(self.getEvents(f, self.readEvents(root)))
+            self.loaded(f, ids)
+            self.metrics.fileParsed(f, time.time() - start, self.countElements(root))
         
     """
-    Load the data from an XML file
+    Parse and load the XML files in a single pass
     """
-    def load_file_data(self, f, elem, parent, parent_obj):
-        obj = {}
+    def stream_input(self):
+        for f in self.files:
+            start = time.time()
+            ids = self.engine.getIds()
+            elements = self.stream_XML_file(f)
+            self.loaded(f, ids)
+            self.metrics.fileParsed(f, time.time() - start, elements)
+        self.engine.flush()
         
-        """
-        Load the thumbnail value
-        """
-        if self.hasThumbnailColumn(elem.tag) and get_file_name(f) in self.thumbnails:
-            obj['thumbnail'] = '%s/%s' % (self.thumbnail_url, self.thumbnails[get_file_name(f)])
-
-        hasAttributes = len(elem.attrib.keys()) > 0
-        
-        """
-        Load the attributes
-        """
-        if hasAttributes or len(elem)>0:
-            if elem.tag not in self.tablesData.keys():
-                self.tablesData[elem.tag] = {}
-                self.tablesData[elem.tag]['id'] = 0
-                self.tablesData[elem.tag]['data'] = []
-            self.tablesData[elem.tag]['id'] = self.tablesData[elem.tag]['id']+1
-            self.tablesData[elem.tag]['data'].append(obj)
-            obj['id'] = self.tablesData[elem.tag]['id']
-            if parent!=None and elem.tag in self.tablesReferences.keys() and parent.tag in self.tablesReferences[elem.tag]:
-                col = '%s_id' % parent.tag
-                obj[col] = self.tablesData[parent.tag]['id']
-        if hasAttributes:
-            for attr,value in elem.attrib.items():
-                attrib = attr
-                obj[attrib] = value
-                
-        """
-        Load the element
-        """
-        if len(elem)==0:
-            value = elem.text
-            if value!=None:
-                if self.isMultiValue(elem, parent):
-                    value = self.getMultiValue(elem, parent)
-                if hasAttributes:
-                    obj[elem.tag] = value
-                else:
-                    parent_obj[elem.tag] = value
-        else:
-            for child in elem:
-                self.load_file_data(f, child, elem, obj)
+    """
+    Parse incrementally an XML file, populating the tables definitions and the data
+    from the same events, and returning the number of the parsed elements
+    """
+    def stream_XML_file(self, f):
+        try:
+            self.engine.ingest(self.getEvents(f, self.reader.stream('%s/%s' % (self.input, f))))
+        except InputError as e:
+            sys.stderr.write('%s\n' % e)
+            discardStreams(self.tablesData)
+            sys.exit(1)
+        return self.reader.elements
         
     """
-    Get the multi value of a tag
+    Parse the XML files with a pool of worker processes.
+    The partial results are merged in the order of the files,
+    such that the output is the same as the one of a serial run.
     """
-    def getMultiValue(self, elem, parent):
-        value = []
-        for child in parent:
-            if child.tag==elem.tag:
-                value.append(child.text)
-        return ','.join(value)
+    def parallel_input(self, workers, single_pass):
+        kwargs = {'input': self.input, 'thumbnails': self.thumbnails, 'thumbnail_url': self.thumbnail_url, 'schemaDefinition': self.schemaDefinition, 'columnsIndex': self.columnsIndex, 'single_pass': single_pass, 'count_elements': self.metrics.enabled}
+        pool = Pool(workers, init_worker, (kwargs,))
+        chunksize = max(1, len(self.files) / (workers * 4))
+        for f,partial in zip(self.files, pool.imap(parse_XML_file, self.files, chunksize)):
+            ids = self.engine.getIds()
+            self.engine.merge(partial)
+            self.loaded(f, ids)
+            self.metrics.fileParsed(f, partial['elapsed'], partial['elements'])
+        pool.close()
+        pool.join()
         
+    """
+    Count the elements of a parsed XML file, when the metrics are enabled
+    """
+    def countElements(self, root):
+        if not self.metrics.enabled:
+            return 0
+        return sum([1 for elem in root.iter()])
+        
+    """
+    Report the ranges of the ids given to the rows of a loaded file
+    """
+    def loaded(self, f, ids):
+        if self.fileLoaded == None:
+            return
+        ranges = {}
+        for table,data in self.tablesData.iteritems():
+            first = ids.get(table, 0)
+            if data['id'] > first:
+                ranges[table] = [first + 1, data['id']]
+        self.fileLoaded(f, ranges)
+        
+"""
+Initialize a worker process with the XMLClient parameters
+"""
+def init_worker(kwargs):
+    global worker_kwargs
+    worker_kwargs = kwargs
+    
+"""
+Parse an XML file in a worker process into partial tables definitions and data
+"""
+def parse_XML_file(f):
+    partial = {'tablesNames': OrderedSet(), 'tablesDefinitions': {}, 'tablesReferences': {}, 'columnTypes': {}, 'tablesData': {}}
+    metrics = Metrics(enabled=worker_kwargs['count_elements'])
+    client = XMLClient(files=[f], metrics=metrics, **dict(worker_kwargs, **partial))
+    if worker_kwargs['single_pass']:
+        client.stream_input()
+    else:
+        client.process_input()
+        client.load_data()
+    partial['elapsed'] = metrics.files[f]
+    partial['elements'] = metrics.counters.get('elements', 0)
+    return partial
+    
 """
 Class for generating CSV files
 """
@@ -449,29 +674,22 @@ class CSVClient (object):
         self.tablesData = kwargs.get("tablesData")
         self.tablesDefinitions = kwargs.get("tablesDefinitions")
         self.columnTypes = kwargs.get("columnTypes")
-        
+        self.bag = kwargs.get("bag")
+        self.columnar = kwargs.get("columnar")
+        self.schema = Schema(self.tablesNames, self.tablesDefinitions, self.tablesReferences)
+        self.fixedColumns = False
+        self.spillDir = kwargs.get("spillDir")
         
     """
     Sort the tables to be created based on the dependencies (references)
     """
     def sortTablesDefinitions(self):
-        sorted = False
-        while not sorted:
-            sorted = True
-            for t in self.tablesNames:
-                if t not in self.tablesSortedNames:
-                    if t not in self.tablesReferences.keys():
-                        self.tablesSortedNames.append(t)
-                        sorted = False
-                    else:
-                        resolved = True
-                        for refTable in self.tablesReferences[t]:
-                            if refTable not in self.tablesSortedNames:
-                                resolved = False
-                                break
-                        if resolved:
-                            self.tablesSortedNames.append(t)
-                            sorted = False
+        try:
+            self.tablesSortedNames.extend(sortTables(self.tablesNames, self.tablesReferences))
+        except CycleError as e:
+            sys.stderr.write('%s\n' % e)
+            discardStreams(self.tablesData)
+            sys.exit(1)
         
     """
     Load the CSV files
@@ -481,43 +699,165 @@ class CSVClient (object):
         for table in self.tablesSortedNames:
             self.insert_csv_data(table)
         self.csvFiles.close()
+        for table,data in self.tablesData.iteritems():
+            if isinstance(data['data'], CSVStream) and table not in self.tablesSortedNames:
+                data['data'].close(None)
         
     """
-    Set a CSV value
+    Get the columns of the CSV file of a table
     """
-    def csvValue(self, value):
-        if isinstance(value,basestring):
-            value = value.replace('"','""')
-            value = '"%s"' % value.encode('utf8')
-        else:
-            value = str(value)
-        return value
+    def getColumns(self, table):
+        return getCSVColumns(self.schema, table)
+        
+    """
+    Create the CSV stream of a table
+    """
+    def newStream(self, table):
+        return CSVStream('%s/%s.csv' % (self.output, table), csvValue, lambda: self.getFixedColumns(table), lambda path: self.openFile(table), self.spillDir)
+        
+    """
+    Open the CSV file of a table, in the bag if any
+    """
+    def openFile(self, table):
+        if self.bag != None:
+            return self.bag.openPayload('%s.csv' % table)
+        return open('%s/%s.csv' % (self.output, table), 'w')
+        
+    """
+    Mark the tables definitions as complete, such that the streams write their CSV files directly
+    """
+    def fixColumns(self):
+        self.fixedColumns = True
+        
+    """
+    Get the columns of a table, if they are complete
+    """
+    def getFixedColumns(self, table):
+        if self.fixedColumns and table in self.tablesDefinitions:
+            return self.getColumns(table)
+        return None
         
     """
     Insert the data for a table
     """
     def insert_csv_data(self, table):
-        if table in self.tablesData.keys():
+        if table in self.tablesData:
             self.csvFiles.write('%s/%s.csv\n' % (self.output, table))
-            out = open('%s/%s.csv' % (self.output, table), 'w')
-            colsDefs = ['id']
-            colsDefs.extend(self.tablesDefinitions[table])
-            if table in self.tablesReferences.keys():
-                colsRef = []
-                for col in self.tablesReferences[table]:
-                    colsRef.append('%s_id' % col)
-                colsDefs.extend(colsRef)
-            out.write('%s\n' % ','.join(colsDefs))
-            for data in self.tablesData[table]['data']:
-                row = []
-                for col in colsDefs:
-                    if col in data.keys():
-                        row.append(self.csvValue(data[col]))
-                    else:
-                        row.append('')
-                out.write('%s\n' % ','.join(row))
+            colsDefs = self.getColumns(table)
+            if isinstance(self.tablesData[table]['data'], CSVStream):
+                self.tablesData[table]['data'].close(colsDefs)
+                return
+            out = self.openFile(table)
+            writeCSV(out, colsDefs, self.tablesData[table]['data'])
             out.close()
 
+    """
+    Write the columnar files of the tables
+    """
+    def load_columnar(self):
+        for table in self.tablesSortedNames:
+            if table in self.tablesData:
+                self.columnar.write(table, self.getColumns(table), self.columnTypes.get(table, {}), self.tablesReferences.get(table, []), self.tablesData[table]['data'])
+
+"""
+Class for the manifest of the input files, for the incremental runs.
+The manifest records the size, the mtime, the content hash and the ids ranges
+of each XML file loaded by the previous runs, and the last id of each table.
+"""
+class ManifestClient (object):
+
+    def __init__(self, **kwargs):
+        self.path = kwargs.get("path")
+        self.input = kwargs.get("input")
+        self.stale = kwargs.get("stale")
+        self.files = {}
+        self.ids = {}
+        self.current = {}
+        self.changed = {}
+        self.deleted = {}
+        
+    """
+    Read the manifest of the previous runs, if any
+    """
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path, 'r')
+        try:
+            manifest = json.load(f)
+        except ValueError as e:
+            sys.stderr.write('Malformed manifest file: %s\n' % e)
+            sys.exit(1)
+        else:
+            f.close()
+        self.files = manifest.get('files', {})
+        self.ids = manifest.get('ids', {})
+        
+    """
+    Continue the ids of the tables after the ones given by the previous runs
+    """
+    def seed(self, tables):
+        for table,max_id in self.ids.iteritems():
+            if table not in tables:
+                tables[table] = {}
+                tables[table]['id'] = 0
+                tables[table]['data'] = ColumnStore()
+            tables[table]['id'] = max(tables[table]['id'], max_id)
+        
+    """
+    Select the new and the changed XML files.
+    A file with the recorded size and mtime is not read;
+    otherwise its content hash tells if it changed.
+    """
+    def select(self, files):
+        selected = []
+        for f in files:
+            path = '%s/%s' % (self.input, f)
+            st = os.stat(path)
+            entry = self.files.get(f)
+            if entry != None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+                self.current[f] = entry
+                continue
+            current = {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': fileHash(path), 'ids': {}}
+            if entry != None and entry['sha1'] == current['sha1']:
+                current['ids'] = entry['ids']
+            else:
+                if entry != None:
+                    self.changed[f] = entry['ids']
+                selected.append(f)
+            self.current[f] = current
+        for f,entry in self.files.iteritems():
+            if f not in self.current:
+                self.deleted[f] = entry['ids']
+        return selected
+        
+    """
+    Record the ids ranges of the rows of a loaded file
+    """
+    def fileLoaded(self, f, ranges):
+        self.current[f]['ids'] = ranges
+        
+    """
+    Write the ids ranges of the rows loaded from the changed and the deleted files.
+    These rows are superseded by the current run.
+    """
+    def writeStale(self):
+        out = open('%s' % (self.stale), 'w')
+        out.write('%s\n' % json.dumps({'changed': self.changed, 'deleted': self.deleted}, indent=4, sort_keys=True))
+        out.close()
+        
+    """
+    Save the manifest of the current run
+    """
+    def save(self, tables):
+        manifest = {}
+        manifest['files'] = self.current
+        manifest['ids'] = dict([(table, data['id']) for table,data in tables.iteritems()])
+        out = open('%s.tmp' % self.path, 'w')
+        out.write('%s\n' % json.dumps(manifest, indent=4, sort_keys=True))
+        out.close()
+        os.rename('%s.tmp' % self.path, self.path)
+        
 """
 Class for generating a bean bag
 """
@@ -529,28 +869,44 @@ class BagClient (object):
         self.contact = kwargs.get("contact")
         self.dams = kwargs.get("dams")
         self.host = kwargs.get("host")
+        self.protocol = kwargs.get("protocol")
         self.catalog = kwargs.get("catalog")
         self.schema = kwargs.get("schema")
         self.tablesSortedNames = kwargs.get("tablesSortedNames")
+        self.checksums = kwargs.get("checksums")
+        self.zip_compression = kwargs.get("zip_compression")
+        self.bag = None
+        
+    """
+    Start the beanbag and its zip archive, before the CSV files are written
+    """
+    def open(self):
+        self.bag = BagWriter(self.output, self.checksums, self.zip, self.zip_compression)
         
     """
-    Make a beanbag for the CSV files
+    Open a payload file of the beanbag.
+    The file is checksummed, and zipped when possible, while it is written.
+    """
+    def openPayload(self, name):
+        return self.bag.open(name)
+        
+    """
+    Get the sizes of the payload files of the beanbag
+    """
+    def getPayloadSizes(self):
+        return dict([(name, size) for name,size,checksums in self.bag.payload])
+        
+    """
+    Make a beanbag for the CSV files, from the checksums computed while they were written
     """
     def makeBag(self):
-        bagit.make_bag(self.output,{'Contact-Name': self.contact})
+        self.bag.finish({'Contact-Name': self.contact, 'Bag-Software-Agent': 'MultiCellDB xml2csv.py'})
         
     """
-    Zip the beanbag
+    Zip the beanbag, adding the files not zipped while they were written
     """
     def zipBag(self):
-        zf = zipfile.ZipFile(self.zip, mode='w')
-        crt_path = os.getcwd()
-        os.chdir(self.output)
-        for root, dirs, files in os.walk('.'):
-            for filename in files:
-                zf.write('%s/%s' % (root, filename))
-        zf.close()
-        os.chdir(crt_path)
+        self.bag.close()
         
     """
     Generate the configuration file for loading the beanbag into the database
@@ -560,7 +916,7 @@ class BagClient (object):
         bag = {'bag_path': self.zip}
         config['bag'] = bag
         catalog = {}
-        catalog['host'] = 'https://%s' % self.host
+        catalog['host'] = '%s://%s' % (self.protocol, self.host)
         catalog['path'] = '/ermrest/catalog/%d' % self.catalog
         entities = []
         for table in self.tablesSortedNames:
@@ -579,39 +935,112 @@ class BagClient (object):
 """
 Get the configuration
 """
+metrics = Metrics(options.metrics)
+metrics.start('config')
 config_client = ConfigClient(options=options)
 config_client.load()
 config_client.validate()
+metrics.stop('config')
 
 """
 Get the ermrest data
 """
-ermrest_client = ErmrestClient(host=config_client.get('host'), catalog=config_client.get('catalog'), schema=config_client.get('schema'))
+ermrest_client = ErmrestClient(host=config_client.get('host'), protocol=config_client.get('protocol'), connections=config_client.get('connections'), schema_cache=config_client.get('schema_cache'), offline=options.offline, catalog=config_client.get('catalog'), schema=config_client.get('schema'))
+metrics.start('schema')
 ermrest_client.connect()
 schemaDefinition = ermrest_client.get_schema()
+metrics.stop('schema')
+metrics.start('max_ids')
 ermrest_client.load(schemaDefinition, tablesData)
+metrics.stop('max_ids')
+
+"""
+Get the manifest of the previous runs
+"""
+manifest_client = None
+if config_client.get('manifest'):
+    manifest_client = ManifestClient(path=config_client.get('manifest'), input=config_client.get('input'), stale=config_client.get('stale'))
+    manifest_client.load()
+    manifest_client.seed(tablesData)
+
+"""
+Start the beanbag
+"""
+bag_client = BagClient(zip=config_client.get('zip'), output=config_client.get('output'), contact='Serban Voinea', dams=config_client.get('dams'), host=config_client.get('host'), protocol=config_client.get('protocol'), catalog=config_client.get('catalog'), schema=config_client.get('schema'), tablesSortedNames=tablesSortedNames, checksums=config_client.get('checksums'), zip_compression=config_client.get('zip_compression'))
+bag_client.open()
 
 """
 Parse the XML files
 """
-xml_client = XMLClient(input=config_client.get('input'), thumbnails=config_client.get('thumbnails'), thumbnail_url=config_client.get('thumbnail_url'), tablesNames=tablesNames, tablesDefinitions=tablesDefinitions, tablesReferences=tablesReferences, columnTypes=columnTypes, tablesData=tablesData, schemaDefinition=schemaDefinition)
-xml_client.process_input()
-xml_client.load_data()
+columnar_writer = None
+if config_client.get('columnar'):
+    columnar_writer = ColumnarWriter(config_client.get('columnar_output'), config_client.get('columnar'), config_client.get('columnar_compression'))
+spill_dir = None
+if options.stream:
+    spill_dir = tempfile.mkdtemp(prefix='xml2csv.')
+    atexit.register(shutil.rmtree, spill_dir, True)
+csv_client = CSVClient(spillDir=spill_dir, columnar=columnar_writer, tablesNames=tablesNames, tablesSortedNames=tablesSortedNames, tablesReferences=tablesReferences, columnTypes=columnTypes, tablesData=tablesData, file=config_client.get('file'), output='%s/data' % config_client.get('output'), tablesDefinitions=tablesDefinitions, bag=bag_client)
+xml_client = XMLClient(input=config_client.get('input'), thumbnails=config_client.get('thumbnails'), thumbnail_url=config_client.get('thumbnail_url'), tablesNames=tablesNames, tablesDefinitions=tablesDefinitions, tablesReferences=tablesReferences, columnTypes=columnTypes, tablesData=tablesData, schemaDefinition=schemaDefinition, newStore=csv_client.newStream if options.stream else None, fileLoaded=manifest_client.fileLoaded if manifest_client != None else None, inference_cache=config_client.get('inference_cache'), metrics=metrics)
+if manifest_client != None:
+    metrics.start('manifest')
+    xml_client.files = manifest_client.select(xml_client.files)
+    metrics.stop('manifest')
+if options.workers > 1 or options.single_pass:
+    metrics.start('parse')
+    if options.workers > 1:
+        xml_client.parallel_input(options.workers, options.single_pass)
+    else:
+        xml_client.stream_input()
+    metrics.stop('parse')
+else:
+    metrics.start('inference')
+    xml_client.process_input()
+    metrics.stop('inference')
+    metrics.start('data')
+    csv_client.fixColumns()
+    xml_client.load_data()
+    metrics.stop('data')
 
 """
 Generate the CSV files
 """
-csv_client = CSVClient(tablesNames=tablesNames, tablesSortedNames=tablesSortedNames, tablesReferences=tablesReferences, columnTypes=columnTypes, tablesData=tablesData, file=config_client.get('file'), output=config_client.get('output'), tablesDefinitions=tablesDefinitions)
+metrics.start('csv')
 csv_client.sortTablesDefinitions()
 csv_client.load_data()
+metrics.stop('csv')
+if columnar_writer != None:
+    metrics.start('columnar')
+    csv_client.load_columnar()
+    metrics.stop('columnar')
 
 """
 Generate the beanbag
 """
-bag_client = BagClient(zip=config_client.get('zip'), output=config_client.get('output'), contact='Serban Voinea', dams=config_client.get('dams'), host=config_client.get('host'), catalog=config_client.get('catalog'), schema=config_client.get('schema'), tablesSortedNames=tablesSortedNames)
+metrics.start('bag')
 bag_client.makeBag()
+metrics.stop('bag')
+metrics.start('zip')
 bag_client.zipBag()
+metrics.stop('zip')
+metrics.start('dams')
 bag_client.damsConfig()
+metrics.stop('dams')
+
+"""
+Save the manifest for the next run
+"""
+if manifest_client != None:
+    manifest_client.writeStale()
+    manifest_client.save(tablesData)
+
+"""
+Write the metrics of the run
+"""
+sizes = bag_client.getPayloadSizes()
+for table in tablesSortedNames:
+    if table in tablesData:
+        metrics.table(table, len(tablesData[table]['data']), sizes.get('data/%s.csv' % table, 0))
+metrics.write()
 
 """ DEBUG Traces
 
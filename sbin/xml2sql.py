@@ -11,17 +11,36 @@ Parameters:
     - title: the column name to set the title annotation
     - root: the top level table to be viewed 
     - output: the SQL file for creating and loading the tables
+      (the SQLite database file with the sqlite format)
+    - format: the statements loading the rows, "insert" (default) or "copy" for
+      COPY blocks in the PostgreSQL text format (loaded with psql), or "sqlite"
+      for creating and loading the tables directly in a SQLite database
+    - batch-size: the number of rows of an INSERT statement (default 1); the rows
+      with the same columns are grouped in multi-row INSERT statements
+    - inference-cache: a file caching the tables inferred from each XML file with its
+      content hash; the inference pass only parses the new and the changed files
+    - metrics: a JSON file where the metrics of the run (phases, counters, tables, peak RSS, slowest files) are written
     
 An SQL file with the schema name followed by the suffix _annotation will contain the statements 
-to be executed for the model_table_annotation and model_column_annotation tables.
+to be executed for the model_table_annotation and model_column_annotation tables
+(except with the sqlite format, as SQLite has no schema and no ermrest annotations).
     
 """
 
 import sys
 import os
+import time
 from optparse import OptionParser
 import json
 import xml.etree.ElementTree as ET
+from multicelldb.ordering import sortTables, CycleError
+from multicelldb.schema import Schema
+from multicelldb.engine import Engine, InputError
+from multicelldb.readers import XMLReader
+from multicelldb.metrics import Metrics
+from multicelldb.inferencecache import InferenceCache, cacheKey
+from multicelldb.sql import getColumns, writeInserts, writeBatchedInserts, writeCopy
+from multicelldb.sqlitedb import SQLiteDatabase
 
 parser = OptionParser()
 parser.header = {}
@@ -31,6 +50,10 @@ parser.add_option('-s', '--schema', action='store', dest='schema', type='string'
 parser.add_option('-t', '--title', action='store', dest='title', type='string', help='The title column')
 parser.add_option('-p', '--thumbnail', action='store', dest='thumbnail', type='string', help='The thumbnail column')
 parser.add_option('-r', '--root', action='store', dest='root', type='string', help='The root table')
+parser.add_option('-f', '--format', action='store', dest='format', type='choice', choices=['insert', 'copy', 'sqlite'], default='insert', help='Output format of the rows: insert (default), copy or sqlite')
+parser.add_option('-b', '--batch-size', action='store', dest='batch_size', type='int', default=1, help='Number of rows of an INSERT statement')
+parser.add_option('--inference-cache', action='store', dest='inference_cache', type='string', help='File caching the inference of the XML files')
+parser.add_option('--metrics', action='store', dest='metrics', type='string', help='JSON file for the metrics of the run')
 
 (options, args) = parser.parse_args()
 
@@ -53,6 +76,10 @@ if not options.root:
     print 'ERROR: Missing root table'
     sys.exit(1)
 
+if options.batch_size < 1:
+    print 'ERROR: The batch size must be a positive integer'
+    sys.exit(1)
+
 if not options.title:
     print 'WARNING: Missing title column'
 else:
@@ -65,145 +92,39 @@ else:
 
 schema='"%s"' % options.schema
 
-out_annotation = file('%s_annotation.sql' % options.schema, 'w')
-out = file(options.output, 'w')
-
+if options.format == 'sqlite':
+    database = SQLiteDatabase(options.output)
+else:
+    out_annotation = file('%s_annotation.sql' % options.schema, 'w')
+    out = file(options.output, 'w')
 
-tablesList = []
-tablesDict = {}
 
-tablesNames = []
-tablesDefinitions = {}
-tablesReferences = {}
+tablesSchema = Schema()
+tablesNames = tablesSchema.names
+tablesDefinitions = tablesSchema.definitions
+tablesReferences = tablesSchema.references
 tablesSortedNames = []
 
 tablesData = {}
 columnTypes = {}
+engine = Engine(tablesSchema, tablesData, columnTypes)
+reader = XMLReader('@', '#text')
+metrics = Metrics(options.metrics)
+cache = None
+if options.inference_cache:
+    cache = InferenceCache(options.inference_cache, options.input, cacheKey('xml', '@', '#text'))
+    cache.load()
 
-"""
-Guess the type of a value
-"""
-def getType(value):
-    try:
-        v = int(value)
-        return 'integer'
-    except:
-        try:
-            v = float(value)
-            return 'double precision'
-        except:
-            return 'text'
-        
-"""
-Set the SQL type of a value
-"""
-def setType(table, column, col_type):        
-    if col_type=='integer':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'integer'
-    elif col_type=='double precision':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys() or columnTypes[table][column]=='integer':
-            columnTypes[table][column] = 'double precision'
-    elif col_type=='text':
-        if table not in columnTypes.keys():
-            columnTypes[table] = {}
-        if column not in columnTypes[table].keys():
-            columnTypes[table][column] = 'text'
-            
 """
 Sort the tables to be created based on the dependencies (references)
 """
 def sortTablesDefinitions():
-    sorted = False
-    while not sorted:
-        sorted = True
-        for t in tablesNames:
-            if t not in tablesSortedNames:
-                if t not in tablesReferences.keys():
-                    tablesSortedNames.append(t)
-                    sorted = False
-                else:
-                    resolved = True
-                    for refTable in tablesReferences[t]:
-                        if refTable not in tablesSortedNames:
-                            resolved = False
-                            break
-                    if resolved:
-                        tablesSortedNames.append(t)
-                        sorted = False
+    try:
+        tablesSortedNames.extend(sortTables(tablesNames, tablesReferences))
+    except CycleError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
                         
-"""
-Check if the tag is an array
-"""
-def isMultiValue(elem, parent):
-    count = 0
-    for child in parent:
-        if child.tag==elem.tag:
-            count += 1
-    return count >= 2
-
-"""
-Get the multi value of a tag
-"""
-def getMultiValue(elem, parent):
-    value = []
-    for child in parent:
-        if child.tag==elem.tag:
-            value.append(child.text)
-    return ','.join(value)
-
-"""
-Populate the data structures for the SQL tables
-"""
-def process_file(f, elem, parent):
-    hasAttributes = len(elem.attrib.keys()) > 0
-    
-    if hasAttributes:
-        if elem.tag not in tablesNames:
-            tablesNames.append(elem.tag)
-        if elem.tag not in tablesDefinitions.keys():
-            tablesDefinitions[elem.tag] = []
-        if parent!=None and elem.tag not in tablesReferences.keys():
-            tablesReferences[elem.tag] = []
-        if parent!=None and parent.tag not in tablesReferences[elem.tag]:
-            tablesReferences[elem.tag].append(parent.tag)
-        for attr,value in elem.attrib.items():
-            attrib = '@%s' % attr
-            if attrib not in tablesDefinitions[elem.tag]:
-                tablesDefinitions[elem.tag].append(attrib)
-                setType(elem.tag, attrib, getType(value))
-
-    if len(elem)==0:
-        if parent==None:
-            print 'Unexpected parent: None'
-            sys.exit(1)
-        if not hasAttributes:
-            if elem.tag not in tablesDefinitions[parent.tag]:
-                tablesDefinitions[parent.tag].append(elem.tag)
-        else:
-            if '#text' not in tablesDefinitions[elem.tag]:
-                tablesDefinitions[elem.tag].append('#text')
-        if isMultiValue(elem, parent):
-            setType(parent.tag, elem.tag, 'text')
-        else:
-            setType(parent.tag, elem.tag, getType(elem.text))
-    else:
-        if not hasAttributes:
-            if elem.tag not in tablesNames:
-                tablesNames.append(elem.tag)
-            if elem.tag not in tablesDefinitions.keys():
-                tablesDefinitions[elem.tag] = []
-            if parent!=None and elem.tag not in tablesReferences.keys():
-                tablesReferences[elem.tag] = []
-            if parent!=None and parent.tag not in tablesReferences[elem.tag]:
-                tablesReferences[elem.tag].append(parent.tag)
-        for child in elem:
-            process_file(f, child, elem)
-    
 """
 Generate the SQL statements for a table as well as its annotations
 """
@@ -219,12 +140,12 @@ def create_sql_table(table):
             out_annotation.write('INSERT INTO _ermrest.model_column_annotation VALUES(\'%s\', \'%s\', \'%s\', \'comment\', \'["thumbnail"]\');\n' % (options.schema, table, col))
         if title!=None and col==title:
             out_annotation.write('INSERT INTO _ermrest.model_column_annotation VALUES(\'%s\', \'%s\', \'%s\', \'comment\', \'["title"]\');\n' % (options.schema, table, col))
-        if col not in tablesReferences.keys() or table not in tablesReferences[col]:
+        if not tablesSchema.isReference(col, table):
             col_type = 'text'
-            if table in columnTypes.keys() and col in columnTypes[table].keys():
+            if table in columnTypes and col in columnTypes[table]:
                 col_type = columnTypes[table][col]
             out.write(',\n\t"%s" %s' % (col, col_type))
-    if table in tablesReferences.keys():
+    if table in tablesReferences:
         for col in tablesReferences[table]:
             out.write(',\n\t"%s_id" integer' % col)
         for col in tablesReferences[table]:
@@ -233,83 +154,79 @@ def create_sql_table(table):
     out.write('\n);\n\n')
 
 
-"""
-Get the set of columns and values for a row to be inserted into the table
-"""
-def getRow(data):
-    ret={}
-    ret['columns']=[]
-    ret['values']=[]
-    for column,value in data.items():
-        ret['columns'].append('"%s"' % column)
-        if isinstance(value,basestring):
-            value = value.replace("'","''")
-        ret['values'].append("'%s'" % value)
-    ret['columns'] = ','.join(ret['columns'])
-    ret['values'] = ','.join(ret['values'])
-    return ret
-    
 """
 Insert the data for a table
 """
 def insert_sql_data(table):
-    if table in tablesData.keys():
-        for data in tablesData[table]['data']:
-            columns=getRow(data)['columns']
-            values=getRow(data)['values']
-            out.write(('INSERT INTO %s."%s" (%s) VALUES(%s);\n' % (schema,table,columns,values)).encode('utf8'))
+    if table in tablesData:
+        store = tablesData[table]['data']
+        if options.format == 'copy':
+            writeCopy(out, schema, table, getColumns(tablesSchema, table), store)
+        elif options.batch_size > 1:
+            writeBatchedInserts(out, schema, table, store, options.batch_size)
+        else:
+            writeInserts(out, schema, table, store)
     out.write('\n\n')
 
 
 """
-Populate the data structures for the SQL data
+Create a table in the SQLite database and load its data
 """
-def load_file_data(f, elem, parent, parent_obj):
-    obj = {}
-    hasAttributes = len(elem.attrib.keys()) > 0
-    if hasAttributes or len(elem)>0:
-        if elem.tag not in tablesData.keys():
-            tablesData[elem.tag] = {}
-            tablesData[elem.tag]['id'] = 0
-            tablesData[elem.tag]['data'] = []
-        tablesData[elem.tag]['id'] = tablesData[elem.tag]['id']+1
-        tablesData[elem.tag]['data'].append(obj)
-        obj['id'] = tablesData[elem.tag]['id']
-        if parent!=None and elem.tag in tablesReferences.keys() and parent.tag in tablesReferences[elem.tag]:
-            col = '%s_id' % parent.tag
-            obj[col] = tablesData[parent.tag]['id']
-    if hasAttributes:
-        for attr,value in elem.attrib.items():
-            attrib = '@%s' % attr
-            obj[attrib] = value
-            
-    if len(elem)==0:
-        value = elem.text
-        if value!=None:
-            if isMultiValue(elem, parent):
-                value = getMultiValue(elem, parent)
-            if hasAttributes:
-                obj['#text'] = value
-            else:
-                parent_obj[elem.tag] = value
-    else:
-        for child in elem:
-            load_file_data(f, child, elem, obj)
-    
+def create_sqlite_table(table):
+    columns = getColumns(tablesSchema, table)
+    database.createTable(table, columns, columnTypes.get(table, {}), tablesReferences.get(table, []))
+    if table in tablesData:
+        metrics.table(table, database.insertRows(table, columns, tablesData[table]['data']), 0)
+
 files=os.listdir(options.input)     
 
-def process_XML_file(f):
+"""
+Count the elements of a parsed XML file, when the metrics are enabled
+"""
+def countElements(root):
+    if not metrics.enabled:
+        return 0
+    return sum([1 for elem in root.iter()])
+
+"""
+Get the events of a parsed XML file
+"""
+def get_events(root):
+    try:
+        return reader.events(root)
+    except InputError as e:
+        print e
+        sys.exit(1)
+
+"""
+Get the events of an XML file
+"""
+def read_XML_file(f):
     tree = ET.parse('%s/%s' % (options.input, f))
-    root = tree.getroot()
-    process_file(f, root, None)
+    return get_events(tree.getroot())
 
+metrics.start('inference')
 for f in files:  
-    process_XML_file(f) 
-
+    start = time.time()
+    if cache != None:
+        cache.infer(engine, f, lambda: read_XML_file(f))
+    else:
+        engine.infer(read_XML_file(f))
+    metrics.fileParsed(f, time.time() - start)
+engine.flush()
+if cache != None:
+    cache.save()
+    metrics.count('cached_files', cache.hits)
+metrics.stop('inference')
+
+metrics.start('data')
 for f in files:  
+    start = time.time()
     tree = ET.parse('%s/%s' % (options.input, f))
     root = tree.getroot()
-    load_file_data(f, root, None, None) 
+    engine.load(get_events(root))
+    metrics.fileParsed(f, time.time() - start, countElements(root))
+metrics.stop('data')
     
 sortTablesDefinitions()
 
@@ -330,6 +247,16 @@ print json.dumps(columnTypes, indent=4)
 
 """
 
+if options.format == 'sqlite':
+    metrics.start('sql')
+    for table in tablesSortedNames:
+        create_sqlite_table(table)
+    database.close()
+    metrics.count('bytes', os.path.getsize(options.output))
+    metrics.stop('sql')
+    metrics.write()
+    sys.exit(0)
+
 out_annotation.write('BEGIN;\n\n')
 out_annotation.write('DELETE FROM _ermrest.model_table_annotation where schema_name=\'%s\';\n' % options.schema)
 out_annotation.write('DELETE FROM _ermrest.model_column_annotation where schema_name=\'%s\';\n\n' % options.schema)
@@ -338,15 +265,21 @@ out.write('BEGIN;\n\n')
 out.write('DROP SCHEMA %s CASCADE;\n\n' % schema)
 out.write('CREATE SCHEMA %s;\n\n' % schema)
 
+metrics.start('sql')
 for table in tablesSortedNames:
     create_sql_table(table)
     
 for table in tablesSortedNames:
+    position = out.tell()
     insert_sql_data(table)
+    if table in tablesData:
+        metrics.table(table, len(tablesData[table]['data']), out.tell() - position)
     
 out.write('COMMIT;\n\n')
 out.close()
 out_annotation.write('COMMIT;\n\n')
 out_annotation.close()
+metrics.stop('sql')
+metrics.write()
 sys.exit(0)
 
@@ -12,13 +12,22 @@ Parameters:
     - tag: the node tag where the attribute will be inserted
     - attribute: the name of the thumbnail attribute
     - output: the directory where the resulted XML files will be placed
+    - stream: copy the parsing events of each XML file to the output file, adding
+      the attribute to the start of the tag elements, instead of loading the whole tree
+      (the attributes keep their order, the empty elements are not self-closed, the
+      comments are copied and the tag is matched against the element names as they are
+      written, with their namespace prefix)
+    - workers: the number of processes rewriting the XML files in parallel
     
 """
 
 import sys
 import os
 from optparse import OptionParser
+from multiprocessing import Pool
 import xml.etree.ElementTree as ET
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
 
 parser = OptionParser()
 parser.header = {}
@@ -28,6 +37,8 @@ parser.add_option('-u', '--url', action='store', dest='url', type='string', help
 parser.add_option('-p', '--thumbnail', action='store', dest='thumbnail', type='string', help='Directory for thumbnails')
 parser.add_option('-t', '--tag', action='store', dest='tag', type='string', help='XML tag for thumbnails')
 parser.add_option('-a', '--attribute', action='store', dest='attribute', type='string', help='XML attribute for thumbnails')
+parser.add_option('--stream', action='store_true', dest='stream', default=False, help='Rewrite the XML files while parsing them')
+parser.add_option('-w', '--workers', action='store', dest='workers', type='int', default=1, help='Number of parallel XML rewriting processes')
 
 (options, args) = parser.parse_args()
 
@@ -39,6 +50,15 @@ if not options.output:
     print 'ERROR: Missing output directory'
     sys.exit()
     
+if options.workers < 1:
+    print 'ERROR: The number of workers must be a positive integer'
+    sys.exit(1)
+    
+"""
+The number of pieces of text buffered by the stream writer before they are written
+"""
+BUFFER_SIZE = 4096
+
 thumbnails = {}
 thumbnail_url = ''
 thumbnail_tag = ''
@@ -62,34 +82,130 @@ def get_file_name(file):
 files=os.listdir(options.input)     
 
 """
-Process recursively the XML elements,
-adding the thumbnail attribute
+Get the thumbnail attribute value of an XML file
+"""
+def get_thumbnail(file):
+    return '%s/%s' % (thumbnail_url, thumbnails.get(get_file_name(file), 'blank.png'))
+
+"""
+Add the thumbnail attribute to the XML elements with the thumbnail tag
 """
-def process_element(elem, file):
-    for child in elem:
-        process_element(child, file)
-    if elem.tag==thumbnail_tag:
-        filename = get_file_name(file)
-        if filename in thumbnails.keys():
-            elem.set(thumbnail_attribute, '%s/%s' % (thumbnail_url, thumbnails[filename]))
-        else:
-            elem.set(thumbnail_attribute, '%s/%s' % (thumbnail_url, 'blank.png'))
+def process_element(elem, thumbnail):
+    for child in elem.iter(thumbnail_tag):
+        child.set(thumbnail_attribute, thumbnail)
     
 """
 Process each XML file
 """
 def process_file(f):
+    if options.stream:
+        stream_file(f)
+        return
     tree = ET.parse('%s/%s' % (options.input, f))
     root = tree.getroot()
-    process_element(root, f)
+    process_element(root, get_thumbnail(f))
     tree.write('%s/%s' % (options.output, f), encoding='UTF-8')
     
+"""
+Writer of the parsing events of an XML file,
+adding the thumbnail attribute to the start of the elements with the thumbnail tag
+"""
+class ThumbnailWriter (object):
+    
+    def __init__(self, out, thumbnail):
+        self.out = out
+        self.thumbnail = thumbnail
+        self.parts = []
+        
+    """
+    Write the XML declaration
+    """
+    def startDocument(self):
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        
+    """
+    Write the start of an element, from its attributes as a flat list of names and values
+    """
+    def startElement(self, name, attributes):
+        parts = self.parts
+        parts.append(u'<' + name)
+        thumbnail = name == thumbnail_tag
+        for i in xrange(0, len(attributes), 2):
+            value = attributes[i + 1]
+            if thumbnail and attributes[i] == thumbnail_attribute:
+                value = self.thumbnail
+                thumbnail = False
+            parts.append(u' %s=%s' % (attributes[i], quoteattr(value)))
+        if thumbnail:
+            parts.append(u' %s=%s' % (thumbnail_attribute, quoteattr(self.thumbnail)))
+        parts.append(u'>')
+        if len(parts) >= BUFFER_SIZE:
+            self.flush()
+        
+    """
+    Write the end of an element
+    """
+    def endElement(self, name):
+        self.parts.append(u'</%s>' % name)
+        
+    """
+    Write a text
+    """
+    def characters(self, data):
+        self.parts.append(escape(data))
+        
+    """
+    Write a processing instruction
+    """
+    def processingInstruction(self, target, data):
+        self.parts.append(u'<?%s %s?>' % (target, data))
+        
+    """
+    Write a comment
+    """
+    def comment(self, data):
+        self.parts.append(u'<!--%s-->' % data)
+        
+    """
+    Write the buffered pieces of text
+    """
+    def flush(self):
+        self.out.write(u''.join(self.parts).encode('utf8'))
+        del self.parts[:]
+    
+"""
+Rewrite an XML file while parsing it
+"""
+def stream_file(f):
+    input = open('%s/%s' % (options.input, f), 'rb')
+    out = open('%s/%s' % (options.output, f), 'wb')
+    writer = ThumbnailWriter(out, get_thumbnail(f))
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = writer.startElement
+    parser.EndElementHandler = writer.endElement
+    parser.CharacterDataHandler = writer.characters
+    parser.ProcessingInstructionHandler = writer.processingInstruction
+    parser.CommentHandler = writer.comment
+    writer.startDocument()
+    parser.ParseFile(input)
+    writer.flush()
+    out.close()
+    input.close()
+    
 if options.thumbnail:
     for f in os.listdir(options.thumbnail):
         thumbnails[get_file_name(f)] = f
 
-for f in files:  
-    process_file(f) 
+if options.workers > 1:
+    pool = Pool(options.workers)
+    pool.map(process_file, files, max(1, len(files) / (options.workers * 4)))
+    pool.close()
+    pool.join()
+else:
+    for f in files:  
+        process_file(f) 
 
 sys.exit(0)
     
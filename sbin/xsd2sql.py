@@ -20,6 +20,7 @@ import os
 from optparse import OptionParser
 import xml.etree.ElementTree as ET
 import json
+from multicelldb.ordering import sortTables, CycleError
 
 parser = OptionParser()
 parser.header = {}
@@ -226,20 +227,14 @@ def create_sql_table(table, out, out_annotation):
 
 
 def sortTablesDefinitions():
-    sorted = False
-    while not sorted:
-        sorted = True
-        for table in tables:
-            if table not in tablesSortedNames:
-                resolved = True
-                for col,value in tablesDefinitions[table].iteritems():
-                    if value in tables and value not in tablesSortedNames and value!=table:
-                        resolved = False
-                        break
-                if resolved:
-                    tablesSortedNames.append(table)
-                else:
-                    sorted = False
+    references = {}
+    for table in tables:
+        references[table] = tablesDefinitions[table].values()
+    try:
+        tablesSortedNames.extend(sortTables(tables, references))
+    except CycleError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
                         
 xsd_files.append(xsd_root)
 ready=False
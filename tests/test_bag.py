@@ -0,0 +1,91 @@
+"""
+Tests of the BagIt bag and of its zip archive
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin'))
+
+import multicelldb.bag
+from multicelldb.bag import BagWriter
+
+class BagWriterTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bag')
+        self.zip = os.path.join(self.directory, 'bag.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    """
+    Write a bag with two payload files open at the same time, and close it
+    """
+    def makeBag(self, compression):
+        bag = BagWriter(self.path, ['md5', 'sha1'], self.zip, compression)
+        a = bag.open('a.csv')
+        b = bag.open('b.csv')
+        a.write('id,x\n')
+        b.write('id\n1\n')
+        a.write('1,"%s"\n' % ('x' * 100000))
+        b.close()
+        a.close()
+        bag.finish({'Contact-Name': 'test'})
+        bag.close()
+
+    """
+    Check the zip archive of a bag against the files of the bag
+    """
+    def checkZip(self, compression):
+        zf = zipfile.ZipFile(self.zip)
+        self.assertEqual(zf.testzip(), None)
+        names = zf.namelist()
+        self.assertEqual(sorted(names), ['bag-info.txt', 'bagit.txt', 'data/a.csv', 'data/b.csv', 'manifest-md5.txt', 'manifest-sha1.txt', 'tagmanifest-md5.txt', 'tagmanifest-sha1.txt'])
+        # a.csv is zipped while it is written, b.csv (opened meanwhile) from the disk at the end
+        self.assertEqual((names[0], names[-1]), ('data/a.csv', 'data/b.csv'))
+        for name in names:
+            f = open(os.path.join(self.path, name), 'rb')
+            self.assertEqual(zf.read(name), f.read())
+            f.close()
+        self.assertEqual(zf.getinfo('data/a.csv').compress_type, zipfile.ZIP_STORED if compression == None else zipfile.ZIP_DEFLATED)
+        zf.close()
+
+    def testZip(self):
+        for compression in [None, 0, 1, 9]:
+            self.makeBag(compression)
+            self.checkZip(compression)
+            shutil.rmtree(self.path)
+
+    """
+    Lower the ZIP64 limits, so that the central directory has the ZIP64 records
+    """
+    def testZip64(self):
+        limits = multicelldb.bag.ZIP64_LIMIT, multicelldb.bag.ZIP_FILECOUNT_LIMIT
+        multicelldb.bag.ZIP64_LIMIT, multicelldb.bag.ZIP_FILECOUNT_LIMIT = 1000, 4
+        try:
+            self.makeBag(6)
+        finally:
+            multicelldb.bag.ZIP64_LIMIT, multicelldb.bag.ZIP_FILECOUNT_LIMIT = limits
+        self.checkZip(6)
+
+    def testManifest(self):
+        self.makeBag(None)
+        f = open(os.path.join(self.path, 'manifest-sha1.txt'))
+        lines = f.read().splitlines()
+        f.close()
+        for line in lines:
+            checksum,name = line.split('  ')
+            f = open(os.path.join(self.path, name), 'rb')
+            self.assertEqual(checksum, hashlib.sha1(f.read()).hexdigest())
+            f.close()
+        self.assertEqual([line.split('  ')[1] for line in lines], ['data/a.csv', 'data/b.csv'])
+
+if __name__ == '__main__':
+    unittest.main()
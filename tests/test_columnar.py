@@ -0,0 +1,38 @@
+"""
+Tests of the columnar output of the tables; they require the pyarrow package
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin'))
+
+from multicelldb.store import ColumnStore
+from multicelldb.columnar import available, ColumnarWriter
+
+@unittest.skipUnless(available(), 'pyarrow is not installed')
+class ColumnarWriterTest (unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def testOverflow(self):
+        import pyarrow.parquet
+        store = ColumnStore()
+        store.append({'id': 1, 'small': '40000', 'large': '99999999999999999999', 'number': '-5'})
+        store.append({'id': 2, 'small': '1', 'large': '1', 'number': '7'})
+        columnTypes = {'small': 'int2', 'large': 'int8', 'number': 'int4'}
+        path = ColumnarWriter(self.output).write('a', ['id', 'small', 'large', 'number'], columnTypes, [], store)
+        data = pyarrow.parquet.read_table(path).to_pydict()
+        self.assertEqual(list(data['small']), ['40000', '1'])
+        self.assertEqual(list(data['large']), ['99999999999999999999', '1'])
+        self.assertEqual(list(data['number']), [-5, 7])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests of the streaming writer of the CSV files
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+SBIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin')
+sys.path.insert(0, SBIN)
+
+from multicelldb.csvstream import csvValue, CSVStream, discardStreams
+
+class CSVStreamTest (unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.spillDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.output, 'a.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.spillDir)
+
+    def testSpill(self):
+        stream = CSVStream(self.path, csvValue, lambda: None, spillDir=self.spillDir)
+        first = stream.reserve()
+        stream.append({'id': 2, 'b': u'y'})
+        self.assertEqual(os.listdir(self.output), [])
+        stream.fill(first, {'id': 1, 'a': u'x'})
+        self.assertEqual(len(os.listdir(self.spillDir)), 1)
+        stream.close(['id', 'a', 'b'])
+        self.assertEqual(os.listdir(self.output), ['a.csv'])
+        self.assertEqual(os.listdir(self.spillDir), [])
+        f = open(self.path)
+        self.assertEqual(f.read(), 'id,a,b\n1,"x",\n2,,"y"\n')
+        f.close()
+
+    def testSpillRemovedOnError(self):
+        stream = CSVStream(self.path, csvValue, lambda: None, spillDir=self.spillDir)
+        stream.append({'id': 1, 'a': u'x'})
+        stream.reserve()
+        stream.append({'id': 3, 'a': u'z'})
+        self.assertRaises(RuntimeError, stream.close, ['id', 'a'])
+        self.assertEqual(os.listdir(self.spillDir), [])
+        self.assertEqual(os.listdir(self.output), [])
+
+    def testDiscarded(self):
+        stream = CSVStream(self.path, csvValue, lambda: None, spillDir=self.spillDir)
+        stream.append({'id': 1, 'a': u'x'})
+        stream.close(None)
+        self.assertEqual(os.listdir(self.spillDir), [])
+        self.assertEqual(os.listdir(self.output), [])
+
+    def testDiscardStreams(self):
+        written = CSVStream(self.path, csvValue, lambda: ['id', 'a'], spillDir=self.spillDir)
+        written.append({'id': 1, 'a': u'x'})
+        spilled = CSVStream(os.path.join(self.output, 'b.csv'), csvValue, lambda: None, spillDir=self.spillDir)
+        spilled.reserve()
+        spilled.append({'id': 2, 'b': u'y'})
+        discardStreams({'a': {'id': 1, 'data': written}, 'b': {'id': 2, 'data': spilled}})
+        self.assertEqual(os.listdir(self.output), [])
+        self.assertEqual(os.listdir(self.spillDir), [])
+
+    """
+    Run json2csv in a single pass on references forming a cycle: it fails,
+    without leaving spill files in the temporary directory or CSV files
+    """
+    def testCycle(self):
+        input = os.path.join(self.spillDir, 'input')
+        os.mkdir(input)
+        f = open(os.path.join(input, 'cycle.json'), 'w')
+        json.dump({'x': [{'a': str(i), 'q': {'b': 'y', 'x': {'a': 'z'}}} for i in range(100)]}, f)
+        f.close()
+        temp = os.path.join(self.spillDir, 'temp')
+        os.mkdir(temp)
+        env = dict(os.environ, TMPDIR=temp)
+        process = subprocess.Popen([sys.executable, os.path.join(SBIN, 'json2csv.py'), '--single-pass', '-i', input, '-o', self.output], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out,err = process.communicate()
+        self.assertEqual(process.returncode, 1)
+        self.assertIn('cycle', err)
+        self.assertEqual(os.listdir(temp), [])
+        self.assertEqual(os.listdir(self.output), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+"""
+Tests of the inference of the SQL types of the columns
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin'))
+
+from multicelldb.inference import widen, valueType, batchType
+
+class InferenceTest (unittest.TestCase):
+
+    def testTimestamps(self):
+        for value in ['2016-01-31', '2016-02-29T12:30', '2016-12-31 23:59:59.5', '2016-06-01T08:00:00+02:00', '2016-06-01T08:00Z']:
+            self.assertEqual(valueType(value), 'timestamptz', value)
+
+    def testInvalidTimestamps(self):
+        for value in ['2016-13-45', '1234-56-78T99:99', '2015-02-29', '2016-01-01T24:00', '2016-01-01T10:60', '2016-01-01T10:00+16:00', '0000-01-01']:
+            self.assertEqual(valueType(value), 'text', value)
+        self.assertEqual(batchType(['2016-01-01', '2016-13-45']), 'text')
+
+    def testIntegers(self):
+        self.assertEqual(batchType(['1', '-32768', '32767']), 'int2')
+        self.assertEqual(batchType(['1', '32768']), 'int4')
+        self.assertEqual(batchType(['1', str(2**31)]), 'int8')
+        self.assertEqual(batchType(['1', '99999999999999999999']), 'numeric')
+        self.assertEqual(valueType('-99999999999999999999'), 'numeric')
+
+    def testWiden(self):
+        self.assertEqual(widen('int2', 'int8'), 'int8')
+        self.assertEqual(widen('int4', 'float8'), 'float8')
+        self.assertEqual(widen('int8', 'numeric'), 'numeric')
+        self.assertEqual(widen('numeric', 'int2'), 'numeric')
+        self.assertEqual(widen('numeric', 'float8'), 'text')
+        self.assertEqual(widen('numeric', 'boolean'), 'text')
+        self.assertEqual(batchType(['1.5', '99999999999999999999']), 'text')
+
+if __name__ == '__main__':
+    unittest.main()
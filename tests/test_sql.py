@@ -0,0 +1,80 @@
+"""
+Tests of the SQL statements loading the rows of the tables
+"""
+
+import os
+import re
+import sys
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin'))
+
+from multicelldb.store import ColumnStore
+from multicelldb.sql import writeInserts, writeBatchedInserts
+
+"""
+Rows of a self-referencing table "a" with different columns: the rows 1 and 4
+have no parent row in "a", the rows 8 and 9 reference the row 7
+"""
+ROWS = [
+    {'id': 1, 'name': 'x'},
+    {'id': 2, 'a_id': 1},
+    {'id': 3, 'a_id': 1, 'name': 'y'},
+    {'id': 4, 'name': 'z'},
+    {'id': 5, 'a_id': 4},
+    {'id': 6, 'a_id': 4},
+    {'id': 7, 'a_id': 6, 'name': 'w'},
+    {'id': 8, 'a_id': 7},
+    {'id': 9, 'a_id': 7},
+]
+
+"""
+Get the ids and the referenced ids of the inserted rows, in the order of the statements
+"""
+def insertedIds(sql):
+    ids = []
+    for statement in sql.split(';\n'):
+        match = re.match(r'INSERT INTO ms\."a" \((.*)\) VALUES\s*(.*)', statement, re.S)
+        if match == None:
+            continue
+        columns = match.group(1).split(',')
+        for values in re.findall(r'\(([^)]*)\)', match.group(2)):
+            row = dict(zip(columns, [value.strip("'") for value in values.split(',')]))
+            ids.append((int(row['"id"']), int(row['"a_id"']) if '"a_id"' in row else None))
+    return ids
+
+class BatchedInsertsTest (unittest.TestCase):
+
+    def setUp(self):
+        self.store = ColumnStore(['id', 'name', 'a_id'])
+        for row in ROWS:
+            self.store.append(row)
+
+    def testSelfReferenceOrder(self):
+        out = StringIO()
+        writeBatchedInserts(out, 'ms', 'a', self.store, 2)
+        ids = insertedIds(out.getvalue())
+        self.assertEqual([row for row,parent in ids], range(1, len(ROWS) + 1))
+        inserted = set()
+        for row,parent in ids:
+            if parent != None:
+                self.assertIn(parent, inserted)
+            inserted.add(row)
+
+    def testBatchSize(self):
+        out = StringIO()
+        writeBatchedInserts(out, 'ms', 'a', self.store, 2)
+        for statement in out.getvalue().split(';\n')[:-1]:
+            self.assertLessEqual(len(re.findall(r'^\(', statement, re.M)), 2)
+
+    def testSameRowsAsInserts(self):
+        single = StringIO()
+        writeInserts(single, 'ms', 'a', self.store)
+        for batchSize in [1, 2, 3, 100]:
+            out = StringIO()
+            writeBatchedInserts(out, 'ms', 'a', self.store, batchSize)
+            self.assertEqual(insertedIds(out.getvalue()), insertedIds(single.getvalue()))
+
+if __name__ == '__main__':
+    unittest.main()
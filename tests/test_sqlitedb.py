@@ -0,0 +1,65 @@
+"""
+Tests of the SQLite database of the tables
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbin'))
+
+from multicelldb.store import ColumnStore
+from multicelldb.sqlitedb import SQLiteDatabase
+
+"""
+Create a table and insert its rows
+"""
+def loadTable(database, table, columns, columnTypes, references, rows):
+    store = ColumnStore(columns)
+    for row in rows:
+        store.append(row)
+    database.createTable(table, columns, columnTypes, references)
+    database.insertRows(table, columns, store)
+
+class SQLiteDatabaseTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testRenamedTables(self):
+        database = SQLiteDatabase(self.path)
+        loadTable(database, 'Cell', ['id', 'name'], {}, [], [{'id': 1, 'name': 'x'}, {'id': 2, 'name': 'y'}])
+        loadTable(database, 'cell', ['id', 'value', 'Cell_id'], {'value': 'int4'}, ['Cell'], [{'id': 1, 'value': '5', 'Cell_id': 2}])
+        loadTable(database, 'CELL', ['id', 'CELL_id'], {}, ['CELL'], [{'id': 1}, {'id': 2, 'CELL_id': 1}])
+        database.close()
+        connection = sqlite3.connect(self.path)
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        self.assertEqual(tables, ['CELL__', 'Cell', 'cell_'])
+        self.assertEqual(connection.execute('SELECT name FROM "Cell" ORDER BY id').fetchall(), [(u'x',), (u'y',)])
+        self.assertEqual(connection.execute('SELECT value, Cell_id FROM "cell_"').fetchall(), [(5, 2)])
+        self.assertEqual(connection.execute('PRAGMA foreign_key_list("cell_")').fetchone()[2], u'Cell')
+        self.assertEqual(connection.execute('PRAGMA foreign_key_list("CELL__")').fetchone()[2], u'CELL__')
+        self.assertEqual(connection.execute('SELECT "CELL_id" FROM "CELL__" ORDER BY id').fetchall(), [(None,), (1,)])
+        connection.close()
+
+    def testRenamedIndexes(self):
+        database = SQLiteDatabase(self.path)
+        loadTable(database, 'c', ['id'], {}, [], [{'id': 1}])
+        loadTable(database, 'b_c', ['id'], {}, [], [{'id': 1}])
+        loadTable(database, 'a_b', ['id', 'c_id'], {}, ['c'], [{'id': 1, 'c_id': 1}])
+        loadTable(database, 'a', ['id', 'b_c_id'], {}, ['b_c'], [{'id': 1, 'b_c_id': 1}])
+        database.close()
+        connection = sqlite3.connect(self.path)
+        indexes = connection.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' ORDER BY name").fetchall()
+        self.assertEqual(indexes, [(u'a_b_c_id_idx', u'a_b'), (u'a_b_c_id_idx_', u'a')])
+        connection.close()
+
+if __name__ == '__main__':
+    unittest.main()